@@ -16,6 +16,11 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Tuple
 import statistics
 
+from timeseries import TimeSeries
+
+# Columnas de las series de NDVI de get_ndvi_history
+NDVI_COLUMNS = ('mean', 'std', 'min', 'max')
+
 class AgroAnalyzer:
     """Analizador de datos agrícolas con predicciones básicas"""
     
@@ -42,8 +47,110 @@ class AgroAnalyzer:
         response = requests.get(url)
         return response.json()
     
-    def get_ndvi_history(self, days: int = 30) -> List[Dict]:
-        """Obtiene histórico de NDVI"""
+    def get_rollups(self, table: str, days: int, resolution: str = 'day') -> TimeSeries:
+        """
+        Agregados por hora/día desde la base de datos (observation_rollups)
+        
+        Returns:
+            TimeSeries con columnas '<variable>_count', '_min', '_max' y
+            '_mean'; vacía si no hay conexión a la BD
+        """
+        try:
+            from db_config import get_connection
+            conn = get_connection()
+        except Exception:
+            return TimeSeries(())
+        if not conn:
+            return TimeSeries(())
+        
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT bucket, variable, sample_count, min_value, max_value, sum_value
+                FROM observation_rollups
+                WHERE polygon_id = %s AND table_name = %s AND resolution = %s
+                  AND bucket >= NOW() - %s * INTERVAL '1 day'
+                ORDER BY bucket
+            """, (self.polygon_id, table, resolution, days))
+            rows = cur.fetchall()
+            cur.close()
+        except Exception:
+            return TimeSeries(())
+        finally:
+            conn.close()
+        
+        variables = sorted({row[1] for row in rows})
+        series = TimeSeries(f'{variable}_{stat}' for variable in variables
+                            for stat in ('count', 'min', 'max', 'mean'))
+        current, values = None, {}
+        for bucket, variable, count, min_value, max_value, sum_value in rows:
+            if bucket != current:
+                if values:
+                    series.append(current, values)
+                current, values = bucket, {}
+            values[f'{variable}_count'] = count
+            values[f'{variable}_min'] = min_value
+            values[f'{variable}_max'] = max_value
+            values[f'{variable}_mean'] = sum_value / count if count else None
+        if values:
+            series.append(current, values)
+        return series
+    
+    def get_ndvi_composites(self, days: int, method: str = 'max') -> TimeSeries:
+        """
+        Compuestos NDVI multi-escena del polígono completo (ver ndvi_zones.py)
+        
+        Returns:
+            TimeSeries como la de get_ndvi_history; vacía si no hay conexión
+            a la BD o compuestos
+        """
+        try:
+            from db_config import get_connection
+            conn = get_connection()
+        except Exception:
+            return TimeSeries(NDVI_COLUMNS)
+        if not conn:
+            return TimeSeries(NDVI_COLUMNS)
+        
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT window_end, mean_value, std_value, min_value, max_value
+                FROM ndvi_composite_stats
+                WHERE polygon_id = %s AND zone = 'total' AND index_name = 'ndvi'
+                  AND method = %s AND window_end >= NOW() - %s * INTERVAL '1 day'
+                ORDER BY window_end
+            """, (self.polygon_id, method, days))
+            rows = cur.fetchall()
+            cur.close()
+        except Exception:
+            return TimeSeries(NDVI_COLUMNS)
+        finally:
+            conn.close()
+        
+        series = TimeSeries(NDVI_COLUMNS)
+        for date, mean, std, min_value, max_value in rows:
+            series.append(date, {'mean': mean, 'std': std, 'min': min_value, 'max': max_value})
+        # Compuestos sin píxeles válidos (todo nubes) no tienen media
+        return series.dropna('mean')
+    
+    def get_ndvi_history(self, days: int = 30) -> TimeSeries:
+        """
+        Obtiene histórico de NDVI: compuestos sin nubes, agregados diarios de
+        la BD o, sin BD, las escenas con poca nubosidad del API
+        
+        Returns:
+            TimeSeries con columnas mean, std, min y max (iterarla da dicts
+            {'date', 'mean', 'std', 'min', 'max'})
+        """
+        composites = self.get_ndvi_composites(days)
+        if composites:
+            return composites
+        
+        rollups = self.get_rollups('ndvi_data', days)
+        if rollups:
+            return self._ndvi_history_from_rollups(rollups)
+        
         end = int(datetime.now().timestamp())
         start = int((datetime.now() - timedelta(days=days)).timestamp())
         
@@ -51,8 +158,12 @@ class AgroAnalyzer:
         response = requests.get(url)
         images = response.json()
         
+        from agro_data_collector import MAX_CLOUD_COVERAGE
+        
         ndvi_data = []
         for image in images:
+            if image.get('cl', 0) > MAX_CLOUD_COVERAGE:
+                continue
             if 'ndvi' in image.get('stats', {}):
                 try:
                     stats_url = image['stats']['ndvi']
@@ -60,7 +171,7 @@ class AgroAnalyzer:
                     stats = stats_response.json()
                     
                     ndvi_data.append({
-                        'date': datetime.fromtimestamp(image['dt']),
+                        'date': image['dt'],
                         'mean': stats.get('mean', 0),
                         'std': stats.get('std', 0),
                         'min': stats.get('min', 0),
@@ -69,7 +180,31 @@ class AgroAnalyzer:
                 except:
                     continue
         
-        return sorted(ndvi_data, key=lambda x: x['date'])
+        return TimeSeries.from_records(ndvi_data, NDVI_COLUMNS)
+    
+    @staticmethod
+    def _ndvi_history_from_rollups(rollups: TimeSeries) -> TimeSeries:
+        """
+        Convierte los agregados diarios al formato de get_ndvi_history. Los
+        datos guardados antes de las claves naturales repiten la última
+        imagen cada hora, así que se conserva un valor por imagen.
+        """
+        if 'ndvi_mean_mean' not in rollups.columns:
+            return TimeSeries(NDVI_COLUMNS)
+        
+        def column(name):
+            # Variables sin agregado en el día valen 0, como antes
+            if name not in rollups.columns:
+                return [0.0] * len(rollups)
+            return [0.0 if value != value else value for value in rollups[name]]
+        
+        history = TimeSeries(NDVI_COLUMNS, rollups.times, {
+            'mean': rollups['ndvi_mean_mean'],
+            'std': column('ndvi_std_mean'),
+            'min': column('ndvi_min_min'),
+            'max': column('ndvi_max_max')
+        })
+        return history.dropna('mean').dedupe('mean')
     
     def predict_irrigation_need(self) -> Tuple[str, str, float]:
         """
@@ -147,7 +282,8 @@ class AgroAnalyzer:
         Returns:
             Dict con análisis de tendencia
         """
-        history = self.get_ndvi_history(30)
+        # Escenas sin media (NaN) no entran en la regresión
+        history = self.get_ndvi_history(30).dropna('mean')
         
         if len(history) < 2:
             return {
@@ -157,7 +293,7 @@ class AgroAnalyzer:
             }
         
         # Calcular tendencia lineal simple
-        values = [h['mean'] for h in history]
+        values = history['mean']
         n = len(values)
         
         # Pendiente de la recta de regresión
@@ -489,7 +625,7 @@ class AgroAnalyzer:
                     'min': h['min'],
                     'max': h['max']
                 }
-                for h in self.get_ndvi_history()
+                for h in self.get_ndvi_history().dropna('mean')
             ],
             'analysis': {
                 'ndvi_trend': self.analyze_ndvi_trend(),
@@ -527,6 +663,24 @@ def load_config():
         return None
 
 
+def resolve_polygon(key: str) -> Dict:
+    """Polígono del registro (polygon_registry.py) por ID o nombre; None si no está"""
+    try:
+        import polygon_registry
+        from db_config import get_connection
+        conn = get_connection()
+    except Exception:
+        return None
+    if not conn:
+        return None
+    
+    try:
+        return polygon_registry.find(polygon_registry.load_polygons(conn), key)
+    except Exception:
+        return None
+    finally:
+        conn.close()
+
 def safe_print(text):
     """Imprime texto de forma segura reemplazando emojis en Windows"""
     import sys
@@ -578,6 +732,14 @@ def main():
     polygon_id = config['polygon']['id']
     polygon_name = config['polygon']['nombre']
     
+    # Otro polígono de la cuenta por ID o nombre: python agro_analyzer.py "los valles"
+    if len(sys.argv) > 1:
+        polygon = resolve_polygon(sys.argv[1])
+        if not polygon:
+            safe_print(f"[ERROR] Poligono '{sys.argv[1]}' no encontrado en el registro")
+            return
+        polygon_id, polygon_name = polygon['id'], polygon['name']
+    
     if not api_key or not polygon_id:
         safe_print("[ERROR] API Key y Polygon ID son requeridos en polygon_config.json")
         return
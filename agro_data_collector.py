@@ -10,14 +10,25 @@ import requests
 import json
 import csv
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
 
+import raw_archive
+
 # Configuración
 SCRIPT_DIR = Path(__file__).parent
 CONFIG_FILE = SCRIPT_DIR / "polygon_config.json"
 DATA_DIR = SCRIPT_DIR / "data"
 
+# Fuente de los datos (parte de la clave natural en la BD)
+SOURCE = 'agromonitoring'
+
+# Respuestas crudas del API de la ejecución actual (ver raw_archive.py)
+RAW_RESPONSES = []
+
+# Nubosidad máxima (%) de una escena para usar su NDVI
+MAX_CLOUD_COVERAGE = float(os.environ.get('MAX_CLOUD_COVERAGE', 30))
+
 # Crear directorio de datos si no existe
 DATA_DIR.mkdir(exist_ok=True)
 
@@ -57,28 +68,142 @@ def safe_print(text):
     except UnicodeEncodeError:
         print(text.encode('ascii', 'replace').decode('ascii'))
 
+def observation_time(dt=None):
+    """Momento de la observación upstream (`dt`, epoch UTC) en ISO 8601"""
+    if dt is None:
+        return datetime.now(timezone.utc).isoformat()
+    return datetime.fromtimestamp(dt, tz=timezone.utc).isoformat()
+
+def issuance_time():
+    """
+    Emisión del pronóstico: hora UTC de la consulta (el API no informa la
+    corrida del modelo). Truncada a la hora, un reintento dentro de la misma
+    hora actualiza la emisión en vez de crear otra.
+    """
+    return datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+def lead_days(forecast_date, issued_at):
+    """Días de anticipación de un pronóstico ('YYYY-MM-DD') respecto a su emisión"""
+    return (datetime.strptime(forecast_date, '%Y-%m-%d').date() - issued_at.date()).days
+
+def fetch_json(kind, url, polygon_id, api_key):
+    """
+    GET al API. La respuesta cruda (sin la API key) se guarda en
+    RAW_RESPONSES para archivarla al final de la recolección.
+    """
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    RAW_RESPONSES.append(raw_archive.capture(kind, polygon_id, url, response.content, api_key))
+    return response.json()
+
+# ============================================
+# PARSERS (sin red: también los usa raw_archive.py al reprocesar)
+# ============================================
+
+def parse_weather(data):
+    """Fila de weather_data a partir de la respuesta de /weather"""
+    return {
+        'timestamp': observation_time(data.get('dt')),
+        'temperature_c': round(data['main']['temp'] - 273.15, 2),
+        'feels_like_c': round(data['main']['feels_like'] - 273.15, 2),
+        'temp_min_c': round(data['main']['temp_min'] - 273.15, 2),
+        'temp_max_c': round(data['main']['temp_max'] - 273.15, 2),
+        'humidity_percent': data['main']['humidity'],
+        'pressure_hpa': data['main']['pressure'],
+        'wind_speed_ms': data['wind']['speed'],
+        'wind_deg': data['wind'].get('deg', 0),
+        'clouds_percent': data['clouds']['all'],
+        'weather_main': data['weather'][0]['main'],
+        'weather_description': data['weather'][0]['description'],
+        'rain_1h_mm': data.get('rain', {}).get('1h', 0)
+    }
+
+def parse_soil(data):
+    """Fila de soil_data a partir de la respuesta de /soil"""
+    return {
+        'timestamp': observation_time(data.get('dt')),
+        'soil_temp_c': round(data.get('t10', 273.15) - 273.15, 2),
+        'soil_moisture': round(data.get('moisture', 0), 4),
+        'soil_moisture_percent': round(data.get('moisture', 0) * 100, 2)
+    }
+
+def select_image(images, max_cloud=MAX_CLOUD_COVERAGE):
+    """
+    Imagen a usar de la respuesta de /image/search: la más reciente con
+    nubosidad <= max_cloud o, si todas la superan, la menos nublada
+    """
+    if not images:
+        return None
+    clear = [image for image in images if image.get('cl', 0) <= max_cloud]
+    if clear:
+        return max(clear, key=lambda image: image['dt'])
+    return min(images, key=lambda image: (image.get('cl', 0), -image['dt']))
+
+def parse_ndvi(image, ndvi_stats, ndwi_stats):
+    """Fila de ndvi_data a partir de una imagen y sus estadísticas NDVI/NDWI"""
+    return {
+        'timestamp': observation_time(image['dt']),
+        'image_date': observation_time(image['dt']),
+        'ndvi_mean': round(ndvi_stats.get('mean', 0), 4) if ndvi_stats else None,
+        'ndvi_min': round(ndvi_stats.get('min', 0), 4) if ndvi_stats else None,
+        'ndvi_max': round(ndvi_stats.get('max', 0), 4) if ndvi_stats else None,
+        'ndvi_std': round(ndvi_stats.get('std', 0), 4) if ndvi_stats else None,
+        'ndwi_mean': round(ndwi_stats.get('mean', 0), 4) if ndwi_stats else None,
+        'cloud_coverage': image.get('cl', 0)
+    }
+
+def parse_forecast(data, issued_at):
+    """Resumen diario (días UTC) de la respuesta de /weather/forecast"""
+    daily_forecast = {}
+    total_precip = 0
+    
+    for item in data:
+        date = datetime.fromtimestamp(item['dt'], tz=timezone.utc)
+        day_key = date.strftime('%Y-%m-%d')
+        
+        if day_key not in daily_forecast:
+            daily_forecast[day_key] = {
+                'temps': [],
+                'precip': 0,
+                'humidity': []
+            }
+        
+        daily_forecast[day_key]['temps'].append(item['main']['temp'] - 273.15)
+        daily_forecast[day_key]['humidity'].append(item['main']['humidity'])
+        
+        if 'rain' in item and '3h' in item['rain']:
+            daily_forecast[day_key]['precip'] += item['rain']['3h']
+            total_precip += item['rain']['3h']
+    
+    # Calcular resumen
+    forecast_summary = []
+    for day, values in list(daily_forecast.items())[:5]:
+        forecast_summary.append({
+            'date': day,
+            'issued_at': issued_at.isoformat(),
+            'lead_days': lead_days(day, issued_at),
+            'temp_min': round(min(values['temps']), 1),
+            'temp_max': round(max(values['temps']), 1),
+            'temp_avg': round(sum(values['temps']) / len(values['temps']), 1),
+            'humidity_avg': round(sum(values['humidity']) / len(values['humidity']), 0),
+            'precipitation_mm': round(values['precip'], 1)
+        })
+    
+    return {
+        'timestamp': issued_at.isoformat(),
+        'total_5day_precip_mm': round(total_precip, 1),
+        'daily_forecast': forecast_summary
+    }
+
+# ============================================
+# RECOLECCIÓN
+# ============================================
+
 def get_weather_data(api_key, polygon_id):
     """Obtiene datos del clima actual"""
     url = f"http://api.agromonitoring.com/agro/1.0/weather?polyid={polygon_id}&appid={api_key}"
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            'timestamp': datetime.now().isoformat(),
-            'temperature_c': round(data['main']['temp'] - 273.15, 2),
-            'feels_like_c': round(data['main']['feels_like'] - 273.15, 2),
-            'temp_min_c': round(data['main']['temp_min'] - 273.15, 2),
-            'temp_max_c': round(data['main']['temp_max'] - 273.15, 2),
-            'humidity_percent': data['main']['humidity'],
-            'pressure_hpa': data['main']['pressure'],
-            'wind_speed_ms': data['wind']['speed'],
-            'wind_deg': data['wind'].get('deg', 0),
-            'clouds_percent': data['clouds']['all'],
-            'weather_main': data['weather'][0]['main'],
-            'weather_description': data['weather'][0]['description']
-        }
+        return parse_weather(fetch_json('weather', url, polygon_id, api_key))
     except Exception as e:
         safe_print(f"Error obteniendo clima: {e}")
         return None
@@ -87,16 +212,7 @@ def get_soil_data(api_key, polygon_id):
     """Obtiene datos del suelo"""
     url = f"http://api.agromonitoring.com/agro/1.0/soil?polyid={polygon_id}&appid={api_key}"
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            'timestamp': datetime.now().isoformat(),
-            'soil_temp_c': round(data.get('t10', 273.15) - 273.15, 2),
-            'soil_moisture': round(data.get('moisture', 0), 4),
-            'soil_moisture_percent': round(data.get('moisture', 0) * 100, 2)
-        }
+        return parse_soil(fetch_json('soil', url, polygon_id, api_key))
     except Exception as e:
         safe_print(f"Error obteniendo datos del suelo: {e}")
         return None
@@ -109,35 +225,20 @@ def get_ndvi_data(api_key, polygon_id):
     
     url = f"http://api.agromonitoring.com/agro/1.0/image/search?start={start}&end={end}&polyid={polygon_id}&appid={api_key}"
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        images = response.json()
+        latest_image = select_image(fetch_json('ndvi_search', url, polygon_id, api_key))
         
-        if images and len(images) > 0:
-            latest_image = images[0]
-            
+        if latest_image:
             # Obtener estadísticas NDVI
             ndvi_stats = None
             ndwi_stats = None
             
             if latest_image.get('stats', {}).get('ndvi'):
-                stats_response = requests.get(latest_image['stats']['ndvi'], timeout=30)
-                ndvi_stats = stats_response.json()
+                ndvi_stats = fetch_json('ndvi_stats', latest_image['stats']['ndvi'], polygon_id, api_key)
             
             if latest_image.get('stats', {}).get('ndwi'):
-                stats_response = requests.get(latest_image['stats']['ndwi'], timeout=30)
-                ndwi_stats = stats_response.json()
+                ndwi_stats = fetch_json('ndwi_stats', latest_image['stats']['ndwi'], polygon_id, api_key)
             
-            return {
-                'timestamp': datetime.now().isoformat(),
-                'image_date': datetime.fromtimestamp(latest_image['dt']).isoformat(),
-                'ndvi_mean': round(ndvi_stats.get('mean', 0), 4) if ndvi_stats else None,
-                'ndvi_min': round(ndvi_stats.get('min', 0), 4) if ndvi_stats else None,
-                'ndvi_max': round(ndvi_stats.get('max', 0), 4) if ndvi_stats else None,
-                'ndvi_std': round(ndvi_stats.get('std', 0), 4) if ndvi_stats else None,
-                'ndwi_mean': round(ndwi_stats.get('mean', 0), 4) if ndwi_stats else None,
-                'cloud_coverage': latest_image.get('cl', 0)
-            }
+            return parse_ndvi(latest_image, ndvi_stats, ndwi_stats)
     except Exception as e:
         safe_print(f"Error obteniendo NDVI: {e}")
         return None
@@ -146,49 +247,8 @@ def get_forecast_data(api_key, polygon_id):
     """Obtiene datos del pronóstico"""
     url = f"http://api.agromonitoring.com/agro/1.0/weather/forecast?polyid={polygon_id}&appid={api_key}"
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Procesar pronóstico por día
-        daily_forecast = {}
-        total_precip = 0
-        
-        for item in data:
-            date = datetime.fromtimestamp(item['dt'])
-            day_key = date.strftime('%Y-%m-%d')
-            
-            if day_key not in daily_forecast:
-                daily_forecast[day_key] = {
-                    'temps': [],
-                    'precip': 0,
-                    'humidity': []
-                }
-            
-            daily_forecast[day_key]['temps'].append(item['main']['temp'] - 273.15)
-            daily_forecast[day_key]['humidity'].append(item['main']['humidity'])
-            
-            if 'rain' in item and '3h' in item['rain']:
-                daily_forecast[day_key]['precip'] += item['rain']['3h']
-                total_precip += item['rain']['3h']
-        
-        # Calcular resumen
-        forecast_summary = []
-        for day, values in list(daily_forecast.items())[:5]:
-            forecast_summary.append({
-                'date': day,
-                'temp_min': round(min(values['temps']), 1),
-                'temp_max': round(max(values['temps']), 1),
-                'temp_avg': round(sum(values['temps']) / len(values['temps']), 1),
-                'humidity_avg': round(sum(values['humidity']) / len(values['humidity']), 0),
-                'precipitation_mm': round(values['precip'], 1)
-            })
-        
-        return {
-            'timestamp': datetime.now().isoformat(),
-            'total_5day_precip_mm': round(total_precip, 1),
-            'daily_forecast': forecast_summary
-        }
+        data = fetch_json('forecast', url, polygon_id, api_key)
+        return parse_forecast(data, issuance_time())
     except Exception as e:
         safe_print(f"Error obteniendo pronóstico: {e}")
         return None
@@ -247,6 +307,63 @@ def get_db_connection():
         safe_print(f"   [AVISO] Error conexión BD: {e}")
         return None
 
+def upsert_sql(table, columns, key):
+    """
+    INSERT sobre la clave natural: si la fila ya existe solo se actualiza
+    (renovando created_at) cuando cambió algún valor, así los reintentos y
+    los recolectores simultáneos no generan filas ni versiones nuevas.
+    """
+    values = [c for c in columns if c not in key]
+    return f"""
+        INSERT INTO {table} AS t ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        ON CONFLICT ({', '.join(key)}) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in values)},
+            created_at = NOW()
+        WHERE ({', '.join(f't.{c}' for c in values)})
+            IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in values)})
+    """
+
+WEATHER_COLUMNS = [
+    'polygon_id', 'source', 'timestamp', 'temperature_c', 'feels_like_c',
+    'temp_min_c', 'temp_max_c', 'humidity_percent', 'pressure_hpa',
+    'wind_speed_ms', 'wind_deg', 'clouds_percent', 'weather_main', 'weather_description',
+    'rain_1h_mm'
+]
+SOIL_COLUMNS = [
+    'polygon_id', 'source', 'timestamp', 'soil_temp_c', 'soil_moisture', 'soil_moisture_percent'
+]
+NDVI_COLUMNS = [
+    'polygon_id', 'source', 'timestamp', 'image_date', 'ndvi_mean', 'ndvi_min',
+    'ndvi_max', 'ndvi_std', 'ndwi_mean', 'cloud_coverage'
+]
+FORECAST_COLUMNS = [
+    'polygon_id', 'source', 'forecast_date', 'issued_at', 'lead_days', 'temp_min_c',
+    'temp_max_c', 'temp_avg_c', 'humidity_avg', 'precipitation_mm'
+]
+
+OBSERVATION_KEY = ('polygon_id', 'source', 'timestamp')
+FORECAST_KEY = ('polygon_id', 'source', 'forecast_date', 'issued_at')
+
+def observation_row(data, polygon_id, columns):
+    """Valores para upsert_sql() de una observación (claves = nombres de columna)"""
+    return (polygon_id, SOURCE) + tuple(data.get(c) for c in columns[2:])
+
+def forecast_rows(forecast, polygon_id):
+    """Valores para upsert_sql() de cada día de un pronóstico"""
+    return [(
+        polygon_id,
+        SOURCE,
+        day.get('date'),
+        day.get('issued_at'),
+        day.get('lead_days'),
+        day.get('temp_min'),
+        day.get('temp_max'),
+        day.get('temp_avg'),
+        day.get('humidity_avg'),
+        day.get('precipitation_mm')
+    ) for day in forecast.get('daily_forecast', [])]
+
 def save_weather_to_db(data, polygon_id):
     """Guarda datos del clima en PostgreSQL"""
     conn = get_db_connection()
@@ -255,26 +372,8 @@ def save_weather_to_db(data, polygon_id):
     
     try:
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO weather_data (
-                polygon_id, temperature_c, feels_like_c, temp_min_c, temp_max_c,
-                humidity_percent, pressure_hpa, wind_speed_ms, wind_deg,
-                clouds_percent, weather_main, weather_description
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            polygon_id,
-            data.get('temperature_c'),
-            data.get('feels_like_c'),
-            data.get('temp_min_c'),
-            data.get('temp_max_c'),
-            data.get('humidity_percent'),
-            data.get('pressure_hpa'),
-            data.get('wind_speed_ms'),
-            data.get('wind_deg'),
-            data.get('clouds_percent'),
-            data.get('weather_main'),
-            data.get('weather_description')
-        ))
+        cur.execute(upsert_sql('weather_data', WEATHER_COLUMNS, OBSERVATION_KEY),
+                    observation_row(data, polygon_id, WEATHER_COLUMNS))
         conn.commit()
         cur.close()
         conn.close()
@@ -293,16 +392,8 @@ def save_soil_to_db(data, polygon_id):
     
     try:
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO soil_data (
-                polygon_id, soil_temp_c, soil_moisture, soil_moisture_percent
-            ) VALUES (%s, %s, %s, %s)
-        """, (
-            polygon_id,
-            data.get('soil_temp_c'),
-            data.get('soil_moisture'),
-            data.get('soil_moisture_percent')
-        ))
+        cur.execute(upsert_sql('soil_data', SOIL_COLUMNS, OBSERVATION_KEY),
+                    observation_row(data, polygon_id, SOIL_COLUMNS))
         conn.commit()
         cur.close()
         conn.close()
@@ -321,24 +412,8 @@ def save_ndvi_to_db(data, polygon_id):
     
     try:
         cur = conn.cursor()
-        # Convertir image_date string a timestamp
-        image_date = data.get('image_date')
-        
-        cur.execute("""
-            INSERT INTO ndvi_data (
-                polygon_id, image_date, ndvi_mean, ndvi_min, ndvi_max,
-                ndvi_std, ndwi_mean, cloud_coverage
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            polygon_id,
-            image_date,
-            data.get('ndvi_mean'),
-            data.get('ndvi_min'),
-            data.get('ndvi_max'),
-            data.get('ndvi_std'),
-            data.get('ndwi_mean'),
-            data.get('cloud_coverage')
-        ))
+        cur.execute(upsert_sql('ndvi_data', NDVI_COLUMNS, OBSERVATION_KEY),
+                    observation_row(data, polygon_id, NDVI_COLUMNS))
         conn.commit()
         cur.close()
         conn.close()
@@ -357,24 +432,8 @@ def save_forecast_to_db(forecast_data, polygon_id):
     
     try:
         cur = conn.cursor()
-        
-        for day in forecast_data.get('daily_forecast', []):
-            cur.execute("""
-                INSERT INTO forecast_data (
-                    polygon_id, forecast_date, temp_min_c, temp_max_c,
-                    temp_avg_c, humidity_avg, precipitation_mm
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT DO NOTHING
-            """, (
-                polygon_id,
-                day.get('date'),
-                day.get('temp_min'),
-                day.get('temp_max'),
-                day.get('temp_avg'),
-                day.get('humidity_avg'),
-                day.get('precipitation_mm')
-            ))
-        
+        cur.executemany(upsert_sql('forecast_data', FORECAST_COLUMNS, FORECAST_KEY),
+                        forecast_rows(forecast_data, polygon_id))
         conn.commit()
         cur.close()
         conn.close()
@@ -385,6 +444,56 @@ def save_forecast_to_db(forecast_data, polygon_id):
         conn.close()
         return False
 
+def save_group_to_db(weather, forecast, polygon_ids):
+    """
+    Guarda el clima y el pronóstico de una celda meteorológica para todos
+    sus polígonos (ver weather_grid.py) en una sola transacción
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        if weather:
+            cur.executemany(upsert_sql('weather_data', WEATHER_COLUMNS, OBSERVATION_KEY),
+                            [observation_row(weather, polygon_id, WEATHER_COLUMNS)
+                             for polygon_id in polygon_ids])
+        if forecast:
+            cur.executemany(upsert_sql('forecast_data', FORECAST_COLUMNS, FORECAST_KEY),
+                            [row for polygon_id in polygon_ids
+                             for row in forecast_rows(forecast, polygon_id)])
+        conn.commit()
+        cur.close()
+        conn.close()
+        return True
+    except Exception as e:
+        safe_print(f"   [ERROR BD] weather/forecast: {e}")
+        conn.rollback()
+        conn.close()
+        return False
+
+def save_raw_responses_to_db(responses):
+    """Archiva las respuestas crudas del API (ver raw_archive.py)"""
+    if not responses:
+        return False
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        raw_archive.archive_responses(cur, responses)
+        conn.commit()
+        cur.close()
+        conn.close()
+        return True
+    except Exception as e:
+        safe_print(f"   [ERROR BD] raw: {e}")
+        conn.rollback()
+        conn.close()
+        return False
+
 def collect_and_save_all_data():
     """Función principal: recolecta y guarda todos los datos"""
     safe_print("\n" + "=" * 60)
@@ -476,6 +585,11 @@ def collect_and_save_all_data():
     save_to_json(results, 'complete_records.json')
     safe_print("   [OK] Guardado en complete_records.json")
     
+    # 6. Archivar las respuestas crudas (para reprocesar sin volver al API)
+    db_raw_ok = save_raw_responses_to_db(RAW_RESPONSES)
+    safe_print(f"   [PostgreSQL] Respuestas crudas: {'OK' if db_raw_ok else 'SKIP'} ({len(RAW_RESPONSES)})")
+    RAW_RESPONSES.clear()
+    
     # Resumen
     safe_print("\n" + "=" * 60)
     safe_print("  RESUMEN DE RECOLECCION")
@@ -491,10 +605,89 @@ def collect_and_save_all_data():
     
     return True
 
+def load_account_polygons(api_key):
+    """
+    Polígonos de la cuenta desde el registro (polygon_registry.py). Solo se
+    consulta /polygons si el registro está vacío (primera ejecución, que lo
+    llena) o no hay base de datos.
+    """
+    import polygon_registry
+    
+    conn = get_db_connection()
+    if not conn:
+        from get_polygon_id import get_polygons
+        safe_print("   [AVISO] Sin BD: polígonos leídos de /polygons")
+        return get_polygons(api_key, verbose=False)
+    
+    try:
+        polygons = polygon_registry.load_polygons(conn)
+        if not polygons:
+            safe_print("   [AVISO] Registro de polígonos vacío: sincronizando desde /polygons")
+            polygon_registry.sync(conn, polygon_registry.fetch_polygons(api_key))
+            polygons = polygon_registry.load_polygons(conn)
+        return polygons
+    except Exception as e:
+        safe_print(f"   [ERROR BD] polygons: {e}")
+        return []
+    finally:
+        conn.close()
+
+def collect_all_polygons():
+    """
+    Recolecta todos los polígonos de la cuenta. Clima y pronóstico se
+    consultan una vez por celda meteorológica y se reparten a los polígonos
+    de la celda; suelo y NDVI se consultan por polígono.
+    """
+    import weather_grid
+    
+    config = load_config()
+    if not config or not config.get('api_key'):
+        safe_print("ERROR: API Key no configurada")
+        return False
+    api_key = config['api_key']
+    
+    polygons = load_account_polygons(api_key)
+    if not polygons:
+        safe_print("ERROR: No se pudieron obtener los polígonos de la cuenta")
+        return False
+    
+    groups = weather_grid.group_polygons(polygons)
+    safe_print(f"\n{len(polygons)} poligonos en {len(groups)} celdas meteorologicas "
+               f"({2 * (len(polygons) - len(groups))} consultas de clima ahorradas)")
+    
+    ok = True
+    for group in groups:
+        polygon_ids = [polygon['id'] for polygon in group.polygons]
+        weather = get_weather_data(api_key, group.representative['id'])
+        forecast = get_forecast_data(api_key, group.representative['id'])
+        db_ok = save_group_to_db(weather, forecast, polygon_ids)
+        ok = ok and bool(weather and forecast and db_ok)
+        safe_print(f"   Celda {group.cell}: {len(polygon_ids)} poligonos | "
+                   f"clima {'OK' if weather else 'ERROR'} | pronostico {'OK' if forecast else 'ERROR'} | "
+                   f"[PostgreSQL] {'OK' if db_ok else 'SKIP'}")
+        
+        for polygon_id in polygon_ids:
+            soil = get_soil_data(api_key, polygon_id)
+            ndvi = get_ndvi_data(api_key, polygon_id)
+            db_soil_ok = bool(soil) and save_soil_to_db(soil, polygon_id)
+            db_ndvi_ok = bool(ndvi) and save_ndvi_to_db(ndvi, polygon_id)
+            ok = ok and db_soil_ok
+            safe_print(f"      {polygon_id}: suelo {'OK' if db_soil_ok else 'ERROR'} | "
+                       f"NDVI {'OK' if db_ndvi_ok else '-'}")
+    
+    save_raw_responses_to_db(RAW_RESPONSES)
+    RAW_RESPONSES.clear()
+    return ok
+
 def main():
     """Punto de entrada principal"""
     import sys
     
+    # Con --all-polygons se recolectan todos los polígonos de la cuenta
+    if '--all-polygons' in sys.argv[1:]:
+        collect_all_polygons()
+        return
+    
     # Si se pasa --loop, ejecutar continuamente cada hora
     if len(sys.argv) > 1 and sys.argv[1] == '--loop':
         import time
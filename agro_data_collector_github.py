@@ -7,14 +7,50 @@ Lee credenciales desde variables de entorno (secrets)
 
 import requests
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 import time
 
+import raw_archive
+
 # Leer credenciales desde variables de entorno (GitHub Secrets)
 API_KEY = os.environ.get('AGROMONITORING_API_KEY', '')
 POLYGON_ID = os.environ.get('POLYGON_ID', '')
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 
+# Fuente de los datos (parte de la clave natural en la BD)
+SOURCE = 'agromonitoring'
+
+# Respuestas crudas del API de esta ejecución (ver raw_archive.py)
+RAW_RESPONSES = []
+
+# Nubosidad máxima (%) de una escena para usar su NDVI
+MAX_CLOUD_COVERAGE = float(os.environ.get('MAX_CLOUD_COVERAGE', 30))
+
+def fetch_json(kind, url):
+    """GET al API, guardando la respuesta cruda (sin la API key) para archivarla"""
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    RAW_RESPONSES.append(raw_archive.capture(kind, POLYGON_ID, url, response.content, API_KEY))
+    return response.json()
+
+def observation_time(dt=None):
+    """Momento de la observación upstream (`dt`, epoch UTC) en ISO 8601"""
+    if dt is None:
+        return datetime.now(timezone.utc).isoformat()
+    return datetime.fromtimestamp(dt, tz=timezone.utc).isoformat()
+
+def issuance_time():
+    """
+    Emisión del pronóstico: hora UTC de la consulta (el API no informa la
+    corrida del modelo). Truncada a la hora, un reintento dentro de la misma
+    hora actualiza la emisión en vez de crear otra.
+    """
+    return datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+def lead_days(forecast_date, issued_at):
+    """Días de anticipación de un pronóstico ('YYYY-MM-DD') respecto a su emisión"""
+    return (datetime.strptime(forecast_date, '%Y-%m-%d').date() - issued_at.date()).days
+
 def get_db_connection():
     """Conecta a PostgreSQL"""
     try:
@@ -39,11 +75,10 @@ def get_weather_data():
     """Obtiene datos del clima"""
     url = f"http://api.agromonitoring.com/agro/1.0/weather?polyid={POLYGON_ID}&appid={API_KEY}"
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+        data = fetch_json('weather', url)
         
         return {
+            'timestamp': observation_time(data.get('dt')),
             'temperature_c': round(data['main']['temp'] - 273.15, 2),
             'feels_like_c': round(data['main']['feels_like'] - 273.15, 2),
             'temp_min_c': round(data['main']['temp_min'] - 273.15, 2),
@@ -54,7 +89,8 @@ def get_weather_data():
             'wind_deg': data['wind'].get('deg', 0),
             'clouds_percent': data['clouds']['all'],
             'weather_main': data['weather'][0]['main'],
-            'weather_description': data['weather'][0]['description']
+            'weather_description': data['weather'][0]['description'],
+            'rain_1h_mm': data.get('rain', {}).get('1h', 0)
         }
     except Exception as e:
         print(f"[ERROR] Weather: {e}")
@@ -64,11 +100,10 @@ def get_soil_data():
     """Obtiene datos del suelo"""
     url = f"http://api.agromonitoring.com/agro/1.0/soil?polyid={POLYGON_ID}&appid={API_KEY}"
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+        data = fetch_json('soil', url)
         
         return {
+            'timestamp': observation_time(data.get('dt')),
             'soil_temp_c': round(data.get('t10', 273.15) - 273.15, 2),
             'soil_moisture': round(data.get('moisture', 0), 4),
             'soil_moisture_percent': round(data.get('moisture', 0) * 100, 2)
@@ -84,25 +119,27 @@ def get_ndvi_data():
     
     url = f"http://api.agromonitoring.com/agro/1.0/image/search?start={start}&end={end}&polyid={POLYGON_ID}&appid={API_KEY}"
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        images = response.json()
+        images = fetch_json('ndvi_search', url)
         
         if images and len(images) > 0:
-            latest = images[0]
+            # La más reciente con pocas nubes; si no hay, la menos nublada
+            clear = [image for image in images if image.get('cl', 0) <= MAX_CLOUD_COVERAGE]
+            if clear:
+                latest = max(clear, key=lambda image: image['dt'])
+            else:
+                latest = min(images, key=lambda image: (image.get('cl', 0), -image['dt']))
             ndvi_stats = None
             ndwi_stats = None
             
             if latest.get('stats', {}).get('ndvi'):
-                stats_resp = requests.get(latest['stats']['ndvi'], timeout=30)
-                ndvi_stats = stats_resp.json()
+                ndvi_stats = fetch_json('ndvi_stats', latest['stats']['ndvi'])
             
             if latest.get('stats', {}).get('ndwi'):
-                stats_resp = requests.get(latest['stats']['ndwi'], timeout=30)
-                ndwi_stats = stats_resp.json()
+                ndwi_stats = fetch_json('ndwi_stats', latest['stats']['ndwi'])
             
             return {
-                'image_date': datetime.fromtimestamp(latest['dt']).isoformat(),
+                'timestamp': observation_time(latest['dt']),
+                'image_date': observation_time(latest['dt']),
                 'ndvi_mean': round(ndvi_stats.get('mean', 0), 4) if ndvi_stats else None,
                 'ndvi_min': round(ndvi_stats.get('min', 0), 4) if ndvi_stats else None,
                 'ndvi_max': round(ndvi_stats.get('max', 0), 4) if ndvi_stats else None,
@@ -118,13 +155,13 @@ def get_forecast_data():
     """Obtiene pronóstico"""
     url = f"http://api.agromonitoring.com/agro/1.0/weather/forecast?polyid={POLYGON_ID}&appid={API_KEY}"
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+        data = fetch_json('forecast', url)
+        issued_at = issuance_time()
         
+        # Días en UTC, igual que los agregados diarios
         daily_forecast = {}
         for item in data:
-            date = datetime.fromtimestamp(item['dt'])
+            date = datetime.fromtimestamp(item['dt'], tz=timezone.utc)
             day_key = date.strftime('%Y-%m-%d')
             
             if day_key not in daily_forecast:
@@ -140,6 +177,8 @@ def get_forecast_data():
         for day, values in list(daily_forecast.items())[:5]:
             forecast_list.append({
                 'date': day,
+                'issued_at': issued_at.isoformat(),
+                'lead_days': lead_days(day, issued_at),
                 'temp_min': round(min(values['temps']), 1),
                 'temp_max': round(max(values['temps']), 1),
                 'temp_avg': round(sum(values['temps']) / len(values['temps']), 1),
@@ -152,6 +191,43 @@ def get_forecast_data():
         print(f"[ERROR] Forecast: {e}")
         return None
 
+def upsert_sql(table, columns, key):
+    """
+    INSERT sobre la clave natural: si la fila ya existe solo se actualiza
+    cuando cambió algún valor (reintentos del workflow no duplican filas)
+    """
+    values = [c for c in columns if c not in key]
+    return f"""
+        INSERT INTO {table} AS t ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        ON CONFLICT ({', '.join(key)}) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in values)},
+            created_at = NOW()
+        WHERE ({', '.join(f't.{c}' for c in values)})
+            IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in values)})
+    """
+
+WEATHER_COLUMNS = [
+    'polygon_id', 'source', 'timestamp', 'temperature_c', 'feels_like_c',
+    'temp_min_c', 'temp_max_c', 'humidity_percent', 'pressure_hpa',
+    'wind_speed_ms', 'wind_deg', 'clouds_percent', 'weather_main', 'weather_description',
+    'rain_1h_mm'
+]
+SOIL_COLUMNS = [
+    'polygon_id', 'source', 'timestamp', 'soil_temp_c', 'soil_moisture', 'soil_moisture_percent'
+]
+NDVI_COLUMNS = [
+    'polygon_id', 'source', 'timestamp', 'image_date', 'ndvi_mean', 'ndvi_min',
+    'ndvi_max', 'ndvi_std', 'ndwi_mean', 'cloud_coverage'
+]
+FORECAST_COLUMNS = [
+    'polygon_id', 'source', 'forecast_date', 'issued_at', 'lead_days', 'temp_min_c',
+    'temp_max_c', 'temp_avg_c', 'humidity_avg', 'precipitation_mm'
+]
+
+OBSERVATION_KEY = ('polygon_id', 'source', 'timestamp')
+FORECAST_KEY = ('polygon_id', 'source', 'forecast_date', 'issued_at')
+
 def save_to_db(weather, soil, ndvi, forecast):
     """Guarda todos los datos en PostgreSQL"""
     conn = get_db_connection()
@@ -163,51 +239,52 @@ def save_to_db(weather, soil, ndvi, forecast):
         
         # Weather
         if weather:
-            cur.execute("""
-                INSERT INTO weather_data (
-                    polygon_id, temperature_c, feels_like_c, temp_min_c, temp_max_c,
-                    humidity_percent, pressure_hpa, wind_speed_ms, wind_deg,
-                    clouds_percent, weather_main, weather_description
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (POLYGON_ID, weather['temperature_c'], weather['feels_like_c'],
-                  weather['temp_min_c'], weather['temp_max_c'], weather['humidity_percent'],
-                  weather['pressure_hpa'], weather['wind_speed_ms'], weather['wind_deg'],
-                  weather['clouds_percent'], weather['weather_main'], weather['weather_description']))
+            cur.execute(upsert_sql('weather_data', WEATHER_COLUMNS, OBSERVATION_KEY),
+                        (POLYGON_ID, SOURCE, weather['timestamp'], weather['temperature_c'],
+                         weather['feels_like_c'], weather['temp_min_c'], weather['temp_max_c'],
+                         weather['humidity_percent'], weather['pressure_hpa'],
+                         weather['wind_speed_ms'], weather['wind_deg'], weather['clouds_percent'],
+                         weather['weather_main'], weather['weather_description'],
+                         weather['rain_1h_mm']))
             print("[OK] Weather saved to DB")
         
         # Soil
         if soil:
-            cur.execute("""
-                INSERT INTO soil_data (polygon_id, soil_temp_c, soil_moisture, soil_moisture_percent)
-                VALUES (%s, %s, %s, %s)
-            """, (POLYGON_ID, soil['soil_temp_c'], soil['soil_moisture'], soil['soil_moisture_percent']))
+            cur.execute(upsert_sql('soil_data', SOIL_COLUMNS, OBSERVATION_KEY),
+                        (POLYGON_ID, SOURCE, soil['timestamp'], soil['soil_temp_c'],
+                         soil['soil_moisture'], soil['soil_moisture_percent']))
             print("[OK] Soil saved to DB")
         
         # NDVI
         if ndvi:
-            cur.execute("""
-                INSERT INTO ndvi_data (
-                    polygon_id, image_date, ndvi_mean, ndvi_min, ndvi_max,
-                    ndvi_std, ndwi_mean, cloud_coverage
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (POLYGON_ID, ndvi['image_date'], ndvi['ndvi_mean'], ndvi['ndvi_min'],
-                  ndvi['ndvi_max'], ndvi['ndvi_std'], ndvi['ndwi_mean'], ndvi['cloud_coverage']))
+            cur.execute(upsert_sql('ndvi_data', NDVI_COLUMNS, OBSERVATION_KEY),
+                        (POLYGON_ID, SOURCE, ndvi['timestamp'], ndvi['image_date'],
+                         ndvi['ndvi_mean'], ndvi['ndvi_min'], ndvi['ndvi_max'],
+                         ndvi['ndvi_std'], ndvi['ndwi_mean'], ndvi['cloud_coverage']))
             print("[OK] NDVI saved to DB")
         
         # Forecast
         if forecast:
+            forecast_sql = upsert_sql('forecast_data', FORECAST_COLUMNS, FORECAST_KEY)
             for day in forecast:
-                cur.execute("""
-                    INSERT INTO forecast_data (
-                        polygon_id, forecast_date, temp_min_c, temp_max_c,
-                        temp_avg_c, humidity_avg, precipitation_mm
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT DO NOTHING
-                """, (POLYGON_ID, day['date'], day['temp_min'], day['temp_max'],
-                      day['temp_avg'], day['humidity_avg'], day['precipitation_mm']))
+                cur.execute(forecast_sql, (POLYGON_ID, SOURCE, day['date'], day['issued_at'],
+                                           day['lead_days'], day['temp_min'], day['temp_max'],
+                                           day['temp_avg'], day['humidity_avg'],
+                                           day['precipitation_mm']))
             print("[OK] Forecast saved to DB")
         
         conn.commit()
+        
+        # Respuestas crudas, en su propia transacción: si fallan los datos ya quedaron
+        try:
+            if RAW_RESPONSES:
+                raw_archive.archive_responses(cur, RAW_RESPONSES)
+                conn.commit()
+                print(f"[OK] {len(RAW_RESPONSES)} raw responses archived")
+        except Exception as e:
+            print(f"[WARN] Archiving raw responses: {e}")
+            conn.rollback()
+        
         cur.close()
         conn.close()
         return True
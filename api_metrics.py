@@ -0,0 +1,211 @@
+"""
+AgroMonitor - Métricas del API
+Contadores e histogramas en memoria con salida en formato de texto de
+Prometheus, para exponer en /metrics.
+
+Cada observación es una suma bajo un lock, así que el costo es lo bastante
+bajo para dejarlo activo en producción.
+"""
+
+import bisect
+import threading
+import time
+
+from flask import has_request_context, request
+import psycopg2.extensions
+
+from local_replica import ReplicaCursor
+import slow_query_log
+
+# Buckets de latencia en segundos (de 1 ms a 10 s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Buckets de filas devueltas por consulta
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+def escape_label(value):
+    """Escapa un valor de label según el formato de texto de Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{n}="{escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Contador monotónico con labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histograma de buckets fijos con labels"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(label_values, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self.values[label_values] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self.values.items())
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# ============================================
+# MÉTRICAS DEL API
+# ============================================
+
+REQUESTS = Counter(
+    'agromonitor_http_requests_total', 'Requests HTTP atendidas',
+    ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram(
+    'agromonitor_http_request_duration_seconds', 'Latencia de requests HTTP por ruta',
+    ('route',))
+DB_CONNECT_SECONDS = Histogram(
+    'agromonitor_db_connect_seconds', 'Tiempo para obtener una conexión a la BD',
+    ('source',))
+DB_QUERY_SECONDS = Histogram(
+    'agromonitor_db_query_seconds', 'Tiempo de ejecución y lectura de consultas',
+    ('route',))
+DB_ROWS = Histogram(
+    'agromonitor_db_rows_returned', 'Filas devueltas por consulta',
+    ('route',), buckets=ROW_BUCKETS)
+SERIALIZATION_SECONDS = Histogram(
+    'agromonitor_serialization_seconds', 'Tiempo de serialización de respuestas',
+    ('route', 'format'))
+CACHE_REQUESTS = Counter(
+    'agromonitor_cache_requests_total', 'Aciertos y fallos de cachés (etag, replica, coalesce)',
+    ('cache', 'result'))
+
+ALL_METRICS = [
+    REQUESTS, REQUEST_SECONDS, DB_CONNECT_SECONDS, DB_QUERY_SECONDS,
+    DB_ROWS, SERIALIZATION_SECONDS, CACHE_REQUESTS
+]
+
+
+def current_route():
+    """Patrón de la ruta actual (no la URL, para acotar la cardinalidad)"""
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return 'none'
+
+
+def render_metrics():
+    """Todas las métricas en formato de texto de Prometheus"""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ============================================
+# CURSORES INSTRUMENTADOS
+# ============================================
+
+class TimedCursorMixin:
+    """
+    Mide el tiempo de execute/fetch, cuenta filas devueltas y pasa la
+    consulta al log de consultas lentas. Las sentencias sin resultado
+    (INSERT/UPDATE sin RETURNING, DDL) se registran al terminar execute; las
+    demás al leer sus filas.
+    """
+
+    def execute(self, sql, params=None):
+        self._sql = sql
+        self._params = params
+        start = time.perf_counter()
+        try:
+            result = super().execute(sql, params)
+        finally:
+            self._query_seconds = time.perf_counter() - start
+        # Los cursores con nombre (del lado del servidor) no tienen
+        # description hasta el primer fetch: se registran ahí
+        if getattr(self, 'description', ()) is None and getattr(self, 'name', None) is None:
+            self._record(time.perf_counter(), 0)
+        return result
+
+    def _record(self, start, rows):
+        elapsed = getattr(self, '_query_seconds', 0.0) + time.perf_counter() - start
+        self._query_seconds = 0.0
+        route = current_route()
+        DB_QUERY_SECONDS.observe(elapsed, route)
+        DB_ROWS.observe(rows, route)
+        slow_query_log.record(
+            getattr(self, '_sql', ''), getattr(self, '_params', None), elapsed, route,
+            explain=isinstance(self, psycopg2.extensions.cursor))
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._record(start, 1 if row is not None else 0)
+        return row
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._record(start, len(rows))
+        return rows
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        self._record(start, len(rows))
+        return rows
+
+
+class TimedCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    """Cursor de psycopg2 instrumentado (usar como cursor_factory)"""
+
+
+class TimedReplicaCursor(TimedCursorMixin, ReplicaCursor):
+    """Cursor de la réplica local instrumentado"""
+
+    def execute(self, sql, params=()):
+        return super().execute(sql, params if params is not None else ())
@@ -5,16 +5,1066 @@ Backend Flask que sirve datos del dashboard desde PostgreSQL
 Ejecutar: python api_server.py
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from functools import wraps
+import hashlib
+import hmac
+import gzip
+import itertools
 import json
+import os
+import queue
+import re
+import select
+import threading
+import time
+import zlib
+
+import psycopg2.extensions
+import psycopg2.extras
 
 # Importar configuración de BD
 from db_config import get_connection
+from local_replica import LocalReplica, ReplicaConnection
+import api_metrics as metrics
+import cold_archive
+import polygon_registry
+
+# Brotli es opcional: si no está instalado solo se usa gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# PyArrow es opcional: sin él solo se sirve JSON
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask que mide el tiempo de serialización"""
+
+    def response(self, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().response(*args, **kwargs)
+        metrics.SERIALIZATION_SECONDS.observe(
+            time.perf_counter() - start, metrics.current_route(), 'json')
+        return response
 
 app = Flask(__name__)
-CORS(app)  # Permitir requests desde el dashboard
+app.json = TimedJSONProvider(app)
+CORS(app, expose_headers=['ETag', 'Last-Modified'])  # Permitir requests desde el dashboard
+
+def load_default_polygon_id():
+    """Polígono por defecto: variable POLYGON_ID o polygon_config.json"""
+    if os.environ.get('POLYGON_ID'):
+        return os.environ['POLYGON_ID']
+    config_path = os.path.join(os.path.dirname(__file__), 'polygon_config.json')
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('polygon', {}).get('id')
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+# Polígono usado cuando la request no trae ?polygon=
+DEFAULT_POLYGON_ID = load_default_polygon_id()
+
+# Réplica local opcional para no esperar el arranque en frío de Neon
+REPLICA_PATH = os.environ.get('REPLICA_PATH')
+replica = None
+if REPLICA_PATH:
+    replica = LocalReplica(
+        REPLICA_PATH,
+        sync_interval=int(os.environ.get('REPLICA_SYNC_INTERVAL', 300)),
+        max_staleness=int(os.environ.get('REPLICA_MAX_STALENESS', 900))
+    )
+    replica.start()
+
+# Respuestas más pequeñas que esto no se comprimen (no compensa el CPU)
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# ============================================
+# CONEXIÓN, VALIDADORES HTTP Y COMPRESIÓN
+# ============================================
+
+# IDs de Agromonitoring (ObjectId): se usan tal cual, sin pasar por el registro
+POLYGON_ID_PATTERN = re.compile(r'[0-9a-f]{24}')
+
+def requested_polygon():
+    """
+    Polígono pedido en la request (?polygon= con el ID o el nombre del
+    registro de polígonos) o None si no se pidió ninguno
+    """
+    key = request.args.get('polygon')
+    return resolve_polygon(key) if key else None
+
+def get_polygon():
+    """Polígono de la request o el polígono por defecto"""
+    return requested_polygon() or DEFAULT_POLYGON_ID
+
+def resolve_polygon(key):
+    """ID del polígono: los IDs pasan tal cual, los nombres se buscan en el registro"""
+    if POLYGON_ID_PATTERN.fullmatch(key):
+        return key
+    conn = get_db()
+    if not conn:
+        return key
+    try:
+        polygon = polygon_registry.find(polygon_registry.cached_polygons(conn), key)
+    except Exception:
+        conn.rollback()
+        return key
+    return polygon['id'] if polygon else key
+
+def get_db():
+    """Devuelve la conexión de la request actual (una sola por request)"""
+    if 'db' not in g:
+        start = time.perf_counter()
+        g.db = get_connection()
+        metrics.DB_CONNECT_SECONDS.observe(time.perf_counter() - start, 'primary')
+        if g.db:
+            g.db.cursor_factory = metrics.TimedCursor
+    return g.db
+
+def get_read_db(since=None):
+    """
+    Conexión de lectura: la réplica local si está al día (y, si se pasa
+    since, si su ventana cubre desde ese momento), si no el primario
+    """
+    if replica is None:
+        return get_db()
+    if since is not None and not replica.covers(since):
+        return get_db()
+    if 'read_db' not in g:
+        if replica.is_fresh():
+            metrics.CACHE_REQUESTS.inc('replica', 'hit')
+            start = time.perf_counter()
+            g.read_db = replica.connect()
+            metrics.DB_CONNECT_SECONDS.observe(time.perf_counter() - start, 'replica')
+            g.read_db.cursor_factory = metrics.TimedReplicaCursor
+        else:
+            metrics.CACHE_REQUESTS.inc('replica', 'miss')
+            g.read_db = None
+    return g.read_db or get_db()
+
+# Tabla cruda -> tabla con el último registro de cada polígono
+LATEST_TABLES = {
+    'weather_data': 'latest_weather',
+    'soil_data': 'latest_soil',
+    'ndvi_data': 'latest_ndvi'
+}
+
+def latest_table(conn, table):
+    """
+    Tabla de donde leer el último registro: latest_* en PostgreSQL (una fila
+    por polígono, búsqueda por PK). La réplica no las copia y usa la tabla
+    cruda con su índice (polygon_id, timestamp).
+    """
+    if isinstance(conn, ReplicaConnection):
+        return table
+    return LATEST_TABLES[table]
+
+@app.teardown_appcontext
+def close_db(exc):
+    """Cierra las conexiones al terminar la request"""
+    for name in ('db', 'read_db'):
+        conn = g.pop(name, None)
+        if conn is not None:
+            conn.close()
+
+def get_data_version(conn, tables, polygon_id=None):
+    """
+    Obtiene la versión de los datos desde table_stats (una sola lectura por PK)
+    o desde la réplica local: conteo y último created_at de cada tabla, del
+    polígono pedido o de todos.
+
+    Returns:
+        Tuple (etag, last_modified) o (None, None) si no hay datos
+    """
+    if isinstance(conn, ReplicaConnection):
+        rows = conn.table_versions(tables, polygon_id)
+        return build_etag(rows)
+
+    cur = conn.cursor()
+    if polygon_id:
+        cur.execute("""
+            SELECT table_name, row_count, last_created_at
+            FROM table_stats
+            WHERE table_name = ANY(%s) AND polygon_id = %s
+            ORDER BY table_name
+        """, (list(tables), polygon_id))
+    else:
+        cur.execute("""
+            SELECT table_name, SUM(row_count), MAX(last_created_at)
+            FROM table_stats
+            WHERE table_name = ANY(%s)
+            GROUP BY table_name
+            ORDER BY table_name
+        """, (list(tables),))
+    rows = cur.fetchall()
+    cur.close()
+    return build_etag(rows)
+
+def build_etag(rows):
+    """ETag y Last-Modified a partir de (tabla, conteo, último created_at)"""
+    parts = [f"{row[0]}:{row[1]}:{row[2].isoformat() if row[2] else ''}" for row in rows]
+    last_modified = max((row[2] for row in rows if row[2]), default=None)
+    if last_modified is None:
+        return None, None
+
+    # La misma versión de datos con distintos parámetros es otra respuesta.
+    # La hora entra en la clave porque las ventanas NOW()/CURRENT_DATE avanzan
+    # aunque no lleguen filas nuevas.
+    hour = datetime.utcnow().strftime('%Y%m%d%H')
+    key = '|'.join([request.full_path, request.headers.get('Accept', ''), hour] + parts)
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+    return etag, last_modified
+
+def conditional(*tables, all_polygons=False):
+    """
+    Decorador: responde 304 Not Modified sin ejecutar la consulta si el
+    cliente ya tiene la versión actual (If-None-Match / If-Modified-Since).
+
+    Con all_polygons=True la versión cubre todos los polígonos salvo que la
+    request pida uno explícitamente (caso /api/stats).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            conn = get_read_db()
+            if not conn:
+                return view(*args, **kwargs)
+
+            try:
+                polygon_id = requested_polygon() if all_polygons else get_polygon()
+                etag, last_modified = get_data_version(conn, tables, polygon_id)
+            except Exception:
+                # Sin validadores la request se sirve normalmente
+                conn.rollback()
+                return view(*args, **kwargs)
+
+            if etag is None:
+                return view(*args, **kwargs)
+
+            # Precisión de segundos, como en el header HTTP
+            last_modified = last_modified.replace(microsecond=0)
+
+            not_modified = False
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            elif request.if_modified_since:
+                not_modified = last_modified <= request.if_modified_since
+
+            metrics.CACHE_REQUESTS.inc('etag', 'hit' if not_modified else 'miss')
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            # ETag débil: el cuerpo puede ir comprimido con distintos encodings
+            response.set_etag(etag, weak=True)
+            response.vary.add('Accept')
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+# ============================================
+# COALESCENCIA DE REQUESTS IDÉNTICAS (SINGLE-FLIGHT)
+# ============================================
+
+class InFlightCall:
+    """Resultado compartido de una llamada en curso"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Las llamadas concurrentes con la misma clave esperan a la primera y
+    reciben su resultado. Nada se guarda al terminar: no agrega staleness.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        """
+        Ejecuta fn() una sola vez por clave entre llamadas concurrentes.
+
+        Returns:
+            Tuple (resultado, compartido) donde compartido indica si se
+            reutilizó el resultado de otra llamada
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = InFlightCall()
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
+
+inflight = SingleFlight()
+
+def coalesce(view):
+    """
+    Decorador: requests GET idénticas simultáneas comparten una sola
+    consulta y una sola serialización. Cada una recibe su propia copia de
+    la respuesta (la compresión y los headers se aplican después).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.full_path, request.headers.get('Accept', ''))
+
+        def call():
+            response = app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, response.mimetype
+
+        (body, status, mimetype), shared = inflight.do(key, call)
+        metrics.CACHE_REQUESTS.inc('coalesce', 'hit' if shared else 'miss')
+        return app.response_class(body, status=status, mimetype=mimetype)
+    return wrapper
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Registra conteo y latencia por ruta (corre después de comprimir)"""
+    start = g.get('request_start')
+    if start is not None:
+        route = metrics.current_route()
+        metrics.REQUESTS.inc(route, request.method, str(response.status_code))
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Comprime la respuesta con brotli o gzip según Accept-Encoding"""
+    if (response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+
+    return response
+
+# ============================================
+# FORMATO BINARIO (ARROW IPC)
+# ============================================
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+ARROW_BATCH_ROWS = 10000
+
+# NUMERIC -> float directamente en el driver (evita Decimal por valor)
+FLOAT_NUMERIC = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, 'FLOAT_NUMERIC',
+    lambda value, cur: float(value) if value is not None else None)
+
+# Columnas de los historiales: (nombre, tipo Arrow)
+WEATHER_HISTORY_COLUMNS = [
+    ('timestamp', 'timestamp'), ('temperature_c', 'float64'),
+    ('humidity_percent', 'int32'), ('wind_speed_ms', 'float64'),
+    ('weather_main', 'string')
+]
+SOIL_HISTORY_COLUMNS = [
+    ('timestamp', 'timestamp'), ('soil_temp_c', 'float64'),
+    ('soil_moisture_percent', 'float64')
+]
+NDVI_HISTORY_COLUMNS = [
+    ('timestamp', 'timestamp'), ('image_date', 'timestamp'),
+    ('ndvi_mean', 'float64'), ('ndwi_mean', 'float64')
+]
+
+def wants_arrow():
+    """True si el cliente pide Arrow (?format=arrow o header Accept)"""
+    if request.args.get('format') == 'arrow':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', ARROW_MIMETYPE])
+    return best == ARROW_MIMETYPE
+
+def arrow_cursor(conn):
+    """
+    Cursor del lado del servidor que entrega NUMERIC como float: las filas
+    llegan por lotes en vez de cargarse todas en memoria.
+    """
+    cur = conn.cursor(name='arrow_history')
+    psycopg2.extensions.register_type(FLOAT_NUMERIC, cur)
+    return cur
+
+def arrow_response(cur, columns, archived=None, limit=None):
+    """
+    Serializa el resultado del cursor a un stream Arrow IPC, un RecordBatch
+    columnar por cada lote de fetchmany(), sin crear dicts por fila. Las
+    filas del archivo frío (tabla Arrow, opcional) van al final, hasta
+    completar `limit` filas si se pasa.
+    """
+    types = {
+        'timestamp': pa.timestamp('us', tz='UTC'),
+        'float64': pa.float64(),
+        'int32': pa.int32(),
+        'string': pa.string()
+    }
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    start = time.perf_counter()
+
+    sink = pa.BufferOutputStream()
+    written = 0
+    with pa.ipc.new_stream(sink, schema) as writer:
+        while True:
+            rows = cur.fetchmany(ARROW_BATCH_ROWS)
+            if not rows:
+                break
+            written += len(rows)
+            arrays = [pa.array(col, type=field.type) for col, field in zip(zip(*rows), schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        if archived is not None and limit is not None:
+            archived = archived.slice(0, max(limit - written, 0))
+        if archived is not None and archived.num_rows:
+            writer.write_table(archived.select(schema.names).cast(schema))
+    cur.close()
+    body = sink.getvalue().to_pybytes()
+    # Incluye la lectura por lotes del cursor: ambas van intercaladas
+    metrics.SERIALIZATION_SECONDS.observe(
+        time.perf_counter() - start, metrics.current_route(), 'arrow')
+
+    return Response(body, mimetype=ARROW_MIMETYPE)
+
+def arrow_unavailable():
+    """Respuesta cuando se pide Arrow y pyarrow no está instalado"""
+    return jsonify({'error': 'Arrow format not available (pyarrow not installed)'}), 406
+
+def history_archive(table, polygon_id, since, columns):
+    """
+    Parte del historial crudo que ya está en el archivo frío.
+
+    Returns:
+        Tuple (tabla Arrow o None, since para la consulta a la BD)
+    """
+    if not cold_archive.reaches_archive(since):
+        return None, since
+    conn = get_db()
+    if not conn:
+        return None, since
+    return cold_archive.load_archived(
+        conn, table, polygon_id, since, [name for name, _ in columns])
+
+# ============================================
+# AGREGADOS POR HORA / DÍA (ROLLUPS)
+# ============================================
+
+ROLLUP_RESOLUTIONS = ('hour', 'day')
+
+def history_resolution():
+    """
+    Resolución pedida con ?resolution=raw|hour|day. Los agregados tienen
+    otras claves que las filas crudas, así que solo se usan si el cliente
+    los pide: sin el parámetro el historial es crudo a cualquier rango.
+
+    Returns:
+        La resolución, o None si el valor no es válido
+    """
+    resolution = request.args.get('resolution', 'raw')
+    if resolution == 'raw' or resolution in ROLLUP_RESOLUTIONS:
+        return resolution
+    return None
+
+def rollup_history(table, polygon_id, since, resolution, limit=None):
+    """
+    Historial desde observation_rollups (búsqueda por la clave primaria).
+    Un elemento por bucket: la media con el nombre de la variable y
+    _min/_max/_sum aparte; samples es la cantidad de filas agregadas.
+    """
+    conn = get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    # Incluir el bucket que contiene `since`
+    since = since.replace(minute=0, second=0, microsecond=0)
+    if resolution == 'day':
+        since = since.replace(hour=0)
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT bucket, variable, sample_count, min_value, max_value, sum_value
+            FROM observation_rollups
+            WHERE polygon_id = %s AND table_name = %s AND resolution = %s
+              AND bucket >= %s
+            ORDER BY bucket DESC
+        """, (polygon_id, table, resolution, since))
+        rows = cur.fetchall()
+        cur.close()
+
+        buckets = {}
+        for bucket, variable, count, min_value, max_value, sum_value in rows:
+            item = buckets.get(bucket)
+            if item is None:
+                if limit is not None and len(buckets) >= limit:
+                    break
+                item = buckets[bucket] = {'timestamp': bucket.isoformat(), 'samples': 0}
+            item[variable] = sum_value / count if count else None
+            item[f'{variable}_min'] = min_value
+            item[f'{variable}_max'] = max_value
+            item[f'{variable}_sum'] = sum_value
+            item['samples'] = max(item['samples'], count)
+
+        data = list(buckets.values())
+        return jsonify({'count': len(data), 'resolution': resolution, 'data': data})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============================================
+# EXPORTACIÓN CSV (COPY TO STDOUT)
+# ============================================
+
+# Dataset -> (tabla, columna de rango, columnas exportadas)
+EXPORT_TABLES = {
+    'weather': ('weather_data', 'timestamp', [
+        'timestamp', 'polygon_id', 'temperature_c', 'feels_like_c', 'temp_min_c',
+        'temp_max_c', 'humidity_percent', 'pressure_hpa', 'wind_speed_ms', 'wind_deg',
+        'clouds_percent', 'weather_main', 'weather_description', 'rain_1h_mm', 'created_at']),
+    'soil': ('soil_data', 'timestamp', [
+        'timestamp', 'polygon_id', 'soil_temp_c', 'soil_moisture',
+        'soil_moisture_percent', 'created_at']),
+    'ndvi': ('ndvi_data', 'timestamp', [
+        'timestamp', 'polygon_id', 'image_date', 'ndvi_mean', 'ndvi_min', 'ndvi_max',
+        'ndvi_std', 'ndwi_mean', 'cloud_coverage', 'created_at']),
+    'forecast': ('forecast_data', 'forecast_date', [
+        'forecast_date', 'polygon_id', 'timestamp', 'issued_at', 'lead_days', 'temp_min_c',
+        'temp_max_c', 'temp_avg_c', 'humidity_avg', 'precipitation_mm', 'created_at'])
+}
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_QUEUE_CHUNKS = 32
+# Espera máxima del primer bloque antes de comprometer el 200
+EXPORT_START_TIMEOUT = 30
+
+class ExportCancelled(Exception):
+    """El cliente cerró la descarga antes de terminar"""
+
+class ChunkWriter:
+    """
+    Archivo de escritura para copy_expert: agrupa lo que manda COPY en
+    bloques de EXPORT_CHUNK_BYTES y los pasa a una cola acotada (si el
+    cliente lee lento, COPY espera).
+    """
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data.encode('utf-8') if isinstance(data, str) else data
+        if len(self.buffer) >= EXPORT_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+def run_copy(query, params, chunks, cancelled):
+    """Hilo de fondo: ejecuta COPY (query) TO STDOUT en su propia conexión"""
+    writer = ChunkWriter(chunks, cancelled)
+    conn = get_connection()
+    try:
+        if not conn:
+            raise RuntimeError('Database connection failed')
+        cur = conn.cursor()
+        # COPY no acepta parámetros: se enlazan con mogrify
+        query = cur.mogrify(query, params).decode('utf-8')
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", writer)
+        cur.close()
+        conn.rollback()
+        writer.flush()
+        writer.put(None)
+    except ExportCancelled:
+        pass
+    except Exception as e:
+        try:
+            writer.put(e)
+        except ExportCancelled:
+            pass
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/api/export/<dataset>')
+def export_csv(dataset):
+    """
+    Exporta un dataset completo de un polígono en CSV, directo desde
+    COPY TO STDOUT sin pasar las filas por objetos Python.
+
+    Query params:
+        polygon: polígono (por defecto el configurado)
+        start, end: rango ISO 8601 (opcionales; end es exclusivo)
+        gzip: 1 para descargar .csv.gz
+
+    Antes de responder se espera el primer bloque de COPY (o su fin): si
+    COPY falla al arrancar se devuelve un 500. Si falla a mitad de la
+    descarga, el cuerpo termina con una línea "# ERROR: ..." y se corta la
+    conexión sin cerrar la transferencia, para que el cliente no tome el
+    archivo truncado por completo.
+    """
+    if dataset not in EXPORT_TABLES:
+        return jsonify({'error': f'Unknown dataset: {dataset}'}), 404
+    table, range_column, columns = EXPORT_TABLES[dataset]
+
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid start/end (use ISO 8601)'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    query = f"""
+        SELECT {', '.join(columns)}
+        FROM {table}
+        WHERE polygon_id = %(polygon)s
+          AND (%(start)s::TIMESTAMPTZ IS NULL OR {range_column} >= %(start)s)
+          AND (%(end)s::TIMESTAMPTZ IS NULL OR {range_column} < %(end)s)
+        ORDER BY {range_column}
+    """
+    params = {'polygon': polygon_id, 'start': start, 'end': end}
+
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    threading.Thread(target=run_copy, args=(query, params, chunks, cancelled), daemon=True).start()
+
+    # Todavía se puede responder con un error: esperar a que COPY arranque
+    try:
+        first = [chunks.get(timeout=EXPORT_START_TIMEOUT)]
+    except queue.Empty:
+        first = []  # COPY lento: se sigue esperando ya en la descarga
+    if first and isinstance(first[0], Exception):
+        cancelled.set()
+        return jsonify({'error': str(first[0])}), 500
+
+    def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        try:
+            for chunk in itertools.chain(first, iter(chunks.get, object())):
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    # Los headers ya salieron: se marca el error al final de
+                    # lo enviado y se corta la conexión (sin fin de chunked
+                    # ni pie gzip)
+                    message = ' '.join(str(chunk).split())
+                    print(f"[ERROR] Exportación {dataset}/{polygon_id}: {message}")
+                    trailer = f"\n# ERROR: {message}\n".encode('utf-8')
+                    yield compressor.compress(trailer) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else trailer
+                    raise chunk
+                yield compressor.compress(chunk) if compressor else chunk
+            if compressor:
+                yield compressor.flush()
+        finally:
+            cancelled.set()
+
+    filename = f"{dataset}_{polygon_id}.csv" + ('.gz' if compress else '')
+    response = Response(generate(), mimetype='application/gzip' if compress else 'text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+# ============================================
+# INGESTA DE SENSORES DE CAMPO
+# ============================================
+
+# Tokens aceptados (separados por coma); sin tokens la ingesta está desactivada
+INGEST_TOKENS = [t.strip() for t in os.environ.get('INGEST_TOKENS', '').split(',') if t.strip()]
+INGEST_MAX_READINGS = 5000
+INGEST_MAX_BYTES = 2 * 1024 * 1024
+
+# Métrica -> rango válido
+SENSOR_METRICS = {
+    'soil_moisture_percent': (0, 100),
+    'soil_temp_c': (-10, 70),
+    'air_temp_c': (-20, 60),
+    'air_humidity_percent': (0, 100),
+    'rain_mm': (0, 500)
+}
+
+# Se aceptan lecturas hasta esta distancia en el futuro (relojes desfasados)
+INGEST_MAX_CLOCK_SKEW = timedelta(hours=1)
+
+def check_ingest_token():
+    """True si el header Authorization trae un token de ingesta válido"""
+    auth = request.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return False
+    token = auth[len('Bearer '):].strip()
+    return any(hmac.compare_digest(token, valid) for valid in INGEST_TOKENS)
+
+def read_ingest_body():
+    """
+    Body de la request leído hasta INGEST_MAX_BYTES + 1 bytes: el tope vale
+    también sin Content-Length (transferencia chunked).
+
+    Returns:
+        Los bytes del body, o None si supera INGEST_MAX_BYTES
+    """
+    chunks = []
+    size = 0
+    while size <= INGEST_MAX_BYTES:
+        chunk = request.stream.read(INGEST_MAX_BYTES + 1 - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return None if size > INGEST_MAX_BYTES else b''.join(chunks)
+
+def parse_ingest_body(body):
+    """Lecturas del body: array JSON o NDJSON (una lectura por línea)"""
+    if 'ndjson' in (request.mimetype or ''):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    readings = json.loads(body)
+    if not isinstance(readings, list):
+        raise ValueError('Body must be a JSON array of readings')
+    return readings
+
+def validate_reading(reading, now):
+    """
+    Valida una lectura y la devuelve como tupla para el INSERT.
+
+    Returns:
+        Tuple (device_id, metric, timestamp, value) o lanza ValueError
+    """
+    if not isinstance(reading, dict):
+        raise ValueError('reading must be an object')
+
+    device_id = reading.get('device_id')
+    if not isinstance(device_id, str) or not 0 < len(device_id) <= 64:
+        raise ValueError('invalid device_id')
+
+    metric = reading.get('metric')
+    if metric not in SENSOR_METRICS:
+        raise ValueError(f'unknown metric: {metric}')
+
+    ts = reading.get('timestamp')
+    if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+        try:
+            ts = datetime.fromtimestamp(ts, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            # Epoch fuera del rango de la plataforma (p. ej. 1e18)
+            raise ValueError('invalid timestamp')
+    elif isinstance(ts, str):
+        ts = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+        if ts.tzinfo is None:
+            raise ValueError('timestamp must include a timezone')
+    else:
+        raise ValueError('invalid timestamp')
+    if ts > now + INGEST_MAX_CLOCK_SKEW:
+        raise ValueError('timestamp in the future')
+
+    value = reading.get('value')
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('invalid value')
+    low, high = SENSOR_METRICS[metric]
+    if not low <= value <= high:
+        raise ValueError(f'value out of range [{low}, {high}]')
+
+    return device_id, metric, ts, float(value)
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_readings():
+    """
+    Recibe un lote de lecturas de sensores de un polígono y las guarda con
+    un único INSERT multi-fila. Lecturas repetidas (mismo dispositivo,
+    métrica y hora) se ignoran, así que reintentar un lote es seguro.
+
+    Headers:
+        Authorization: Bearer <token>
+        Idempotency-Key: identificador del lote (opcional)
+    """
+    if not INGEST_TOKENS:
+        return jsonify({'error': 'Ingest disabled (INGEST_TOKENS not set)'}), 503
+    if not check_ingest_token():
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    if request.content_length and request.content_length > INGEST_MAX_BYTES:
+        return jsonify({'error': f'Body larger than {INGEST_MAX_BYTES} bytes'}), 413
+
+    batch_key = request.headers.get('Idempotency-Key')
+    if batch_key and len(batch_key) > 100:
+        return jsonify({'error': 'Idempotency-Key too long'}), 400
+
+    body = read_ingest_body()
+    if body is None:
+        return jsonify({'error': f'Body larger than {INGEST_MAX_BYTES} bytes'}), 413
+    try:
+        readings = parse_ingest_body(body)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid body: {e}'}), 400
+    if len(readings) > INGEST_MAX_READINGS:
+        return jsonify({'error': f'More than {INGEST_MAX_READINGS} readings'}), 413
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    rejected = []
+    for i, reading in enumerate(readings):
+        try:
+            rows.append((polygon_id,) + validate_reading(reading, now))
+        except (ValueError, TypeError, OverflowError, OSError) as e:
+            rejected.append({'index': i, 'error': str(e)})
+
+    conn = get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cur = conn.cursor()
+
+        if batch_key:
+            cur.execute("""
+                SELECT result FROM ingest_batches
+                WHERE idempotency_key = %s AND polygon_id = %s
+            """, (batch_key, polygon_id))
+            row = cur.fetchone()
+            if row:
+                cur.close()
+                return jsonify(dict(row[0], replayed=True))
+
+        inserted = []
+        if rows:
+            inserted = psycopg2.extras.execute_values(cur, """
+                INSERT INTO sensor_readings (polygon_id, device_id, metric, timestamp, value)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                RETURNING id
+            """, rows, page_size=len(rows), fetch=True)
+
+        result = {
+            'polygon_id': polygon_id,
+            'received': len(readings),
+            'inserted': len(inserted),
+            'duplicates': len(rows) - len(inserted),
+            'rejected': rejected
+        }
+
+        if batch_key:
+            cur.execute("""
+                INSERT INTO ingest_batches (idempotency_key, polygon_id, result)
+                VALUES (%s, %s, %s)
+                ON CONFLICT DO NOTHING
+            """, (batch_key, polygon_id, json.dumps(result)))
+
+        conn.commit()
+        cur.close()
+        return jsonify(result)
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), 500
+
+# ============================================
+# EVENTOS EN VIVO (SSE)
+# ============================================
+
+NOTIFY_CHANNEL = 'agro_updates'
+SSE_HEARTBEAT_SECONDS = 25
+SSE_QUEUE_SIZE = 100
+# Cada stream abierto ocupa un hilo del servidor: por encima de este límite
+# /api/events responde 503 en lugar de dejar sin hilos al resto del API
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 20))
+
+# Nombre del evento SSE para cada tabla
+EVENT_NAMES = {
+    'weather_data': 'weather',
+    'soil_data': 'soil',
+    'ndvi_data': 'ndvi',
+    'forecast_data': 'forecast',
+    'sensor_readings': 'sensors'
+}
+
+class ChangeBroadcaster:
+    """
+    Escucha NOTIFY de PostgreSQL en una única conexión y reenvía cada
+    cambio a las colas de los suscriptores SSE; la BD ve una sola conexión
+    por proceso. Cada suscriptor es un stream abierto que retiene un hilo
+    del servidor mientras la pestaña está abierta, por eso se limitan a
+    SSE_MAX_SUBSCRIBERS.
+
+    Nota: LISTEN requiere una conexión directa (no el pooler de Neon).
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self):
+        """Registra un suscriptor y devuelve su cola; None si se llegó al límite"""
+        q = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self.lock:
+            if len(self.subscribers) >= SSE_MAX_SUBSCRIBERS:
+                return None
+            self.subscribers.add(q)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._listen, daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def publish(self, event):
+        """Entrega un evento a todos los suscriptores"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Cliente lento: se descarta el evento, recargará al reconectar
+                pass
+
+    def _listen(self):
+        """Hilo de fondo: LISTEN con reconexión"""
+        while True:
+            conn = get_connection()
+            if not conn:
+                time.sleep(5)
+                continue
+            try:
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {self.channel}")
+                while True:
+                    if select.select([conn], [], [], SSE_HEARTBEAT_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            self.publish(json.loads(notify.payload))
+                        except ValueError:
+                            continue
+            except Exception as e:
+                print(f"[ERROR] LISTEN {self.channel}: {e}")
+                time.sleep(5)
+            finally:
+                conn.close()
+
+broadcaster = ChangeBroadcaster(NOTIFY_CHANNEL)
+
+def format_sse(event, data):
+    """Formatea un mensaje Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/events')
+def stream_events():
+    """
+    Canal SSE con un evento por polígono cada vez que el recolector guarda
+    clima, suelo, NDVI o pronóstico. El cliente solo recarga lo que cambió.
+
+    Cada conexión abierta retiene un hilo del servidor, así que hace falta
+    un servidor con hilos: app.run(threaded=True) en desarrollo o, en
+    producción, gunicorn con workers gthread (o gevent) y más hilos que
+    SSE_MAX_SUBSCRIBERS, p. ej.:
+        gunicorn -k gthread --threads 32 api_server:app
+    Con el límite alcanzado responde 503 con Retry-After; EventSource
+    reintenta solo.
+
+    Query params:
+        polygon: filtra los eventos de un polígono, por ID o nombre (opcional)
+    """
+    polygon = requested_polygon()
+    # La conexión usada para resolver el nombre no se retiene durante el stream
+    close_db(None)
+    q = broadcaster.subscribe()
+    if q is None:
+        response = jsonify({'error': 'Too many event subscribers'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_HEARTBEAT_SECONDS)
+        return response
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = q.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Comentario SSE para mantener viva la conexión en proxies
+                    yield ": ping\n\n"
+                    continue
+                if polygon and event.get('polygon_id') != polygon:
+                    continue
+                name = EVENT_NAMES.get(event.get('table'))
+                if name:
+                    yield format_sse(name, event)
+        finally:
+            broadcaster.unsubscribe(q)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # ============================================
 # ENDPOINTS DE LA API
@@ -34,31 +1084,116 @@ def home():
             '/api/soil/history',
             '/api/ndvi',
             '/api/ndvi/history',
+            '/api/ndvi/zones',
+            '/api/polygons',
             '/api/forecast',
-            '/api/stats'
+            '/api/latest',
+            '/api/stats',
+            '/api/events',
+            '/api/export/<weather|soil|ndvi|forecast>',
+            'POST /api/ingest',
+            '/metrics'
         ]
     })
 
+@app.route('/metrics')
+def get_metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Máximo de polígonos por request en /api/latest
+LATEST_MAX_POLYGONS = 100
+
+# Columnas del estado actual: clave de la respuesta -> (tabla, columnas)
+LATEST_COLUMNS = {
+    'weather': ('latest_weather', [
+        'timestamp', 'temperature_c', 'feels_like_c', 'temp_min_c', 'temp_max_c',
+        'humidity_percent', 'pressure_hpa', 'wind_speed_ms', 'wind_deg',
+        'clouds_percent', 'weather_main', 'weather_description'
+    ]),
+    'soil': ('latest_soil', [
+        'timestamp', 'soil_temp_c', 'soil_moisture', 'soil_moisture_percent'
+    ]),
+    'ndvi': ('latest_ndvi', [
+        'timestamp', 'image_date', 'ndvi_mean', 'ndvi_min', 'ndvi_max',
+        'ndvi_std', 'ndwi_mean', 'cloud_coverage'
+    ])
+}
+
+def json_value(value):
+    """Decimal -> float y fechas -> ISO 8601"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+@app.route('/api/latest')
+@conditional('weather_data', 'soil_data', 'ndvi_data', all_polygons=True)
+@coalesce
+def get_latest():
+    """
+    Estado actual (clima, suelo y NDVI) de varios polígonos en una request.
+
+    Query params:
+        polygons: lista separada por comas (por defecto el polígono de la request)
+    """
+    polygons = [resolve_polygon(p) for p in request.args.get('polygons', get_polygon() or '').split(',') if p]
+    if not polygons:
+        return jsonify({'error': 'Missing polygons parameter'}), 400
+    if len(polygons) > LATEST_MAX_POLYGONS:
+        return jsonify({'error': f'Too many polygons (max {LATEST_MAX_POLYGONS})'}), 400
+    
+    conn = get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    try:
+        cur = conn.cursor()
+        result = {polygon_id: dict.fromkeys(LATEST_COLUMNS) for polygon_id in polygons}
+        for key, (table, columns) in LATEST_COLUMNS.items():
+            cur.execute(f"""
+                SELECT polygon_id, {', '.join(columns)}
+                FROM {table}
+                WHERE polygon_id = ANY(%s)
+            """, (polygons,))
+            for row in cur.fetchall():
+                result[row[0]][key] = {
+                    column: json_value(value) for column, value in zip(columns, row[1:])
+                }
+        cur.close()
+        
+        return jsonify({'count': len(polygons), 'polygons': result})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/weather')
+@conditional('weather_data')
+@coalesce
 def get_weather():
-    """Obtiene el último registro de clima"""
-    conn = get_connection()
+    """Obtiene el último registro de clima del polígono"""
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    
+    conn = get_read_db()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
         cur = conn.cursor()
-        cur.execute("""
+        cur.execute(f"""
             SELECT timestamp, temperature_c, feels_like_c, temp_min_c, temp_max_c,
                    humidity_percent, pressure_hpa, wind_speed_ms, wind_deg,
                    clouds_percent, weather_main, weather_description
-            FROM weather_data
+            FROM {latest_table(conn, 'weather_data')}
+            WHERE polygon_id = %s
             ORDER BY timestamp DESC
             LIMIT 1
-        """)
+        """, (polygon_id,))
         row = cur.fetchone()
         cur.close()
-        conn.close()
         
         if row:
             return jsonify({
@@ -81,29 +1216,54 @@ def get_weather():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/weather/history')
+@conditional('weather_data')
+@coalesce
 def get_weather_history():
-    """Obtiene historial de clima"""
+    """
+    Obtiene historial de clima del polígono (JSON o Arrow IPC). Con
+    ?resolution=hour|day se sirve desde los agregados.
+    """
     days = request.args.get('days', 7, type=int)
-    limit = request.args.get('limit', 100, type=int)
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    arrow = wants_arrow()
+    if arrow and pa is None:
+        return arrow_unavailable()
+    # El límite por defecto es para JSON; Arrow trae toda la ventana salvo
+    # que el cliente pida un límite (LIMIT NULL = sin límite)
+    limit = request.args.get('limit', None if arrow else 100, type=int)
+    resolution = history_resolution()
+    if resolution is None:
+        return jsonify({'error': 'Invalid resolution'}), 400
+    if resolution != 'raw':
+        return rollup_history('weather_data', polygon_id, since, resolution,
+                              request.args.get('limit', type=int))
     
-    conn = get_connection()
+    conn = get_db() if arrow else get_read_db(since)
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
-        cur = conn.cursor()
+        archived, since = history_archive('weather_data', polygon_id, since, WEATHER_HISTORY_COLUMNS)
+        cur = arrow_cursor(conn) if arrow else conn.cursor()
         cur.execute("""
             SELECT timestamp, temperature_c, humidity_percent, 
                    wind_speed_ms, weather_main
             FROM weather_data
-            WHERE timestamp > NOW() - INTERVAL '%s days'
+            WHERE polygon_id = %s AND timestamp > %s
             ORDER BY timestamp DESC
             LIMIT %s
-        """, (days, limit))
+        """, (polygon_id, since, limit))
+        
+        if arrow:
+            return arrow_response(cur, WEATHER_HISTORY_COLUMNS, archived, limit)
         
         rows = cur.fetchall()
         cur.close()
-        conn.close()
+        if archived is not None:
+            rows = (rows + cold_archive.table_rows(archived))[:limit]
         
         data = [{
             'timestamp': row[0].isoformat(),
@@ -119,23 +1279,29 @@ def get_weather_history():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/soil')
+@conditional('soil_data')
+@coalesce
 def get_soil():
-    """Obtiene el último registro de suelo"""
-    conn = get_connection()
+    """Obtiene el último registro de suelo del polígono"""
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    
+    conn = get_read_db()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
         cur = conn.cursor()
-        cur.execute("""
+        cur.execute(f"""
             SELECT timestamp, soil_temp_c, soil_moisture, soil_moisture_percent
-            FROM soil_data
+            FROM {latest_table(conn, 'soil_data')}
+            WHERE polygon_id = %s
             ORDER BY timestamp DESC
             LIMIT 1
-        """)
+        """, (polygon_id,))
         row = cur.fetchone()
         cur.close()
-        conn.close()
         
         if row:
             return jsonify({
@@ -150,26 +1316,48 @@ def get_soil():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/soil/history')
+@conditional('soil_data')
+@coalesce
 def get_soil_history():
-    """Obtiene historial de suelo"""
+    """
+    Obtiene historial de suelo del polígono (JSON o Arrow IPC). Con
+    ?resolution=hour|day se sirve desde los agregados.
+    """
     days = request.args.get('days', 7, type=int)
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    arrow = wants_arrow()
+    if arrow and pa is None:
+        return arrow_unavailable()
+    resolution = history_resolution()
+    if resolution is None:
+        return jsonify({'error': 'Invalid resolution'}), 400
+    if resolution != 'raw':
+        return rollup_history('soil_data', polygon_id, since, resolution)
     
-    conn = get_connection()
+    conn = get_db() if arrow else get_read_db(since)
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
-        cur = conn.cursor()
+        archived, since = history_archive('soil_data', polygon_id, since, SOIL_HISTORY_COLUMNS)
+        cur = arrow_cursor(conn) if arrow else conn.cursor()
         cur.execute("""
             SELECT timestamp, soil_temp_c, soil_moisture_percent
             FROM soil_data
-            WHERE timestamp > NOW() - INTERVAL '%s days'
+            WHERE polygon_id = %s AND timestamp > %s
             ORDER BY timestamp DESC
-        """, (days,))
+        """, (polygon_id, since))
+        
+        if arrow:
+            return arrow_response(cur, SOIL_HISTORY_COLUMNS, archived)
         
         rows = cur.fetchall()
         cur.close()
-        conn.close()
+        if archived is not None:
+            rows += cold_archive.table_rows(archived)
         
         data = [{
             'timestamp': row[0].isoformat(),
@@ -183,24 +1371,30 @@ def get_soil_history():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/ndvi')
+@conditional('ndvi_data')
+@coalesce
 def get_ndvi():
-    """Obtiene el último registro de NDVI"""
-    conn = get_connection()
+    """Obtiene el último registro de NDVI del polígono"""
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    
+    conn = get_read_db()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
         cur = conn.cursor()
-        cur.execute("""
+        cur.execute(f"""
             SELECT timestamp, image_date, ndvi_mean, ndvi_min, ndvi_max,
                    ndvi_std, ndwi_mean, cloud_coverage
-            FROM ndvi_data
+            FROM {latest_table(conn, 'ndvi_data')}
+            WHERE polygon_id = %s
             ORDER BY timestamp DESC
             LIMIT 1
-        """)
+        """, (polygon_id,))
         row = cur.fetchone()
         cur.close()
-        conn.close()
         
         if row:
             return jsonify({
@@ -219,26 +1413,45 @@ def get_ndvi():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/ndvi/history')
+@conditional('ndvi_data')
+@coalesce
 def get_ndvi_history():
-    """Obtiene historial de NDVI"""
+    """
+    Obtiene historial de NDVI del polígono (JSON o Arrow IPC). Con
+    ?resolution=hour|day se sirve desde los agregados.
+    """
     days = request.args.get('days', 30, type=int)
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    arrow = wants_arrow()
+    if arrow and pa is None:
+        return arrow_unavailable()
+    resolution = history_resolution()
+    if resolution is None:
+        return jsonify({'error': 'Invalid resolution'}), 400
+    if resolution != 'raw':
+        return rollup_history('ndvi_data', polygon_id, since, resolution)
     
-    conn = get_connection()
+    conn = get_db() if arrow else get_read_db(since)
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
-        cur = conn.cursor()
+        cur = arrow_cursor(conn) if arrow else conn.cursor()
         cur.execute("""
             SELECT timestamp, image_date, ndvi_mean, ndwi_mean
             FROM ndvi_data
-            WHERE timestamp > NOW() - INTERVAL '%s days'
+            WHERE polygon_id = %s AND timestamp > %s
             ORDER BY timestamp DESC
-        """, (days,))
+        """, (polygon_id, since))
+        
+        if arrow:
+            return arrow_response(cur, NDVI_HISTORY_COLUMNS)
         
         rows = cur.fetchall()
         cur.close()
-        conn.close()
         
         data = [{
             'timestamp': row[0].isoformat(),
@@ -252,10 +1465,90 @@ def get_ndvi_history():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ndvi/zones')
+def get_ndvi_zones():
+    """NDVI/NDWI por zona de cultivo de la última escena procesada (ver ndvi_zones.py)"""
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    
+    conn = get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT zone, index_name, image_time, satellite, cloud_coverage, pixels,
+                   mean_value, min_value, max_value, std_value, p10, p25, p50, p75, p90
+            FROM ndvi_zone_stats
+            WHERE polygon_id = %s
+              AND image_time = (SELECT MAX(image_time) FROM ndvi_zone_stats WHERE polygon_id = %s)
+            ORDER BY zone, index_name
+        """, (polygon_id, polygon_id))
+        rows = cur.fetchall()
+        cur.close()
+        
+        if not rows:
+            return jsonify({'message': 'No data available'}), 404
+        
+        zones = {}
+        for row in rows:
+            zones.setdefault(row[0], {})[row[1]] = {
+                'pixels': row[5],
+                'mean': row[6],
+                'min': row[7],
+                'max': row[8],
+                'std': row[9],
+                'percentiles': {'p10': row[10], 'p25': row[11], 'p50': row[12],
+                                'p75': row[13], 'p90': row[14]}
+            }
+        return jsonify({
+            'image_time': rows[0][2].isoformat(),
+            'satellite': rows[0][3],
+            'cloud_coverage': float(rows[0][4]) if rows[0][4] is not None else None,
+            'zones': zones
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/polygons')
+def list_polygons():
+    """Polígonos del registro (ver polygon_registry.py); ?geometry=1 incluye el GeoJSON"""
+    conn = get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    try:
+        polygons = polygon_registry.cached_polygons(conn)
+        with_geometry = request.args.get('geometry') == '1'
+        return jsonify({
+            'default': DEFAULT_POLYGON_ID,
+            'count': len(polygons),
+            'polygons': [{
+                'id': polygon['id'],
+                'name': polygon['name'],
+                'area_ha': polygon['area'],
+                'center': {'lat': polygon['center'][1], 'lon': polygon['center'][0]}
+                          if polygon['center'] else None,
+                **({'geo_json': polygon['geo_json']} if with_geometry else {})
+            } for polygon in polygons]
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/forecast')
+@conditional('forecast_data')
+@coalesce
 def get_forecast():
-    """Obtiene el pronóstico más reciente"""
-    conn = get_connection()
+    """Obtiene el pronóstico más reciente del polígono (la última emisión)"""
+    polygon_id = get_polygon()
+    if not polygon_id:
+        return jsonify({'error': 'Missing polygon parameter'}), 400
+    
+    conn = get_read_db()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
@@ -263,16 +1556,16 @@ def get_forecast():
         cur = conn.cursor()
         cur.execute("""
             SELECT forecast_date, temp_min_c, temp_max_c, temp_avg_c,
-                   humidity_avg, precipitation_mm
+                   humidity_avg, precipitation_mm, issued_at
             FROM forecast_data
-            WHERE forecast_date >= CURRENT_DATE
+            WHERE polygon_id = %s AND forecast_date >= CURRENT_DATE
+              AND issued_at = (SELECT MAX(issued_at) FROM forecast_data WHERE polygon_id = %s)
             ORDER BY forecast_date
             LIMIT 5
-        """)
+        """, (polygon_id, polygon_id))
         
         rows = cur.fetchall()
         cur.close()
-        conn.close()
         
         data = [{
             'date': row[0].isoformat(),
@@ -287,6 +1580,7 @@ def get_forecast():
         
         return jsonify({
             'days': len(data),
+            'issued_at': rows[0][6].isoformat() if rows else None,
             'total_precipitation_mm': round(total_precip, 1),
             'forecast': data
         })
@@ -294,31 +1588,92 @@ def get_forecast():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+STATS_TABLES = ['weather_data', 'soil_data', 'ndvi_data', 'forecast_data']
+
 @app.route('/api/stats')
+@conditional(*STATS_TABLES, all_polygons=True)
+@coalesce
 def get_stats():
-    """Obtiene estadísticas generales"""
-    conn = get_connection()
+    """
+    Obtiene estadísticas generales desde table_stats (mantenida por triggers).
+
+    Query params:
+        mode: 'stats' (por defecto), 'estimate' (conteo aproximado del
+              planificador, tiempo constante) o 'exact' (COUNT(*) completo)
+        polygon: limita el detalle y los conteos a un polígono, por ID o
+                 nombre (opcional; 404 si no tiene datos)
+    """
+    mode = request.args.get('mode', 'stats')
+    if mode not in ('stats', 'estimate', 'exact'):
+        return jsonify({'error': f'Invalid mode: {mode}'}), 400
+    
+    conn = get_db()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
+        polygon_id = requested_polygon()
         cur = conn.cursor()
         
-        # Contar registros
-        stats = {}
-        for table in ['weather_data', 'soil_data', 'ndvi_data', 'forecast_data']:
-            cur.execute(f"SELECT COUNT(*) FROM {table}")
-            stats[table.replace('_data', '_records')] = cur.fetchone()[0]
+        # Estadísticas por polígono
+        cur.execute("""
+            SELECT table_name, polygon_id, row_count, first_timestamp,
+                   last_timestamp, last_created_at,
+                   EXTRACT(EPOCH FROM last_created_at - last_timestamp),
+                   EXTRACT(EPOCH FROM NOW() - last_created_at)
+            FROM table_stats
+            WHERE %(polygon)s IS NULL OR polygon_id = %(polygon)s
+            ORDER BY polygon_id, table_name
+        """, {'polygon': polygon_id})
+        rows = cur.fetchall()
+        if polygon_id and not rows:
+            cur.close()
+            return jsonify({'message': 'No data available'}), 404
+        
+        stats = {table.replace('_data', '_records'): 0 for table in STATS_TABLES}
+        polygons = {}
+        last_update = None
+        for row in rows:
+            key = row[0].replace('_data', '_records')
+            stats[key] = stats.get(key, 0) + row[2]
+            polygons.setdefault(row[1], {})[row[0]] = {
+                'records': row[2],
+                'first_timestamp': row[3].isoformat() if row[3] else None,
+                'last_timestamp': row[4].isoformat() if row[4] else None,
+                'last_ingest': row[5].isoformat() if row[5] else None,
+                'ingestion_lag_seconds': float(row[6]) if row[6] is not None else None,
+                'seconds_since_ingest': float(row[7]) if row[7] is not None else None
+            }
+            if row[0] == 'weather_data' and row[4] and (last_update is None or row[4] > last_update):
+                last_update = row[4]
         
-        # Última actualización
-        cur.execute("SELECT MAX(timestamp) FROM weather_data")
-        last_update = cur.fetchone()[0]
+        # Conteos globales según el modo
+        if mode == 'estimate' and not polygon_id:
+            # Las tablas particionadas no tienen reltuples propio: se suma
+            # el de sus particiones
+            cur.execute("""
+                SELECT parent.relname, SUM(GREATEST(c.reltuples, 0))::BIGINT
+                FROM pg_class parent
+                LEFT JOIN pg_inherits i ON i.inhparent = parent.oid
+                JOIN pg_class c ON c.oid = COALESCE(i.inhrelid, parent.oid)
+                WHERE parent.relname = ANY(%s) AND parent.relkind IN ('r', 'p')
+                GROUP BY parent.relname
+            """, (STATS_TABLES,))
+            for table, estimate in cur.fetchall():
+                stats[table.replace('_data', '_records')] = estimate
+        elif mode == 'exact':
+            for table in STATS_TABLES:
+                cur.execute(
+                    f"SELECT COUNT(*) FROM {table} WHERE %(polygon)s IS NULL OR polygon_id = %(polygon)s",
+                    {'polygon': polygon_id})
+                stats[table.replace('_data', '_records')] = cur.fetchone()[0]
         
         cur.close()
-        conn.close()
         
         return jsonify({
             'records': stats,
+            'mode': mode,
+            'polygons': polygons,
             'last_update': last_update.isoformat() if last_update else None,
             'database': 'Neon PostgreSQL'
         })
@@ -341,10 +1696,17 @@ if __name__ == '__main__':
     print("    GET /api/soil/history   - Historial suelo")
     print("    GET /api/ndvi           - NDVI actual")
     print("    GET /api/ndvi/history   - Historial NDVI")
+    print("    GET /api/ndvi/zones     - NDVI por zona de cultivo")
+    print("    GET /api/polygons       - Registro de polígonos")
     print("    GET /api/forecast       - Pronóstico 5 días")
+    print("    GET /api/latest         - Estado actual de varios polígonos")
     print("    GET /api/stats          - Estadísticas")
+    print("    GET /api/events         - Cambios en vivo (SSE)")
+    print("    GET /api/export/<tipo>  - Exportar CSV (COPY)")
+    print("    POST /api/ingest        - Lecturas de sensores")
+    print("    GET /metrics            - Métricas (Prometheus)")
     print("=" * 50)
     print("  Iniciando servidor en http://localhost:5000")
     print("=" * 50 + "\n")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+AgroMonitor - Benchmark del API
+Siembra una base PostgreSQL local con datos sintéticos (varios años y
+polígonos, usando db_schema.sql) y mide throughput y latencia p50/p95/p99
+de cada endpoint de api_server.py con concurrencia configurable.
+
+Uso:
+    # 1. Crear y sembrar la BD local (¡no usar la BD de producción!)
+    python benchmark_api.py seed --dsn postgresql://localhost/agro_bench --years 3 --polygons 20
+
+    # Misma --seed => mismos valores sintéticos (random() de PostgreSQL)
+    python benchmark_api.py seed --dsn postgresql://localhost/agro_bench --reset --seed 7
+
+    # 2. Levantar el API contra esa BD (db_config.py / DATABASE_URL) y medir
+    python benchmark_api.py run --url http://localhost:5000 --concurrency 16 --duration 30 \\
+        --output bench_v2.json --compare bench_v1.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+SCRIPT_DIR = Path(__file__).parent
+SCHEMA_FILE = SCRIPT_DIR / "db_schema.sql"
+
+POLYGON_PREFIX = 'bench-poly-'
+
+# Endpoints medidos: (nombre, ruta, parámetros extra)
+ENDPOINTS = [
+    ('weather', '/api/weather', {}),
+    ('weather_history_7d', '/api/weather/history', {'days': 7}),
+    ('weather_history_365d', '/api/weather/history', {'days': 365, 'limit': 10000, 'resolution': 'day'}),
+    ('weather_history_365d_raw', '/api/weather/history', {'days': 365, 'limit': 10000, 'resolution': 'raw'}),
+    ('soil', '/api/soil', {}),
+    ('soil_history_30d', '/api/soil/history', {'days': 30}),
+    ('ndvi', '/api/ndvi', {}),
+    ('ndvi_history_365d', '/api/ndvi/history', {'days': 365, 'resolution': 'day'}),
+    ('forecast', '/api/forecast', {}),
+    ('latest', '/api/latest', {}),
+    ('stats', '/api/stats', {}),
+    ('stats_estimate', '/api/stats', {'mode': 'estimate'})
+]
+
+# Si el p95 empeora más que esto respecto a la línea base, se marca regresión
+REGRESSION_THRESHOLD = 0.20
+
+# ============================================
+# SIEMBRA DE DATOS SINTÉTICOS
+# ============================================
+
+SEED_SQL = {
+    # Clima horario con ciclo diario y estacional
+    'weather_data': """
+        INSERT INTO weather_data (
+            timestamp, polygon_id, temperature_c, feels_like_c, temp_min_c, temp_max_c,
+            humidity_percent, pressure_hpa, wind_speed_ms, wind_deg,
+            clouds_percent, weather_main, weather_description, rain_1h_mm, created_at
+        )
+        SELECT ts, p.id, t, t + 2, t - 1, t + 1,
+               (70 + 20 * random())::INT, (1005 + 10 * random())::INT,
+               round((5 * random())::NUMERIC, 2), (360 * random())::INT,
+               (100 * random())::INT,
+               (ARRAY['Clear', 'Clouds', 'Rain'])[1 + (random() * 2)::INT],
+               'synthetic', round((20 * GREATEST(random() - 0.9, 0))::NUMERIC, 2), ts
+        FROM generate_series(%(start)s::TIMESTAMPTZ, NOW(), INTERVAL '1 hour') ts
+        CROSS JOIN unnest(%(polygons)s::TEXT[]) AS p(id)
+        CROSS JOIN LATERAL (
+            SELECT round((26 + 4 * sin(extract(epoch FROM ts) / 86400 * 2 * pi())
+                          + 2 * sin(extract(doy FROM ts) / 365 * 2 * pi())
+                          + random())::NUMERIC, 2) AS t
+        ) v
+    """,
+    # Suelo horario
+    'soil_data': """
+        INSERT INTO soil_data (
+            timestamp, polygon_id, soil_temp_c, soil_moisture, soil_moisture_percent, created_at
+        )
+        SELECT ts, p.id, round((24 + 3 * random())::NUMERIC, 2), m, round(m * 100, 2), ts
+        FROM generate_series(%(start)s::TIMESTAMPTZ, NOW(), INTERVAL '1 hour') ts
+        CROSS JOIN unnest(%(polygons)s::TEXT[]) AS p(id)
+        CROSS JOIN LATERAL (SELECT round((0.2 + 0.2 * random())::NUMERIC, 4) AS m) v
+    """,
+    # Una escena satelital cada 5 días
+    'ndvi_data': """
+        INSERT INTO ndvi_data (
+            timestamp, polygon_id, image_date, ndvi_mean, ndvi_min, ndvi_max,
+            ndvi_std, ndwi_mean, cloud_coverage, created_at
+        )
+        SELECT ts, p.id, ts, n, n - 0.2, n + 0.1, 0.05,
+               round((0.1 * random())::NUMERIC, 4), round((100 * random())::NUMERIC, 2), ts
+        FROM generate_series(%(start)s::TIMESTAMPTZ, NOW(), INTERVAL '5 days') ts
+        CROSS JOIN unnest(%(polygons)s::TEXT[]) AS p(id)
+        CROSS JOIN LATERAL (
+            SELECT round((0.6 + 0.2 * sin(extract(doy FROM ts) / 365 * 2 * pi())
+                          + 0.05 * random())::NUMERIC, 4) AS n
+        ) v
+    """,
+    # Pronóstico diario de 5 días emitido cada día (una emisión por día)
+    'forecast_data': """
+        INSERT INTO forecast_data (
+            timestamp, polygon_id, forecast_date, issued_at, lead_days, temp_min_c,
+            temp_max_c, temp_avg_c, humidity_avg, precipitation_mm, created_at
+        )
+        SELECT ts, p.id, (ts AT TIME ZONE 'UTC')::DATE + d, date_trunc('hour', ts, 'UTC'), d,
+               round((22 + d * (random() - 0.5))::NUMERIC, 2),
+               round((31 + d * (random() - 0.5))::NUMERIC, 2),
+               round((26.5 + d * (random() - 0.5))::NUMERIC, 2),
+               (75 + 10 * random())::INT, round((20 * random())::NUMERIC, 2), ts
+        FROM generate_series(%(start)s::TIMESTAMPTZ, NOW(), INTERVAL '1 day') ts
+        CROSS JOIN generate_series(0, 4) d
+        CROSS JOIN unnest(%(polygons)s::TEXT[]) AS p(id)
+    """
+}
+
+
+def seed(args):
+    """Crea el esquema y carga los datos sintéticos"""
+    import psycopg2
+    from db_maintenance import ensure_partitions
+
+    polygons = [f"{POLYGON_PREFIX}{i:03d}" for i in range(args.polygons)]
+    conn = psycopg2.connect(args.dsn)
+    cur = conn.cursor()
+
+    print(f"[SEED] Aplicando {SCHEMA_FILE.name}...")
+    cur.execute(SCHEMA_FILE.read_text(encoding='utf-8'))
+    conn.commit()
+
+    if args.reset:
+        print("[SEED] Borrando datos anteriores del benchmark...")
+        for table in SEED_SQL:
+            cur.execute(f"DELETE FROM {table} WHERE polygon_id LIKE %s", (POLYGON_PREFIX + '%',))
+        cur.execute("DELETE FROM observation_rollups WHERE polygon_id LIKE %s", (POLYGON_PREFIX + '%',))
+        conn.commit()
+
+    cur.execute("SELECT NOW() - %s * INTERVAL '1 year'", (args.years,))
+    start = cur.fetchone()[0]
+
+    # Una partición por mes del rango sembrado (si no, todo cae en DEFAULT)
+    created = ensure_partitions(conn, start=start)
+    print(f"[SEED] Particiones creadas: {len(created)}")
+
+    # random() usa la semilla de la sesión: fijarla en esta misma conexión
+    # hace que dos siembras con la misma --seed generen los mismos valores.
+    # setseed() acepta [-1, 1], así que el entero se lleva a [0, 1).
+    cur.execute("SELECT setseed(%s)", ((args.seed % 2**31) / 2**31,))
+    print(f"[SEED] Semilla: {args.seed}")
+    for table, sql in SEED_SQL.items():
+        t0 = time.perf_counter()
+        cur.execute(sql, {'start': start, 'polygons': polygons})
+        print(f"[SEED] {table}: {cur.rowcount} filas en {time.perf_counter() - t0:.1f}s")
+        conn.commit()
+
+    # Estadísticas consistentes y planes con datos reales
+    cur.execute("SELECT refresh_table_stats()")
+    conn.commit()
+    conn.autocommit = True
+    for table in SEED_SQL:
+        cur.execute(f"VACUUM ANALYZE {table}")
+
+    cur.close()
+    conn.close()
+    print(f"[SEED] Listo: {args.polygons} polígonos, {args.years} años, semilla {args.seed}")
+
+# ============================================
+# CARGA Y MEDICIÓN
+# ============================================
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, not_modified, elapsed):
+    """Resumen de un endpoint: percentiles en ms y throughput"""
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'not_modified': not_modified,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(values, 50) * 1000, 2) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 2) if values else None,
+        'p99_ms': round(percentile(values, 99) * 1000, 2) if values else None,
+        'max_ms': round(values[-1] * 1000, 2) if values else None
+    }
+
+
+def run_endpoint(args, name, path, params):
+    """Carga un endpoint durante args.duration segundos con args.concurrency hilos"""
+    polygons = [f"{POLYGON_PREFIX}{i:03d}" for i in range(args.polygons)]
+    latencies = []
+    counters = {'errors': 0, 'not_modified': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(seed_value):
+        rng = random.Random(seed_value)
+        session = requests.Session()
+        etags = {}
+        local = []
+        errors = not_modified = 0
+        while time.perf_counter() < deadline:
+            polygon = rng.choice(polygons)
+            headers = {'Accept-Encoding': 'gzip, br'}
+            if args.conditional and polygon in etags:
+                headers['If-None-Match'] = etags[polygon]
+            t0 = time.perf_counter()
+            try:
+                response = session.get(args.url + path, params=dict(params, polygon=polygon),
+                                       headers=headers, timeout=60)
+                response.content
+                local.append(time.perf_counter() - t0)
+                if response.status_code == 304:
+                    not_modified += 1
+                elif response.status_code >= 400:
+                    errors += 1
+                elif 'ETag' in response.headers:
+                    etags[polygon] = response.headers['ETag']
+            except requests.RequestException:
+                errors += 1
+        with lock:
+            latencies.extend(local)
+            counters['errors'] += errors
+            counters['not_modified'] += not_modified
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return summarize(latencies, counters['errors'], counters['not_modified'], elapsed)
+
+
+def compare(results, baseline):
+    """Compara p95 contra la línea base; devuelve los endpoints con regresión"""
+    regressions = []
+    print("\n" + "=" * 70)
+    print(f"  {'COMPARACION p95':<30} {'base':>10} {'actual':>10} {'cambio':>10}")
+    print("=" * 70)
+    for name, current in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get('p95_ms') or not current.get('p95_ms'):
+            continue
+        change = (current['p95_ms'] - base['p95_ms']) / base['p95_ms']
+        flag = '  REGRESION' if change > REGRESSION_THRESHOLD else ''
+        print(f"  {name:<30} {base['p95_ms']:>10} {current['p95_ms']:>10} {change:>+9.0%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def run(args):
+    """Mide todos los endpoints (o los elegidos con --only)"""
+    selected = [e for e in ENDPOINTS if not args.only or e[0] in args.only]
+
+    # Calentamiento: conexiones, cachés de planes, réplica
+    for _, path, params in selected:
+        try:
+            requests.get(args.url + path, params=dict(params, polygon=f"{POLYGON_PREFIX}000"), timeout=60)
+        except requests.RequestException:
+            pass
+
+    results = {}
+    print("=" * 90)
+    print(f"  {'ENDPOINT':<24} {'req':>7} {'err':>5} {'304':>6} {'rps':>8} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    print("=" * 90)
+    for name, path, params in selected:
+        r = run_endpoint(args, name, path, params)
+        results[name] = r
+        print(f"  {name:<24} {r['requests']:>7} {r['errors']:>5} {r['not_modified']:>6} "
+              f"{r['throughput_rps']:>8} {r['p50_ms']!s:>9} {r['p95_ms']!s:>9} {r['p99_ms']!s:>9}")
+
+    report = {
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'conditional': args.conditional,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[OK] Resultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print(f"\n[REGRESION] p95 peor que +{REGRESSION_THRESHOLD:.0%}: {', '.join(regressions)}")
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de api_server.py")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_seed = sub.add_parser('seed', help='Crea el esquema y siembra datos sintéticos')
+    p_seed.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'),
+                        required=not os.environ.get('BENCH_DATABASE_URL'),
+                        help='BD PostgreSQL local (o BENCH_DATABASE_URL)')
+    p_seed.add_argument('--years', type=int, default=3)
+    p_seed.add_argument('--polygons', type=int, default=20)
+    p_seed.add_argument('--reset', action='store_true', help='Borra antes los datos del benchmark')
+    p_seed.add_argument('--seed', type=int, default=42,
+                        help='Semilla de random() para datos reproducibles')
+
+    p_run = sub.add_parser('run', help='Mide los endpoints')
+    p_run.add_argument('--url', default='http://localhost:5000')
+    p_run.add_argument('--polygons', type=int, default=20)
+    p_run.add_argument('--concurrency', type=int, default=8)
+    p_run.add_argument('--duration', type=float, default=15, help='Segundos por endpoint')
+    p_run.add_argument('--conditional', action='store_true',
+                       help='Reenvía ETags (mide el camino 304)')
+    p_run.add_argument('--only', nargs='*', help='Nombres de endpoints a medir')
+    p_run.add_argument('--output', help='Guardar resultados en JSON')
+    p_run.add_argument('--compare', help='JSON de una ejecución anterior (línea base)')
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        seed(args)
+        return True
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,358 @@
+"""
+AgroMonitor - Archivo frío de datos crudos
+Los datos horarios de clima y suelo con más de TIERING_DAYS días casi nunca
+se leen a resolución completa. Este módulo los pasa, por mes completo, a
+archivos Parquet (columnar, comprimido) y los quita de PostgreSQL; los
+agregados diarios de observation_rollups se recalculan antes y quedan en
+la BD.
+
+    <ARCHIVE_DIR>/<tabla>/polygon=<id>/month=YYYY-MM.parquet
+
+Cada mes archivado queda registrado en archived_months en la misma
+transacción que quita las filas, y el API lee esos archivos cuando un
+historial crudo llega hasta ahí (ver load_archived()).
+
+Uso:
+    python cold_archive.py [--days 90]
+
+Variables de entorno:
+    ARCHIVE_DIR     Carpeta del archivo (sin valor = desactivado)
+    TIERING_DAYS    Antigüedad mínima de los datos a archivar (default 90)
+
+Requiere pyarrow (opcional en requirements.txt).
+"""
+
+import argparse
+import os
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import psycopg2.extensions
+
+from db_maintenance import (
+    add_months, drop_partition, fix_first_timestamps, is_partitioned,
+    month_start, partition_name, prepare_session
+)
+
+# PyArrow es opcional: sin él no se archiva ni se lee el archivo
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+TIERED_TABLES = ['weather_data', 'soil_data']
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+TIERING_DAYS = int(os.environ.get('TIERING_DAYS', 90))
+
+# Clave natural de una observación dentro del archivo de un polígono
+ARCHIVE_KEY = ('source', 'timestamp')
+
+# Filas por lote al leer un mes y al borrar en tablas sin particionar
+BATCH_ROWS = 5000
+PARQUET_COMPRESSION = 'zstd'
+
+# NUMERIC -> float directamente en el driver
+FLOAT_NUMERIC = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, 'FLOAT_NUMERIC',
+    lambda value, cur: float(value) if value is not None else None)
+
+
+def is_enabled():
+    """True si hay carpeta de archivo configurada y pyarrow instalado"""
+    return bool(ARCHIVE_DIR) and pa is not None
+
+
+def arrow_type(type_code):
+    """Tipo Arrow para un OID de PostgreSQL"""
+    if type_code in (20, 21, 23):
+        return pa.int64()
+    if type_code in (700, 701, 1700):
+        return pa.float64()
+    if type_code == 1082:
+        return pa.date32()
+    if type_code in (1114, 1184):
+        return pa.timestamp('us', tz='UTC')
+    return pa.string()
+
+
+def month_bounds(month):
+    """Inicio y fin (exclusivo) del mes en UTC"""
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end_month = add_months(month, 1)
+    return start, datetime(end_month.year, end_month.month, 1, tzinfo=timezone.utc)
+
+
+def archive_path(table, polygon_id, month):
+    """Ruta relativa a ARCHIVE_DIR del archivo de un polígono y mes"""
+    return Path(table) / f"polygon={polygon_id}" / f"month={month:%Y-%m}.parquet"
+
+
+def tiering_cutoff(days=TIERING_DAYS):
+    """Primer mes que se conserva en la BD (los anteriores terminaron hace más de `days` días)"""
+    return month_start(date.today() - timedelta(days=days))
+
+
+def reaches_archive(since):
+    """True si un historial desde `since` puede incluir meses archivados"""
+    return is_enabled() and since < month_bounds(tiering_cutoff())[0]
+
+
+# ============================================
+# ESCRITURA
+# ============================================
+
+def merge_archived(existing, data):
+    """
+    Une un archivo existente con filas nuevas del mismo polígono y mes. Si
+    una fila ya estaba (misma fuente y timestamp, p. ej. porque un archivado
+    anterior escribió el Parquet pero falló antes de quitar las filas de la
+    BD) queda una sola vez, con los valores nuevos.
+    """
+    key = [c for c in ARCHIVE_KEY if c in existing.column_names and c in data.column_names]
+    new_keys = set(zip(*(data[c].to_pylist() for c in key)))
+    keep = [k not in new_keys for k in zip(*(existing[c].to_pylist() for c in key))]
+    return pa.concat_tables([existing.filter(pa.array(keep, type=pa.bool_())), data],
+                            promote_options='default')
+
+
+def write_polygon_month(base, table, polygon_id, month, schema, rows):
+    """
+    Escribe (o amplía, si llegaron filas tardías a un mes ya archivado) el
+    archivo de un polígono y mes, sin duplicar filas ya archivadas.
+
+    Returns:
+        Tuple (ruta relativa, filas en el archivo)
+    """
+    relative = archive_path(table, polygon_id, month)
+    target = Path(base) / relative
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    arrays = [pa.array(col, type=field.type) for col, field in zip(zip(*rows), schema)]
+    data = pa.Table.from_arrays(arrays, schema=schema)
+    if target.exists():
+        data = merge_archived(pq.read_table(target), data)
+
+    tmp = target.with_suffix('.parquet.tmp')
+    pq.write_table(data, tmp, compression=PARQUET_COMPRESSION)
+    tmp.replace(target)
+    return str(relative), data.num_rows
+
+
+def write_month(conn, base, table, month):
+    """
+    Exporta las filas del mes a un archivo por polígono, leyendo por lotes
+    con un cursor del lado del servidor.
+
+    Returns:
+        Dict polygon_id -> (ruta relativa, filas en el archivo, filas nuevas)
+    """
+    start, end = month_bounds(month)
+    cur = conn.cursor(name=f"archive_{table}")
+    psycopg2.extensions.register_type(FLOAT_NUMERIC, cur)
+    cur.execute(f"""
+        SELECT * FROM {table}
+        WHERE timestamp >= %s AND timestamp < %s
+        ORDER BY polygon_id, timestamp
+    """, (start, end))
+
+    rows = cur.fetchmany(BATCH_ROWS)
+    written = {}
+    if not rows:
+        cur.close()
+        return written
+
+    schema = pa.schema([(col.name, arrow_type(col.type_code)) for col in cur.description])
+    polygon_index = schema.get_field_index('polygon_id')
+    current, pending = None, []
+    while rows:
+        for row in rows:
+            if row[polygon_index] != current:
+                if pending:
+                    written[current] = (*write_polygon_month(
+                        base, table, current, month, schema, pending), len(pending))
+                current, pending = row[polygon_index], []
+            pending.append(row)
+        rows = cur.fetchmany(BATCH_ROWS)
+    written[current] = (*write_polygon_month(
+        base, table, current, month, schema, pending), len(pending))
+    cur.close()
+    return written
+
+
+def tier_month(conn, table, month, base=ARCHIVE_DIR):
+    """
+    Archiva un mes de una tabla: recalcula sus agregados, escribe los
+    Parquet, registra el mes en archived_months y quita las filas (DROP de
+    la partición o DELETE por lotes si la tabla no está particionada).
+
+    Returns:
+        Filas archivadas
+    """
+    start, end = month_bounds(month)
+    cur = conn.cursor()
+    prepare_session(cur)
+
+    # Agregados diarios exactos antes de quitar las filas crudas
+    cur.execute("SELECT refresh_rollups(%s, %s)", (start, end))
+    conn.commit()
+
+    written = write_month(conn, base, table, month)
+    if not written:
+        cur.close()
+        return 0
+
+    cur.executemany("""
+        INSERT INTO archived_months (table_name, polygon_id, month, path, row_count)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (table_name, polygon_id, month) DO UPDATE SET
+            path = EXCLUDED.path,
+            row_count = EXCLUDED.row_count,
+            archived_at = NOW()
+    """, [(table, polygon_id, month, path, count)
+          for polygon_id, (path, count, _) in written.items()])
+
+    name = partition_name(table, month)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cur.fetchone()[0] and is_partitioned(cur, table):
+        drop_partition(cur, table, name)
+    else:
+        # El registro va en la primera transacción: si el proceso se corta a
+        # mitad, el API ya lee el mes del archivo e ignora lo que queda en la BD
+        while True:
+            cur.execute(f"""
+                DELETE FROM {table}
+                WHERE timestamp >= %s AND timestamp < %s
+                  AND id IN (
+                      SELECT id FROM {table}
+                      WHERE timestamp >= %s AND timestamp < %s
+                      LIMIT %s
+                  )
+            """, (start, end, start, end, BATCH_ROWS))
+            deleted = cur.rowcount
+            conn.commit()
+            if deleted < BATCH_ROWS:
+                break
+
+    fix_first_timestamps(cur, table)
+    conn.commit()
+    cur.close()
+    return sum(new for _, _, new in written.values())
+
+
+def pending_months(cur, table, cutoff):
+    """Meses con filas anteriores a `cutoff`, del más viejo al más nuevo"""
+    cur.execute(f"SELECT MIN(timestamp) FROM {table}")
+    oldest = cur.fetchone()[0]
+    months = []
+    if oldest is not None:
+        month = month_start(oldest.astimezone(timezone.utc))
+        while month < cutoff:
+            months.append(month)
+            month = add_months(month, 1)
+    return months
+
+
+def run_tiering(conn, base=ARCHIVE_DIR, days=TIERING_DAYS, tables=None):
+    """
+    Archiva todos los meses completos con más de `days` días de antigüedad.
+
+    Returns:
+        Lista de (tabla, mes, filas archivadas)
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow no está instalado")
+
+    cutoff = tiering_cutoff(days)
+    cur = conn.cursor()
+    prepare_session(cur)
+    months = {table: pending_months(cur, table, cutoff) for table in tables or TIERED_TABLES}
+    conn.commit()
+    cur.close()
+
+    archived = []
+    for table, table_months in months.items():
+        for month in table_months:
+            rows = tier_month(conn, table, month, base)
+            if rows:
+                archived.append((table, month, rows))
+    return archived
+
+
+# ============================================
+# LECTURA
+# ============================================
+
+def load_archived(conn, table, polygon_id, since, columns, base=ARCHIVE_DIR):
+    """
+    Filas archivadas del polígono con timestamp > since, más recientes
+    primero.
+
+    Args:
+        conn: Conexión al primario (para leer archived_months)
+        columns: Columnas a leer del Parquet
+
+    Returns:
+        Tuple (pa.Table o None, hot_since): hot_since es el `since` a usar
+        en la BD, posterior al último mes archivado, para no duplicar filas
+        que todavía estén en la réplica local o a medio borrar
+    """
+    if not reaches_archive(since):
+        return None, since
+
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT month, path FROM archived_months
+        WHERE table_name = %s AND polygon_id = %s AND month >= %s
+        ORDER BY month
+    """, (table, polygon_id, month_start(since.astimezone(timezone.utc))))
+    months = cur.fetchall()
+    cur.close()
+    if not months:
+        return None, since
+
+    tables = [
+        pq.read_table(Path(base) / path, columns=columns, filters=[('timestamp', '>', since)])
+        for _, path in months
+    ]
+    data = pa.concat_tables(tables, promote_options='default')
+    archive_until = month_bounds(add_months(months[-1][0], 1))[0]
+    return data.sort_by([('timestamp', 'descending')]), max(since, archive_until)
+
+
+def table_rows(data):
+    """Filas de una tabla Arrow como tuplas (mismo formato que fetchall())"""
+    return list(zip(*(column.to_pylist() for column in data.columns)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivo frío de datos crudos de AgroMonitor")
+    parser.add_argument('--days', type=int, default=TIERING_DAYS,
+                        help='Antigüedad mínima de los meses a archivar')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, required=ARCHIVE_DIR is None)
+    args = parser.parse_args()
+
+    if pa is None:
+        print("[ERROR] pyarrow no está instalado (pip install pyarrow)")
+        return 1
+
+    from db_config import get_connection
+    conn = get_connection()
+    if not conn:
+        print("[ERROR] No se pudo conectar a la base de datos")
+        return 1
+
+    try:
+        archived = run_tiering(conn, args.archive_dir, args.days)
+        for table, month, rows in archived:
+            print(f"[OK] {table} {month:%Y-%m}: {rows} filas archivadas")
+        if not archived:
+            print("[OK] Nada para archivar")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,402 @@
+"""
+AgroMonitor - Mantenimiento de particiones
+Las tablas de observaciones están particionadas por mes (ver db_schema.sql).
+Este módulo crea las particiones de los meses siguientes antes de que
+lleguen datos y aplica la retención quitando particiones completas: un
+DETACH + DROP no deja filas muertas ni índices inflados, a diferencia de un
+DELETE masivo.
+
+Uso:
+    python db_maintenance.py partitions [--ahead 3]
+    python db_maintenance.py retention --months 24 [--archive-dir archive]
+    python db_maintenance.py migrate        # convierte tablas sin particionar
+    python db_maintenance.py rollups [--days 3 | --all]
+
+Variables de entorno (usadas por scheduler.py):
+    PARTITION_MONTHS_AHEAD  Meses futuros a crear (default 3)
+    RETENTION_MONTHS        Meses completos a conservar (sin valor = sin retención)
+    ARCHIVE_DIR             Carpeta para exportar particiones antes de quitarlas
+    ROLLUP_REFRESH_DAYS     Días de agregados a recalcular (default 3)
+"""
+
+import argparse
+import gzip
+import os
+import re
+from datetime import date
+from pathlib import Path
+
+# Tabla -> columna de particionado
+PARTITIONED_TABLES = {
+    'weather_data': 'timestamp',
+    'soil_data': 'timestamp',
+    'ndvi_data': 'timestamp',
+    'forecast_data': 'forecast_date'
+}
+
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+RETENTION_MONTHS = int(os.environ['RETENTION_MONTHS']) if os.environ.get('RETENTION_MONTHS') else None
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+ROLLUP_REFRESH_DAYS = int(os.environ.get('ROLLUP_REFRESH_DAYS', 3))
+
+SCHEMA_FILE = Path(__file__).resolve().parent / "db_schema.sql"
+
+# Crear/quitar particiones toma locks sobre la tabla padre: mejor fallar y
+# reintentar en la próxima corrida que encolar las consultas del API detrás
+LOCK_TIMEOUT = '5s'
+
+PARTITION_NAME = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def add_months(d, months):
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def prepare_session(cur):
+    """Límites de mes en UTC y espera acotada por locks"""
+    cur.execute("SET TIME ZONE 'UTC'")
+    cur.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+
+
+def is_partitioned(cur, table):
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table
+            WHERE partrelid = to_regclass(%s)
+        )
+    """, (table,))
+    return cur.fetchone()[0]
+
+
+def list_partitions(cur, table):
+    """Particiones mensuales de la tabla como [(nombre, mes)], en orden"""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    partitions = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def create_partition(cur, table, month):
+    """
+    Crea la partición del mes. Si la partición DEFAULT ya tiene filas de ese
+    mes (datos que llegaron antes de crearla) se mueven a la nueva partición.
+
+    Returns:
+        True si se creó, False si ya existía
+    """
+    name = partition_name(table, month)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cur.fetchone()[0]:
+        return False
+
+    column = PARTITIONED_TABLES[table]
+    bounds = (month, add_months(month, 1))
+    default = f"{table}_default"
+
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (default,))
+    pending = False
+    if cur.fetchone()[0]:
+        cur.execute(f"""
+            SELECT EXISTS (SELECT 1 FROM {default} WHERE {column} >= %s AND {column} < %s)
+        """, bounds)
+        pending = cur.fetchone()[0]
+
+    if pending:
+        # Las inserciones directas en particiones no disparan los triggers
+        # de la tabla padre: table_stats no cambia al mover las filas
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+        cur.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", bounds)
+        cur.execute(f"""
+            WITH moved AS (
+                DELETE FROM {default} WHERE {column} >= %s AND {column} < %s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, bounds)
+        print(f"   [AVISO] {cur.rowcount} filas movidas de {default} a {name}")
+        cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+    else:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", bounds)
+    return True
+
+
+def ensure_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD, start=None, tables=None):
+    """
+    Crea las particiones desde el mes de `start` (por defecto el actual)
+    hasta `months_ahead` meses en el futuro.
+
+    Returns:
+        Lista de particiones creadas
+    """
+    cur = conn.cursor()
+    prepare_session(cur)
+    first = month_start(start or date.today())
+    last = add_months(month_start(date.today()), months_ahead)
+
+    created = []
+    for table in tables or PARTITIONED_TABLES:
+        if not is_partitioned(cur, table):
+            print(f"   [AVISO] {table} no está particionada (ver: python db_maintenance.py migrate)")
+            continue
+        month = first
+        while month <= last:
+            if create_partition(cur, table, month):
+                created.append(partition_name(table, month))
+            month = add_months(month, 1)
+        conn.commit()
+
+    cur.close()
+    return created
+
+
+def archive_partition(cur, name, archive_dir, table):
+    """Exporta la partición a CSV comprimido antes de quitarla"""
+    target_dir = Path(archive_dir) / table
+    target_dir.mkdir(parents=True, exist_ok=True)
+    target = target_dir / f"{name}.csv.gz"
+    tmp = target.with_suffix('.gz.tmp')
+    with gzip.open(tmp, 'wb', compresslevel=6) as f:
+        cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    tmp.replace(target)
+    return target
+
+
+def drop_partition(cur, table, name, archive_dir=None):
+    """
+    Descuenta las filas de table_stats, archiva (opcional) y quita la
+    partición. DROP no dispara los triggers de borrado, por eso el descuento
+    se hace aquí.
+    """
+    cur.execute(f"""
+        UPDATE table_stats s
+        SET row_count = GREATEST(s.row_count - d.n, 0)
+        FROM (SELECT polygon_id, COUNT(*) AS n FROM {name} GROUP BY polygon_id) d
+        WHERE s.table_name = %s AND s.polygon_id = d.polygon_id
+    """, (table,))
+
+    archived = archive_partition(cur, name, archive_dir, table) if archive_dir else None
+    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+    cur.execute(f"DROP TABLE {name}")
+    return archived
+
+
+def fix_first_timestamps(cur, table):
+    """
+    Recalcula first_timestamp en table_stats tras quitar filas viejas
+    (búsqueda por índice por polígono) y borra los polígonos sin filas.
+    """
+    cur.execute(f"""
+        UPDATE table_stats s
+        SET first_timestamp = (
+            SELECT MIN(t.timestamp) FROM {table} t WHERE t.polygon_id = s.polygon_id
+        )
+        WHERE s.table_name = %s
+    """, (table,))
+    cur.execute("DELETE FROM table_stats WHERE table_name = %s AND row_count = 0", (table,))
+
+
+def apply_retention(conn, retention_months, archive_dir=None, tables=None):
+    """
+    Quita las particiones de meses anteriores a los últimos
+    `retention_months` meses completos (el mes actual no cuenta).
+
+    Returns:
+        Lista de (partición, archivo o None) quitadas
+    """
+    cutoff = add_months(month_start(date.today()), -retention_months)
+    cur = conn.cursor()
+    prepare_session(cur)
+
+    removed = []
+    for table in tables or PARTITIONED_TABLES:
+        if not is_partitioned(cur, table):
+            continue
+        expired = [name for name, month in list_partitions(cur, table) if month < cutoff]
+        if not expired:
+            continue
+
+        for name in expired:
+            removed.append((name, drop_partition(cur, table, name, archive_dir)))
+        fix_first_timestamps(cur, table)
+        conn.commit()
+
+    cur.close()
+    return removed
+
+
+def migrate_table(cur, table, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Convierte una tabla sin particionar: la renombra, crea la versión
+    particionada con las mismas columnas, copia las filas y borra la vieja.
+    Índices, vistas y triggers los recrea db_schema.sql (ver migrate()).
+    """
+    column = PARTITIONED_TABLES[table]
+    legacy = f"{table}_legacy"
+
+    cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+    cur.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    cur.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+    cur.execute(f"""
+        CREATE TABLE {table} (
+            LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+            PRIMARY KEY (id, {column})
+        ) PARTITION BY RANGE ({column})
+    """)
+    # La secuencia del SERIAL se borraría junto con la tabla vieja
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (legacy,))
+    sequence = cur.fetchone()[0]
+    if sequence:
+        cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+
+    cur.execute(f"SELECT MIN({column}) FROM {legacy}")
+    oldest = cur.fetchone()[0] or date.today()
+    month = month_start(oldest)
+    last = add_months(month_start(date.today()), months_ahead)
+    while month <= last:
+        create_partition(cur, table, month)
+        month = add_months(month, 1)
+
+    cur.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+    copied = cur.rowcount
+    cur.execute(f"SELECT COUNT(*) FROM {legacy}")
+    if cur.fetchone()[0] != copied:
+        raise RuntimeError(f"{table}: el conteo de filas copiadas no coincide")
+
+    # CASCADE quita lo que dependa de la tabla vieja; db_schema.sql lo recrea
+    cur.execute(f"DROP TABLE {legacy} CASCADE")
+    return copied
+
+
+def migrate(conn, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Migra todas las tablas sin particionar en una sola transacción y vuelve
+    a aplicar db_schema.sql (índices, vistas, triggers, particiones DEFAULT).
+    """
+    cur = conn.cursor()
+    prepare_session(cur)
+    migrated = {}
+    try:
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(cur, table):
+                continue
+            print(f"   Migrando {table}...")
+            migrated[table] = migrate_table(cur, table, months_ahead)
+        if migrated:
+            cur.execute("RESET lock_timeout")
+            cur.execute(SCHEMA_FILE.read_text(encoding='utf-8'))
+            cur.execute("SELECT refresh_table_stats()")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return migrated
+
+
+def refresh_rollups(conn, days=ROLLUP_REFRESH_DAYS):
+    """
+    Recalcula los agregados de los últimos `days` días (None = todo). Los
+    triggers ya cubren las inserciones, incluidas las tardías; esto corrige
+    filas actualizadas o borradas.
+    """
+    cur = conn.cursor()
+    since = None
+    if days is not None:
+        cur.execute("SELECT NOW() - %s * INTERVAL '1 day'", (days,))
+        since = cur.fetchone()[0]
+    cur.execute("SELECT refresh_rollups(%s)", (since,))
+    conn.commit()
+    cur.close()
+
+
+def run_maintenance():
+    """
+    Crea particiones futuras, archiva los datos crudos viejos (si hay
+    ARCHIVE_DIR y pyarrow), aplica la retención y refresca los agregados
+    """
+    import cold_archive
+    from db_config import get_connection
+
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        result = {'created': ensure_partitions(conn), 'archived': [], 'removed': []}
+        if cold_archive.is_enabled():
+            result['archived'] = cold_archive.run_tiering(conn)
+        if RETENTION_MONTHS:
+            result['removed'] = apply_retention(conn, RETENTION_MONTHS, ARCHIVE_DIR)
+        refresh_rollups(conn)
+        return result
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de particiones de AgroMonitor")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_parts = sub.add_parser('partitions', help='Crea las particiones de los meses siguientes')
+    p_parts.add_argument('--ahead', type=int, default=PARTITION_MONTHS_AHEAD)
+
+    p_ret = sub.add_parser('retention', help='Quita particiones de meses viejos')
+    p_ret.add_argument('--months', type=int, default=RETENTION_MONTHS, required=RETENTION_MONTHS is None)
+    p_ret.add_argument('--archive-dir', default=ARCHIVE_DIR,
+                       help='Exportar cada partición a CSV.gz antes de quitarla')
+
+    p_mig = sub.add_parser('migrate', help='Convierte tablas existentes a particionadas')
+    p_mig.add_argument('--ahead', type=int, default=PARTITION_MONTHS_AHEAD)
+
+    p_roll = sub.add_parser('rollups', help='Recalcula los agregados por hora y día')
+    p_roll.add_argument('--days', type=int, default=ROLLUP_REFRESH_DAYS)
+    p_roll.add_argument('--all', action='store_true', help='Recalcular todo el historial')
+
+    args = parser.parse_args()
+
+    from db_config import get_connection
+    conn = get_connection()
+    if not conn:
+        print("[ERROR] No se pudo conectar a la base de datos")
+        return 1
+
+    try:
+        if args.command == 'partitions':
+            created = ensure_partitions(conn, args.ahead)
+            print(f"[OK] Particiones creadas: {', '.join(created) or 'ninguna'}")
+        elif args.command == 'retention':
+            for name, archived in apply_retention(conn, args.months, args.archive_dir):
+                print(f"[OK] {name} quitada" + (f" (archivo: {archived})" if archived else ""))
+        elif args.command == 'migrate':
+            migrated = migrate(conn, args.ahead)
+            for table, rows in migrated.items():
+                print(f"[OK] {table}: {rows} filas migradas")
+            if not migrated:
+                print("[OK] Las tablas ya están particionadas")
+        elif args.command == 'rollups':
+            refresh_rollups(conn, None if args.all else args.days)
+            print("[OK] Agregados recalculados")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,17 @@
 -- ============================================
 -- AgroMonitor - Database Schema for Neon PostgreSQL
 -- ============================================
+-- Las tablas de observaciones están particionadas por mes (RANGE sobre
+-- timestamp; forecast_data sobre forecast_date). Las particiones futuras y
+-- la retención las maneja db_maintenance.py; una BD creada con tablas sin
+-- particionar se convierte con: python db_maintenance.py migrate
 
 -- Tabla de datos del clima
 CREATE TABLE IF NOT EXISTS weather_data (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     polygon_id VARCHAR(50) NOT NULL,
+    source VARCHAR(30) NOT NULL DEFAULT 'agromonitoring',
     temperature_c DECIMAL(5,2),
     feels_like_c DECIMAL(5,2),
     temp_min_c DECIMAL(5,2),
@@ -18,25 +23,30 @@ CREATE TABLE IF NOT EXISTS weather_data (
     clouds_percent INTEGER,
     weather_main VARCHAR(50),
     weather_description VARCHAR(100),
-    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
+    rain_1h_mm DECIMAL(6,2),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
 
 -- Tabla de datos del suelo
 CREATE TABLE IF NOT EXISTS soil_data (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     polygon_id VARCHAR(50) NOT NULL,
+    source VARCHAR(30) NOT NULL DEFAULT 'agromonitoring',
     soil_temp_c DECIMAL(5,2),
     soil_moisture DECIMAL(6,4),
     soil_moisture_percent DECIMAL(5,2),
-    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
 
 -- Tabla de datos NDVI/NDWI
 CREATE TABLE IF NOT EXISTS ndvi_data (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     polygon_id VARCHAR(50) NOT NULL,
+    source VARCHAR(30) NOT NULL DEFAULT 'agromonitoring',
     image_date TIMESTAMPTZ,
     ndvi_mean DECIMAL(6,4),
     ndvi_min DECIMAL(6,4),
@@ -44,42 +54,692 @@ CREATE TABLE IF NOT EXISTS ndvi_data (
     ndvi_std DECIMAL(6,4),
     ndwi_mean DECIMAL(6,4),
     cloud_coverage DECIMAL(5,2),
-    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
 
--- Tabla de pronósticos diarios
+-- Tabla de pronósticos diarios: una fila por fecha pronosticada y emisión
 CREATE TABLE IF NOT EXISTS forecast_data (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     polygon_id VARCHAR(50) NOT NULL,
+    source VARCHAR(30) NOT NULL DEFAULT 'agromonitoring',
     forecast_date DATE NOT NULL,
+    issued_at TIMESTAMPTZ NOT NULL DEFAULT date_trunc('hour', NOW(), 'UTC'),
+    lead_days SMALLINT,
     temp_min_c DECIMAL(5,2),
     temp_max_c DECIMAL(5,2),
     temp_avg_c DECIMAL(5,2),
     humidity_avg INTEGER,
     precipitation_mm DECIMAL(6,2),
-    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, forecast_date)
+) PARTITION BY RANGE (forecast_date);
+
+-- Particiones DEFAULT: reciben filas fuera de los meses creados (deberían
+-- quedar vacías si db_maintenance.py crea los meses con anticipación)
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['weather_data', 'soil_data', 'ndvi_data', 'forecast_data'] LOOP
+        IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = t::regclass) THEN
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I DEFAULT', t || '_default', t);
+        END IF;
+    END LOOP;
+END;
+$$;
 
 -- Índices para mejorar rendimiento
 CREATE INDEX IF NOT EXISTS idx_weather_timestamp ON weather_data(timestamp DESC);
-CREATE INDEX IF NOT EXISTS idx_weather_polygon ON weather_data(polygon_id);
 CREATE INDEX IF NOT EXISTS idx_soil_timestamp ON soil_data(timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_ndvi_timestamp ON ndvi_data(timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_forecast_date ON forecast_data(forecast_date);
 
--- Vista para el último registro de cada tipo
-CREATE OR REPLACE VIEW latest_weather AS
-SELECT DISTINCT ON (polygon_id) *
-FROM weather_data
-ORDER BY polygon_id, timestamp DESC;
-
-CREATE OR REPLACE VIEW latest_soil AS
-SELECT DISTINCT ON (polygon_id) *
-FROM soil_data
-ORDER BY polygon_id, timestamp DESC;
-
-CREATE OR REPLACE VIEW latest_ndvi AS
-SELECT DISTINCT ON (polygon_id) *
-FROM ndvi_data
-ORDER BY polygon_id, timestamp DESC;
+-- Índices compuestos por polígono: "último" e "historial" de un polígono son
+-- un recorrido del índice. INCLUDE lleva las columnas del historial para que
+-- esas consultas sean index-only.
+CREATE INDEX IF NOT EXISTS idx_weather_polygon_timestamp ON weather_data(polygon_id, timestamp DESC)
+    INCLUDE (temperature_c, humidity_percent, wind_speed_ms, weather_main);
+CREATE INDEX IF NOT EXISTS idx_soil_polygon_timestamp ON soil_data(polygon_id, timestamp DESC)
+    INCLUDE (soil_temp_c, soil_moisture, soil_moisture_percent);
+CREATE INDEX IF NOT EXISTS idx_ndvi_polygon_timestamp ON ndvi_data(polygon_id, timestamp DESC)
+    INCLUDE (image_date, ndvi_mean, ndwi_mean);
+-- (idx_forecast_polygon_date va después de la migración de issued_at)
+
+-- Redundante con idx_weather_polygon_timestamp
+DROP INDEX IF EXISTS idx_weather_polygon;
+
+-- ============================================
+-- Claves naturales: (polígono, fuente, momento de la observación)
+-- timestamp es el `dt` de la observación upstream (en NDVI, el de la
+-- imagen); en forecast_data la clave es la fecha pronosticada más la
+-- emisión (ver más abajo). Los recolectores escriben con INSERT ... ON
+-- CONFLICT sobre estas claves, así que reintentos o varios recolectores a la
+-- vez no duplican filas.
+-- ============================================
+
+ALTER TABLE weather_data ADD COLUMN IF NOT EXISTS source VARCHAR(30) NOT NULL DEFAULT 'agromonitoring';
+ALTER TABLE soil_data ADD COLUMN IF NOT EXISTS source VARCHAR(30) NOT NULL DEFAULT 'agromonitoring';
+ALTER TABLE ndvi_data ADD COLUMN IF NOT EXISTS source VARCHAR(30) NOT NULL DEFAULT 'agromonitoring';
+ALTER TABLE forecast_data ADD COLUMN IF NOT EXISTS source VARCHAR(30) NOT NULL DEFAULT 'agromonitoring';
+ALTER TABLE weather_data ADD COLUMN IF NOT EXISTS rain_1h_mm DECIMAL(6,2);
+
+-- Al crear cada índice único por primera vez se eliminan los duplicados
+-- existentes, conservando la fila más reciente (mayor id)
+DO $$
+DECLARE
+    spec TEXT[];
+BEGIN
+    FOREACH spec SLICE 1 IN ARRAY ARRAY[
+        ['weather_data', 'timestamp', 'uq_weather_natural_key'],
+        ['soil_data', 'timestamp', 'uq_soil_natural_key'],
+        ['ndvi_data', 'timestamp', 'uq_ndvi_natural_key']
+    ] LOOP
+        CONTINUE WHEN to_regclass(spec[3]) IS NOT NULL;
+        EXECUTE format(
+            'DELETE FROM %1$I a USING %1$I b
+             WHERE a.polygon_id = b.polygon_id AND a.source = b.source
+               AND a.%2$I = b.%2$I AND a.id < b.id', spec[1], spec[2]);
+        EXECUTE format('CREATE UNIQUE INDEX %I ON %I (polygon_id, source, %I)',
+                       spec[3], spec[1], spec[2]);
+    END LOOP;
+END;
+$$;
+
+-- ============================================
+-- Emisiones de pronóstico
+-- Cada consulta del pronóstico es una emisión (issued_at, hora UTC) y se
+-- guarda aparte, con su anticipación en días (lead_days), para poder medir
+-- el acierto por anticipación (ver forecast_skill.py). En una BD existente
+-- las filas previas toman como emisión la hora de su created_at.
+-- ============================================
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'forecast_data' AND column_name = 'issued_at'
+    ) THEN
+        ALTER TABLE forecast_data ADD COLUMN issued_at TIMESTAMPTZ;
+        ALTER TABLE forecast_data ADD COLUMN lead_days SMALLINT;
+        UPDATE forecast_data SET
+            issued_at = date_trunc('hour', created_at, 'UTC'),
+            lead_days = forecast_date - (created_at AT TIME ZONE 'UTC')::DATE;
+        ALTER TABLE forecast_data ALTER COLUMN issued_at SET NOT NULL;
+        ALTER TABLE forecast_data ALTER COLUMN issued_at SET DEFAULT date_trunc('hour', NOW(), 'UTC');
+    END IF;
+
+    -- La clave natural pasa a incluir la emisión
+    IF to_regclass('uq_forecast_issuance_key') IS NULL THEN
+        DELETE FROM forecast_data a USING forecast_data b
+        WHERE a.polygon_id = b.polygon_id AND a.source = b.source
+          AND a.forecast_date = b.forecast_date AND a.issued_at = b.issued_at
+          AND a.id < b.id;
+        CREATE UNIQUE INDEX uq_forecast_issuance_key
+            ON forecast_data (polygon_id, source, forecast_date, issued_at);
+        DROP INDEX IF EXISTS uq_forecast_natural_key;
+    END IF;
+END;
+$$;
+
+-- Última emisión de un polígono (/api/forecast)
+CREATE INDEX IF NOT EXISTS idx_forecast_polygon_issued ON forecast_data(polygon_id, issued_at DESC);
+
+-- Pronóstico de un polígono por fecha: issued_at va en la clave para que el
+-- filtro por emisión (/api/forecast, forecast_skill.py) sea index-only. Una
+-- BD existente tiene el índice sin issued_at y se reconstruye.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE indexname = 'idx_forecast_polygon_date' AND indexdef NOT LIKE '%issued_at%'
+    ) THEN
+        DROP INDEX idx_forecast_polygon_date;
+    END IF;
+END;
+$$;
+CREATE INDEX IF NOT EXISTS idx_forecast_polygon_date ON forecast_data(polygon_id, forecast_date, issued_at)
+    INCLUDE (temp_min_c, temp_max_c, temp_avg_c, humidity_avg, precipitation_mm);
+
+-- ============================================
+-- Último registro de cada tipo por polígono
+-- Tablas con las mismas columnas que la tabla cruda y clave primaria
+-- polygon_id, actualizadas por un trigger al insertar: leer el estado
+-- actual de N polígonos es una búsqueda por clave, no un DISTINCT ON.
+-- (Reemplazan a las antiguas vistas latest_*.)
+-- ============================================
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['latest_weather', 'latest_soil', 'latest_ndvi'] LOOP
+        IF EXISTS (SELECT 1 FROM pg_views WHERE viewname = t) THEN
+            EXECUTE format('DROP VIEW %I', t);
+        END IF;
+    END LOOP;
+END;
+$$;
+
+CREATE TABLE IF NOT EXISTS latest_weather (LIKE weather_data, PRIMARY KEY (polygon_id));
+CREATE TABLE IF NOT EXISTS latest_soil (LIKE soil_data, PRIMARY KEY (polygon_id));
+CREATE TABLE IF NOT EXISTS latest_ndvi (LIKE ndvi_data, PRIMARY KEY (polygon_id));
+
+ALTER TABLE latest_weather ADD COLUMN IF NOT EXISTS source VARCHAR(30);
+ALTER TABLE latest_weather ADD COLUMN IF NOT EXISTS rain_1h_mm DECIMAL(6,2);
+ALTER TABLE latest_soil ADD COLUMN IF NOT EXISTS source VARCHAR(30);
+ALTER TABLE latest_ndvi ADD COLUMN IF NOT EXISTS source VARCHAR(30);
+
+-- Upsert de la fila más reciente de cada polígono de la sentencia en la
+-- tabla TG_ARGV[0]; una fila tardía más antigua no reemplaza a la actual
+CREATE OR REPLACE FUNCTION latest_on_insert() RETURNS TRIGGER AS $$
+DECLARE
+    target TEXT := TG_ARGV[0];
+    cols TEXT;
+    sets TEXT;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum),
+           string_agg(format('%I = EXCLUDED.%I', attname, attname), ', ' ORDER BY attnum)
+    INTO cols, sets
+    FROM pg_attribute
+    WHERE attrelid = target::regclass AND attnum > 0 AND NOT attisdropped;
+
+    EXECUTE format(
+        'INSERT INTO %I AS l (%s)
+         SELECT DISTINCT ON (polygon_id) %s FROM new_rows
+         ORDER BY polygon_id, timestamp DESC
+         ON CONFLICT (polygon_id) DO UPDATE SET %s
+         WHERE EXCLUDED.timestamp >= l.timestamp',
+        target, cols, cols, sets);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reconstruye una tabla latest_* desde la tabla cruda (carga inicial, o
+-- tras borrar filas recientes)
+CREATE OR REPLACE FUNCTION refresh_latest(source TEXT, target TEXT) RETURNS VOID AS $$
+DECLARE
+    cols TEXT;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum)
+    INTO cols
+    FROM pg_attribute
+    WHERE attrelid = target::regclass AND attnum > 0 AND NOT attisdropped;
+
+    EXECUTE format('DELETE FROM %I', target);
+    EXECUTE format(
+        'INSERT INTO %I (%s)
+         SELECT DISTINCT ON (polygon_id) %s FROM %I
+         ORDER BY polygon_id, timestamp DESC',
+        target, cols, cols, source);
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    pair TEXT[];
+    populated BOOLEAN;
+BEGIN
+    FOREACH pair SLICE 1 IN ARRAY ARRAY[
+        ['weather_data', 'latest_weather'],
+        ['soil_data', 'latest_soil'],
+        ['ndvi_data', 'latest_ndvi']
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_latest ON %I', pair[1], pair[1]);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_latest AFTER INSERT ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION latest_on_insert(%L)',
+            pair[1], pair[1], pair[2]);
+        -- Upserts que corrigen la fila más reciente
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_latest_update ON %I', pair[1], pair[1]);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_latest_update AFTER UPDATE ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION latest_on_insert(%L)',
+            pair[1], pair[1], pair[2]);
+        -- Carga inicial (al reemplazar las vistas o en una BD nueva)
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I)', pair[2]) INTO populated;
+        IF NOT populated THEN
+            PERFORM refresh_latest(pair[1], pair[2]);
+        END IF;
+    END LOOP;
+END;
+$$;
+
+-- ============================================
+-- Estadísticas por tabla y polígono
+-- Mantenidas por triggers al insertar/borrar, para que /api/stats
+-- no tenga que hacer COUNT(*) sobre tablas completas.
+-- En una BD existente ejecutar una vez: SELECT refresh_table_stats();
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS table_stats (
+    table_name VARCHAR(50) NOT NULL,
+    polygon_id VARCHAR(50) NOT NULL,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    first_timestamp TIMESTAMPTZ,
+    last_timestamp TIMESTAMPTZ,
+    last_created_at TIMESTAMPTZ,
+    PRIMARY KEY (table_name, polygon_id)
+);
+
+CREATE OR REPLACE FUNCTION table_stats_on_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO table_stats AS s (
+        table_name, polygon_id, row_count,
+        first_timestamp, last_timestamp, last_created_at
+    )
+    SELECT TG_TABLE_NAME, polygon_id, COUNT(*),
+           MIN(timestamp), MAX(timestamp), MAX(created_at)
+    FROM new_rows
+    GROUP BY polygon_id
+    ON CONFLICT (table_name, polygon_id) DO UPDATE SET
+        row_count = s.row_count + EXCLUDED.row_count,
+        first_timestamp = LEAST(s.first_timestamp, EXCLUDED.first_timestamp),
+        last_timestamp = GREATEST(s.last_timestamp, EXCLUDED.last_timestamp),
+        last_created_at = GREATEST(s.last_created_at, EXCLUDED.last_created_at);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Al borrar solo se descuenta el conteo; first/last se corrigen con refresh_table_stats()
+CREATE OR REPLACE FUNCTION table_stats_on_delete() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE table_stats s
+    SET row_count = GREATEST(s.row_count - d.n, 0)
+    FROM (
+        SELECT polygon_id, COUNT(*) AS n
+        FROM old_rows
+        GROUP BY polygon_id
+    ) d
+    WHERE s.table_name = TG_TABLE_NAME AND s.polygon_id = d.polygon_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Un upsert que cambia valores renueva created_at: se refleja en
+-- last_created_at para que cambien el ETag y la réplica lo copie
+CREATE OR REPLACE FUNCTION table_stats_on_update() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE table_stats s
+    SET last_created_at = GREATEST(s.last_created_at, u.last_created_at)
+    FROM (
+        SELECT polygon_id, MAX(created_at) AS last_created_at
+        FROM new_rows
+        GROUP BY polygon_id
+    ) u
+    WHERE s.table_name = TG_TABLE_NAME AND s.polygon_id = u.polygon_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recalcula las estadísticas desde cero (backfill inicial o tras mantenimiento)
+CREATE OR REPLACE FUNCTION refresh_table_stats() RETURNS VOID AS $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['weather_data', 'soil_data', 'ndvi_data', 'forecast_data'] LOOP
+        DELETE FROM table_stats WHERE table_name = t;
+        EXECUTE format(
+            'INSERT INTO table_stats (table_name, polygon_id, row_count,
+                                      first_timestamp, last_timestamp, last_created_at)
+             SELECT %L, polygon_id, COUNT(*), MIN(timestamp), MAX(timestamp), MAX(created_at)
+             FROM %I
+             GROUP BY polygon_id', t, t);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['weather_data', 'soil_data', 'ndvi_data', 'forecast_data'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_stats_insert ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_stats_insert AFTER INSERT ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION table_stats_on_insert()', t, t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_stats_delete ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_stats_delete AFTER DELETE ON %I
+             REFERENCING OLD TABLE AS old_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION table_stats_on_delete()', t, t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_stats_update ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_stats_update AFTER UPDATE ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION table_stats_on_update()', t, t);
+    END LOOP;
+END;
+$$;
+
+-- ============================================
+-- Notificaciones de cambios (LISTEN/NOTIFY)
+-- Un aviso por sentencia y polígono en el canal 'agro_updates';
+-- api_server.py los reenvía a los clientes por /api/events (SSE).
+-- ============================================
+
+CREATE OR REPLACE FUNCTION notify_data_change() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('agro_updates', json_build_object(
+        'table', TG_TABLE_NAME,
+        'polygon_id', polygon_id,
+        'rows', COUNT(*),
+        'last_timestamp', MAX(timestamp)
+    )::text)
+    FROM new_rows
+    GROUP BY polygon_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['weather_data', 'soil_data', 'ndvi_data', 'forecast_data'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_notify ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_notify AFTER INSERT ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change()', t, t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_notify_update ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_notify_update AFTER UPDATE ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change()', t, t);
+    END LOOP;
+END;
+$$;
+
+-- ============================================
+-- Lecturas de sensores de campo (sondas de suelo, pluviómetros)
+-- Ingresan por POST /api/ingest. La clave natural (polígono, dispositivo,
+-- métrica, hora) hace que reenviar un lote no duplique filas.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS sensor_readings (
+    id BIGSERIAL PRIMARY KEY,
+    timestamp TIMESTAMPTZ NOT NULL,
+    polygon_id VARCHAR(50) NOT NULL,
+    device_id VARCHAR(64) NOT NULL,
+    metric VARCHAR(40) NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    UNIQUE (polygon_id, device_id, metric, timestamp)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sensor_polygon_timestamp ON sensor_readings(polygon_id, timestamp DESC);
+
+-- Lotes ya procesados (header Idempotency-Key): un reintento devuelve el
+-- resultado original sin volver a insertar
+CREATE TABLE IF NOT EXISTS ingest_batches (
+    idempotency_key VARCHAR(100) PRIMARY KEY,
+    polygon_id VARCHAR(50) NOT NULL,
+    result JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+DROP TRIGGER IF EXISTS trg_sensor_readings_stats_insert ON sensor_readings;
+CREATE TRIGGER trg_sensor_readings_stats_insert AFTER INSERT ON sensor_readings
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION table_stats_on_insert();
+
+DROP TRIGGER IF EXISTS trg_sensor_readings_notify ON sensor_readings;
+CREATE TRIGGER trg_sensor_readings_notify AFTER INSERT ON sensor_readings
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change();
+
+-- ============================================
+-- Agregados por hora y por día (rollups)
+-- Conteo, mínimo, máximo y suma por polígono, variable y bucket (UTC); la
+-- media es sum_value / sample_count. Los triggers de inserción los mantienen
+-- al día; refresh_rollups() recalcula una ventana para corregir filas
+-- actualizadas por upserts o borradas (db_maintenance.py lo corre a diario).
+-- Sobreviven a la retención de particiones de las tablas crudas.
+-- En una BD existente ejecutar una vez: SELECT refresh_rollups();
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS observation_rollups (
+    polygon_id VARCHAR(50) NOT NULL,
+    table_name VARCHAR(50) NOT NULL,
+    variable VARCHAR(50) NOT NULL,
+    resolution VARCHAR(10) NOT NULL CHECK (resolution IN ('hour', 'day')),
+    bucket TIMESTAMPTZ NOT NULL,
+    sample_count INTEGER NOT NULL,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    sum_value DOUBLE PRECISION,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (polygon_id, table_name, resolution, bucket, variable)
+);
+
+-- Variables agregadas de cada tabla
+CREATE OR REPLACE FUNCTION rollup_variables(t TEXT) RETURNS TEXT[] AS $$
+    SELECT CASE t
+        WHEN 'weather_data' THEN ARRAY['temperature_c', 'humidity_percent', 'pressure_hpa',
+                                       'wind_speed_ms', 'clouds_percent', 'rain_1h_mm']
+        WHEN 'soil_data' THEN ARRAY['soil_temp_c', 'soil_moisture_percent']
+        WHEN 'ndvi_data' THEN ARRAY['ndvi_mean', 'ndvi_min', 'ndvi_max', 'ndvi_std', 'ndwi_mean']
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+-- SELECT que agrega las filas de `source` a buckets de hora y día
+CREATE OR REPLACE FUNCTION rollup_query(t TEXT, source TEXT, filter TEXT DEFAULT 'TRUE') RETURNS TEXT AS $$
+    SELECT format(
+        'SELECT n.polygon_id, %L, v.variable, res.resolution,
+                date_trunc(res.resolution, n.timestamp, ''UTC''),
+                COUNT(*), MIN(v.value), MAX(v.value), SUM(v.value)
+         FROM %I n
+         CROSS JOIN LATERAL (VALUES %s) v(variable, value)
+         CROSS JOIN (VALUES (''hour''), (''day'')) res(resolution)
+         WHERE v.value IS NOT NULL AND %s
+         GROUP BY 1, 2, 3, 4, 5',
+        t, source,
+        (SELECT string_agg(format('(%L, n.%I::DOUBLE PRECISION)', c, c), ', ')
+         FROM unnest(rollup_variables(t)) c),
+        filter)
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION rollups_on_insert() RETURNS TRIGGER AS $$
+BEGIN
+    EXECUTE 'INSERT INTO observation_rollups AS r (
+                 polygon_id, table_name, variable, resolution, bucket,
+                 sample_count, min_value, max_value, sum_value
+             ) ' || rollup_query(TG_TABLE_NAME, 'new_rows') || '
+             ON CONFLICT (polygon_id, table_name, resolution, bucket, variable) DO UPDATE SET
+                 sample_count = r.sample_count + EXCLUDED.sample_count,
+                 min_value = LEAST(r.min_value, EXCLUDED.min_value),
+                 max_value = GREATEST(r.max_value, EXCLUDED.max_value),
+                 sum_value = r.sum_value + EXCLUDED.sum_value,
+                 updated_at = NOW()';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recalcula los buckets entre los días de `since` y `until` (NULL = sin
+-- límite). Nunca toca días anteriores a la fila cruda más antigua: los
+-- agregados de datos archivados o quitados por retención se conservan.
+DROP FUNCTION IF EXISTS refresh_rollups(TIMESTAMPTZ);
+CREATE OR REPLACE FUNCTION refresh_rollups(since TIMESTAMPTZ DEFAULT NULL,
+                                           until TIMESTAMPTZ DEFAULT NULL) RETURNS VOID AS $$
+DECLARE
+    t TEXT;
+    oldest TIMESTAMPTZ;
+    start_bucket TIMESTAMPTZ;
+    end_bucket TIMESTAMPTZ := date_trunc('day', COALESCE(until, 'infinity'), 'UTC');
+BEGIN
+    -- Bloquea los upserts de los triggers mientras se reemplaza la ventana
+    LOCK TABLE observation_rollups IN SHARE ROW EXCLUSIVE MODE;
+    FOREACH t IN ARRAY ARRAY['weather_data', 'soil_data', 'ndvi_data'] LOOP
+        EXECUTE format('SELECT date_trunc(''day'', MIN(timestamp), ''UTC'') FROM %I', t) INTO oldest;
+        CONTINUE WHEN oldest IS NULL;
+        start_bucket := GREATEST(date_trunc('day', COALESCE(since, '-infinity'), 'UTC'), oldest);
+
+        DELETE FROM observation_rollups
+        WHERE table_name = t AND bucket >= start_bucket AND bucket < end_bucket;
+        EXECUTE 'INSERT INTO observation_rollups (
+                     polygon_id, table_name, variable, resolution, bucket,
+                     sample_count, min_value, max_value, sum_value
+                 ) ' || rollup_query(t, t, format('n.timestamp >= %L AND n.timestamp < %L',
+                                                  start_bucket, end_bucket));
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['weather_data', 'soil_data', 'ndvi_data'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_rollups ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_rollups AFTER INSERT ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION rollups_on_insert()', t, t);
+    END LOOP;
+END;
+$$;
+
+-- ============================================
+-- Archivo frío (cold_archive.py)
+-- Meses completos de datos crudos viejos exportados a Parquet por polígono
+-- y mes, y luego quitados de PostgreSQL. Cada fila se registra en la misma
+-- transacción que quita los datos: el API lee del archivo solo los meses
+-- registrados aquí.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS archived_months (
+    table_name VARCHAR(50) NOT NULL,
+    polygon_id VARCHAR(50) NOT NULL,
+    month DATE NOT NULL,
+    path TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (table_name, polygon_id, month)
+);
+
+-- ============================================
+-- Acierto de los pronósticos (forecast_skill.py)
+-- Sesgo, MAE y RMSE por variable y anticipación de la última evaluación.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS forecast_skill (
+    source VARCHAR(30) NOT NULL,
+    variable VARCHAR(30) NOT NULL,
+    lead_days SMALLINT NOT NULL,
+    samples INTEGER NOT NULL,
+    bias DOUBLE PRECISION,
+    mae DOUBLE PRECISION,
+    rmse DOUBLE PRECISION,
+    window_start DATE NOT NULL,
+    window_end DATE NOT NULL,
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (source, variable, lead_days)
+);
+
+-- ============================================
+-- Respuestas crudas del API (raw_archive.py)
+-- Cuerpos comprimidos con gzip y direccionados por SHA-256 (se guardan una
+-- vez aunque se repitan) y una fila por consulta. Permiten volver a derivar
+-- las tablas de observaciones sin consultar el API.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS raw_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    size_bytes INTEGER NOT NULL,
+    body BYTEA NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS raw_responses (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL,
+    polygon_id VARCHAR(50) NOT NULL,
+    url TEXT NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL,
+    sha256 CHAR(64) NOT NULL REFERENCES raw_blobs (sha256)
+);
+
+CREATE INDEX IF NOT EXISTS idx_raw_responses_kind_fetched ON raw_responses(kind, fetched_at);
+CREATE INDEX IF NOT EXISTS idx_raw_responses_url ON raw_responses(url, fetched_at DESC);
+
+-- ============================================
+-- NDVI/NDWI por zona de cultivo (ndvi_zones.py)
+-- Estadísticas de cada escena calculadas localmente sobre el raster, por
+-- zona de polygon_config.json ('total' = todo el polígono).
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS ndvi_zone_stats (
+    polygon_id VARCHAR(50) NOT NULL,
+    zone VARCHAR(50) NOT NULL,
+    index_name VARCHAR(10) NOT NULL,
+    image_time TIMESTAMPTZ NOT NULL,
+    satellite VARCHAR(30),
+    cloud_coverage DECIMAL(5,2),
+    pixels INTEGER NOT NULL,
+    mean_value DOUBLE PRECISION,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    std_value DOUBLE PRECISION,
+    p10 DOUBLE PRECISION,
+    p25 DOUBLE PRECISION,
+    p50 DOUBLE PRECISION,
+    p75 DOUBLE PRECISION,
+    p90 DOUBLE PRECISION,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (polygon_id, zone, index_name, image_time)
+);
+
+-- ============================================
+-- Compuestos NDVI/NDWI multi-escena (ndvi_zones.py + raster_store.py)
+-- Estadísticas por zona del compuesto por píxel (máximo o mediana) de las
+-- últimas escenas despejadas que terminan en window_end.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS ndvi_composite_stats (
+    polygon_id VARCHAR(50) NOT NULL,
+    zone VARCHAR(50) NOT NULL,
+    index_name VARCHAR(10) NOT NULL,
+    method VARCHAR(10) NOT NULL,
+    window_end TIMESTAMPTZ NOT NULL,
+    window_start TIMESTAMPTZ NOT NULL,
+    scenes SMALLINT NOT NULL,
+    pixels INTEGER NOT NULL,
+    mean_value DOUBLE PRECISION,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    std_value DOUBLE PRECISION,
+    p10 DOUBLE PRECISION,
+    p25 DOUBLE PRECISION,
+    p50 DOUBLE PRECISION,
+    p75 DOUBLE PRECISION,
+    p90 DOUBLE PRECISION,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (polygon_id, zone, index_name, method, window_end)
+);
+
+-- ============================================
+-- Registro de polígonos (polygon_registry.py)
+-- Copia de /polygons de Agromonitoring. content_hash detecta cambios al
+-- sincronizar; los polígonos que desaparecen quedan con deleted_at.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS polygons (
+    id VARCHAR(50) PRIMARY KEY,
+    name VARCHAR(200),
+    area_ha DOUBLE PRECISION,
+    center_lat DOUBLE PRECISION,
+    center_lon DOUBLE PRECISION,
+    geo_json JSONB,
+    upstream_created_at TIMESTAMPTZ,
+    content_hash CHAR(40) NOT NULL,
+    synced_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    deleted_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_polygons_name ON polygons(LOWER(name)) WHERE deleted_at IS NULL;
@@ -0,0 +1,281 @@
+"""
+AgroMonitor - Evaluación de pronósticos
+Compara cada emisión guardada en forecast_data con lo observado ese día
+(agregados diarios de weather_data en observation_rollups) y calcula sesgo,
+MAE y RMSE por anticipación (lead_days) para temperatura y precipitación.
+
+El cruce y los agregados se hacen con NumPy sobre arreglos completos: las
+emisiones y los días observados se codifican como claves enteras
+(polígono, día) y se emparejan con searchsorted, y los errores se agrupan
+por anticipación con bincount. Años de emisiones se evalúan en segundos.
+
+Los días son UTC, igual que los buckets diarios de los agregados y las
+fechas que escriben los recolectores. En anticipación 0 la emisión solo
+cubre las horas que quedaban del día, así que sus mínimos, máximos y
+totales de lluvia son parciales.
+
+Uso:
+    python forecast_skill.py [--days 365] [--polygon ID] [--save]
+"""
+
+import argparse
+from datetime import date, timedelta
+
+import numpy as np
+
+SOURCE = 'agromonitoring'
+
+# Variable evaluada -> (columna del pronóstico, variable observada, estadístico diario)
+VARIABLES = {
+    'temp_avg': ('temp_avg_c', 'temperature_c', 'mean'),
+    'temp_min': ('temp_min_c', 'temperature_c', 'min'),
+    'temp_max': ('temp_max_c', 'temperature_c', 'max'),
+    'precipitation': ('precipitation_mm', 'rain_1h_mm', 'daily_total'),
+}
+
+# Días con menos muestras horarias no se usan como observación
+MIN_DAILY_SAMPLES = 18
+
+# Filas por lote al leer con cursores del lado del servidor
+BATCH_ROWS = 50000
+
+# Las claves (polígono, día) se empaquetan en un int64: polígono << DAY_BITS | día
+DAY_BITS = 20
+
+
+def fetch_columns(conn, name, sql, params, dtypes):
+    """
+    Ejecuta la consulta con un cursor del lado del servidor y devuelve una
+    columna NumPy por cada dtype (None -> NaN en columnas float)
+    """
+    cur = conn.cursor(name=name)
+    cur.execute(sql, params)
+    chunks = [[] for _ in dtypes]
+    rows = cur.fetchmany(BATCH_ROWS)
+    while rows:
+        for chunk, column, dtype in zip(chunks, zip(*rows), dtypes):
+            chunk.append(np.array(column, dtype=dtype))
+        rows = cur.fetchmany(BATCH_ROWS)
+    cur.close()
+    return [np.concatenate(chunk) if chunk else np.empty(0, dtype=dtype)
+            for chunk, dtype in zip(chunks, dtypes)]
+
+
+def load_issuances(conn, since, until, polygon_id=None, source=SOURCE):
+    """
+    Emisiones con fecha pronosticada en [since, until).
+
+    Returns:
+        Dict con 'polygon_id', 'day' (días desde 1970-01-01), 'lead_days' y
+        una columna float por cada columna de pronóstico de VARIABLES
+    """
+    columns = sorted({spec[0] for spec in VARIABLES.values()})
+    filters = ["source = %s", "forecast_date >= %s", "forecast_date < %s", "lead_days >= 0"]
+    params = [source, since, until]
+    if polygon_id:
+        filters.append("polygon_id = %s")
+        params.append(polygon_id)
+
+    data = fetch_columns(conn, 'skill_issuances', f"""
+        SELECT polygon_id, forecast_date - DATE '1970-01-01', lead_days,
+               {', '.join(f'{c}::DOUBLE PRECISION' for c in columns)}
+        FROM forecast_data
+        WHERE {' AND '.join(filters)}
+    """, params, [object, np.int64, np.int64] + [np.float64] * len(columns))
+    return dict(zip(['polygon_id', 'day', 'lead_days'] + columns, data))
+
+
+def load_observed(conn, since, until, polygon_id=None, min_samples=MIN_DAILY_SAMPLES):
+    """
+    Agregados diarios observados de weather_data en [since, until).
+
+    Returns:
+        Dict variable observada -> dict con 'polygon_id', 'day' y un arreglo
+        por estadístico ('mean', 'min', 'max', 'daily_total')
+    """
+    variables = sorted({spec[1] for spec in VARIABLES.values()})
+    filters = ["table_name = 'weather_data'", "resolution = 'day'",
+               "variable = ANY(%s)", "bucket >= %s", "bucket < %s", "sample_count >= %s"]
+    params = [variables, since, until, min_samples]
+    if polygon_id:
+        filters.append("polygon_id = %s")
+        params.append(polygon_id)
+
+    polygons, days, names, counts, mins, maxs, sums = fetch_columns(conn, 'skill_observed', f"""
+        SELECT polygon_id, (bucket AT TIME ZONE 'UTC')::DATE - DATE '1970-01-01', variable,
+               sample_count, min_value, max_value, sum_value
+        FROM observation_rollups
+        WHERE {' AND '.join(filters)}
+    """, params, [object, np.int64, object, np.float64, np.float64, np.float64, np.float64])
+
+    observed = {}
+    for variable in variables:
+        mask = names == variable
+        mean = sums[mask] / counts[mask]
+        observed[variable] = {
+            'polygon_id': polygons[mask],
+            'day': days[mask],
+            'mean': mean,
+            'min': mins[mask],
+            'max': maxs[mask],
+            # Acumulados de 1 h: la media por 24 es el total del día aunque
+            # falten algunas horas
+            'daily_total': mean * 24,
+        }
+    return observed
+
+
+def match(forecast_keys, observed_keys):
+    """
+    Índice en observed_keys de cada clave del pronóstico (-1 si no hay
+    observación ese día)
+    """
+    if not len(observed_keys):
+        return np.full(len(forecast_keys), -1, dtype=np.int64)
+    order = np.argsort(observed_keys, kind='stable')
+    sorted_keys = observed_keys[order]
+    pos = np.minimum(np.searchsorted(sorted_keys, forecast_keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[pos] == forecast_keys, order[pos], -1)
+
+
+def skill_by_lead(forecast, observed, lead_days):
+    """
+    Sesgo, MAE y RMSE del pronóstico agrupados por anticipación.
+
+    Args:
+        forecast, observed: Arreglos float alineados (NaN = sin dato)
+        lead_days: Anticipación de cada par, en días
+
+    Returns:
+        Lista de dicts {lead_days, samples, bias, mae, rmse}
+    """
+    error = forecast - observed
+    valid = np.isfinite(error)
+    error, lead = error[valid], lead_days[valid]
+    if not len(error):
+        return []
+
+    length = int(lead.max()) + 1
+    samples = np.bincount(lead, minlength=length)
+    total = np.bincount(lead, weights=error, minlength=length)
+    absolute = np.bincount(lead, weights=np.abs(error), minlength=length)
+    squared = np.bincount(lead, weights=error ** 2, minlength=length)
+
+    return [{
+        'lead_days': int(days),
+        'samples': int(samples[days]),
+        'bias': round(float(total[days] / samples[days]), 3),
+        'mae': round(float(absolute[days] / samples[days]), 3),
+        'rmse': round(float(np.sqrt(squared[days] / samples[days])), 3),
+    } for days in np.flatnonzero(samples)]
+
+
+def evaluate(issuances, observed):
+    """
+    Cruza emisiones con observaciones y calcula el acierto por variable.
+
+    Returns:
+        Dict variable evaluada -> lista de skill_by_lead()
+    """
+    # Códigos de polígono comunes a ambos lados para armar las claves
+    polygons = np.concatenate(
+        [issuances['polygon_id']] + [obs['polygon_id'] for obs in observed.values()])
+    _, codes = np.unique(polygons.astype(str), return_inverse=True)
+    codes = codes.astype(np.int64)
+
+    forecast_count = len(issuances['polygon_id'])
+    forecast_keys = (codes[:forecast_count] << DAY_BITS) | issuances['day']
+    offset = forecast_count
+    observed_keys = {}
+    for variable, obs in observed.items():
+        count = len(obs['polygon_id'])
+        observed_keys[variable] = (codes[offset:offset + count] << DAY_BITS) | obs['day']
+        offset += count
+
+    results = {}
+    matches = {}
+    for name, (forecast_column, variable, statistic) in VARIABLES.items():
+        obs = observed.get(variable)
+        if obs is None or not forecast_count:
+            results[name] = []
+            continue
+        if variable not in matches:
+            matches[variable] = match(forecast_keys, observed_keys[variable])
+        index = matches[variable]
+        paired = index >= 0
+        results[name] = skill_by_lead(
+            issuances[forecast_column][paired],
+            obs[statistic][index[paired]],
+            issuances['lead_days'][paired])
+    return results
+
+
+def save_skill(conn, results, since, until, source=SOURCE):
+    """Reemplaza el último resultado guardado en forecast_skill"""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM forecast_skill WHERE source = %s", (source,))
+    cur.executemany("""
+        INSERT INTO forecast_skill (
+            source, variable, lead_days, samples, bias, mae, rmse, window_start, window_end
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, [(source, variable, row['lead_days'], row['samples'], row['bias'],
+           row['mae'], row['rmse'], since, until)
+          for variable, rows in results.items() for row in rows])
+    conn.commit()
+    cur.close()
+
+
+def run_evaluation(conn, days=None, polygon_id=None, save=False):
+    """
+    Evalúa las emisiones de los últimos `days` días (todas si es None); el
+    día en curso queda fuera porque todavía no está observado completo.
+
+    Returns:
+        Dict variable evaluada -> lista de {lead_days, samples, bias, mae, rmse}
+    """
+    until = date.today()
+    since = until - timedelta(days=days) if days else date(1970, 1, 1)
+
+    issuances = load_issuances(conn, since, until, polygon_id)
+    observed = load_observed(conn, since, until, polygon_id)
+    conn.commit()
+    results = evaluate(issuances, observed)
+
+    # Solo el resultado global (sin filtro de polígono) se guarda
+    if save and not polygon_id:
+        save_skill(conn, results, since, until)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluación de pronósticos de AgroMonitor")
+    parser.add_argument('--days', type=int, help='Ventana a evaluar (default: todo)')
+    parser.add_argument('--polygon', help='Evaluar solo un polígono')
+    parser.add_argument('--save', action='store_true', help='Guardar en la tabla forecast_skill')
+    args = parser.parse_args()
+
+    from db_config import get_connection
+    conn = get_connection()
+    if not conn:
+        print("[ERROR] No se pudo conectar a la base de datos")
+        return 1
+
+    try:
+        results = run_evaluation(conn, args.days, args.polygon, args.save)
+    finally:
+        conn.close()
+
+    for variable, rows in results.items():
+        print(f"\n{variable}")
+        if not rows:
+            print("  (sin pares pronóstico/observación)")
+            continue
+        print(f"  {'lead':>4} {'n':>8} {'sesgo':>8} {'mae':>8} {'rmse':>8}")
+        for row in rows:
+            print(f"  {row['lead_days']:>4} {row['samples']:>8} {row['bias']:>8.3f} "
+                  f"{row['mae']:>8.3f} {row['rmse']:>8.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
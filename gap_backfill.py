@@ -0,0 +1,377 @@
+"""
+AgroMonitor - Huecos en las series de observaciones y relleno desde el historial
+Las ejecuciones perdidas (retrasos del cron de GitHub Actions, caídas de
+Render, errores del API) dejan huecos silenciosos en weather_data y
+soil_data. Este módulo:
+
+  1. Encuentra los huecos de cada polígono y fuente con una sola consulta
+     por tabla (LEAD() sobre la serie ordenada, con centinelas en los bordes
+     de la ventana para detectar huecos al principio y al final).
+  2. Agrupa los huecos en pocas consultas a los endpoints de historial
+     (/weather/history, /soil/history), uniendo huecos cercanos y partiendo
+     los largos, y guarda solo las observaciones que caen dentro de un hueco.
+  3. Informa la completitud por polígono.
+
+Las respuestas del historial se archivan con raw_archive.py como las del
+recolector.
+
+Uso:
+    python gap_backfill.py report [--days 30] [--polygon ID]
+    python gap_backfill.py backfill [--days 7] [--polygon ID] [--max-requests 50] [--dry-run]
+
+Cada tabla tiene su intervalo esperado entre observaciones: el clima se
+actualiza cada hora y el suelo unas dos veces al día, así que un hueco de
+tres horas es normal en soil_data y no se cuenta.
+
+Variables de entorno:
+    GAP_THRESHOLD_MINUTES       Separación mínima para contar un hueco en weather_data (default 120)
+    SOIL_GAP_THRESHOLD_MINUTES  Separación mínima para contar un hueco en soil_data (default 1440)
+    BACKFILL_DAYS               Ventana que revisa el job diario (default 7)
+"""
+
+import argparse
+import math
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+# Tabla -> (tabla del último registro, tipo en raw_archive, endpoint de historial,
+#          intervalo esperado entre observaciones, separación mínima de un hueco)
+SERIES_TABLES = {
+    'weather_data': ('latest_weather', 'weather_history', 'weather/history',
+                     timedelta(hours=1),
+                     timedelta(minutes=int(os.environ.get('GAP_THRESHOLD_MINUTES', 120)))),
+    'soil_data': ('latest_soil', 'soil_history', 'soil/history',
+                  timedelta(hours=12),
+                  timedelta(minutes=int(os.environ.get('SOIL_GAP_THRESHOLD_MINUTES', 1440)))),
+}
+
+BASE_URL = "http://api.agromonitoring.com/agro/1.0"
+
+BACKFILL_DAYS = int(os.environ.get('BACKFILL_DAYS', 7))
+
+# Huecos a menos de MERGE_WITHIN se piden juntos; ninguna consulta abarca más de MAX_REQUEST_SPAN
+MERGE_WITHIN = timedelta(hours=12)
+MAX_REQUEST_SPAN = timedelta(days=5)
+
+# Límite de consultas por ejecución y pausa entre ellas (cuota del plan gratuito)
+MAX_REQUESTS = 50
+REQUEST_INTERVAL = 1.5
+
+Gap = namedtuple('Gap', ['table', 'polygon_id', 'source', 'start', 'end'])
+HistoryRequest = namedtuple('HistoryRequest', ['table', 'polygon_id', 'source', 'start', 'end', 'gaps'])
+
+
+def missing_steps(gap):
+    """Observaciones esperadas que faltan dentro de un hueco (según el intervalo de su tabla)"""
+    step = SERIES_TABLES[gap.table][3]
+    return max(math.ceil((gap.end - gap.start) / step) - 1, 0)
+
+
+# ============================================
+# DETECCIÓN
+# ============================================
+
+def find_gaps(conn, table, since, until, polygon_id=None):
+    """
+    Huecos de la tabla en [since, until) para cada polígono con último
+    registro en latest_*: pares de observaciones consecutivas separadas por
+    más que la separación mínima de la tabla (SERIES_TABLES).
+
+    Returns:
+        Lista de Gap (start/end son las observaciones que rodean el hueco, o
+        los bordes de la ventana)
+    """
+    latest, _, _, step, threshold = SERIES_TABLES[table]
+    polygon_filter = "AND polygon_id = %(polygon)s" if polygon_id else ""
+    cur = conn.cursor()
+    cur.execute(f"""
+        WITH polygons AS (
+            SELECT polygon_id, source FROM {latest}
+            WHERE TRUE {polygon_filter}
+        ), points AS (
+            SELECT polygon_id, source, timestamp FROM {table}
+            WHERE timestamp >= %(since)s AND timestamp < %(until)s {polygon_filter}
+            UNION ALL
+            SELECT polygon_id, source, %(since)s - %(step)s FROM polygons
+            UNION ALL
+            SELECT polygon_id, source, %(until)s FROM polygons
+        ), steps AS (
+            SELECT polygon_id, source, timestamp AS gap_start,
+                   LEAD(timestamp) OVER (PARTITION BY polygon_id, source ORDER BY timestamp) AS gap_end
+            FROM points
+        )
+        SELECT polygon_id, source, gap_start, gap_end
+        FROM steps
+        WHERE gap_end - gap_start > %(threshold)s
+        ORDER BY polygon_id, source, gap_start
+    """, {'since': since, 'until': until, 'step': step,
+          'threshold': threshold, 'polygon': polygon_id})
+    gaps = [Gap(table, *row) for row in cur.fetchall()]
+    cur.close()
+    return gaps
+
+
+def list_series(conn, table, polygon_id=None):
+    """Series (tabla, polígono, fuente) con último registro en latest_*"""
+    latest = SERIES_TABLES[table][0]
+    cur = conn.cursor()
+    if polygon_id:
+        cur.execute(f"SELECT polygon_id, source FROM {latest} WHERE polygon_id = %s", (polygon_id,))
+    else:
+        cur.execute(f"SELECT polygon_id, source FROM {latest}")
+    series = [(table, *row) for row in cur.fetchall()]
+    cur.close()
+    return series
+
+
+def completeness(series, gaps, since, until):
+    """
+    Completitud por tabla, polígono y fuente a partir de los huecos.
+
+    Returns:
+        Lista de dicts {table, polygon_id, source, expected, missing,
+        completeness, gaps, largest_gap_hours}; expected y missing cuentan
+        observaciones según el intervalo de cada tabla
+    """
+    report = {key: {'missing': 0, 'gaps': 0, 'largest': timedelta(0)} for key in series}
+    for gap in gaps:
+        key = (gap.table, gap.polygon_id, gap.source)
+        entry = report.setdefault(key, {'missing': 0, 'gaps': 0, 'largest': timedelta(0)})
+        entry['missing'] += missing_steps(gap)
+        entry['gaps'] += 1
+        entry['largest'] = max(entry['largest'], gap.end - gap.start)
+
+    rows = []
+    for (table, polygon_id, source), entry in sorted(report.items()):
+        expected = max(math.floor((until - since) / SERIES_TABLES[table][3]), 1)
+        missing = min(entry['missing'], expected)
+        rows.append({
+            'table': table,
+            'polygon_id': polygon_id,
+            'source': source,
+            'expected': expected,
+            'missing': missing,
+            'completeness': round(100 * (1 - missing / expected), 1),
+            'gaps': entry['gaps'],
+            'largest_gap_hours': round(entry['largest'] / timedelta(hours=1), 1),
+        })
+    return rows
+
+
+def scan(conn, since, until, polygon_id=None, tables=None):
+    """
+    Huecos de todas las tablas de SERIES_TABLES.
+
+    Returns:
+        Tuple (series revisadas, huecos)
+    """
+    series, gaps = [], []
+    for table in tables or SERIES_TABLES:
+        series.extend(list_series(conn, table, polygon_id))
+        gaps.extend(find_gaps(conn, table, since, until, polygon_id))
+    conn.commit()
+    return series, gaps
+
+
+# ============================================
+# RELLENO
+# ============================================
+
+def plan_requests(gaps, since, merge_within=MERGE_WITHIN, max_span=MAX_REQUEST_SPAN):
+    """
+    Consultas de historial que cubren los huecos: une huecos del mismo
+    polígono separados por menos de `merge_within` y parte los que superan
+    `max_span`.
+
+    Returns:
+        Lista de HistoryRequest con los huecos que cubre cada una
+    """
+    requests_ = []
+    current = None
+    for gap in sorted(gaps):
+        gap = gap._replace(start=max(gap.start, since))
+        # Huecos largos: tramos de max_span
+        pieces = []
+        start = gap.start
+        while gap.end - start > max_span:
+            pieces.append(gap._replace(start=start, end=start + max_span))
+            start += max_span
+        pieces.append(gap._replace(start=start))
+
+        for piece in pieces:
+            if (current and current.table == piece.table
+                    and current.polygon_id == piece.polygon_id and current.source == piece.source
+                    and piece.start - current.end <= merge_within
+                    and piece.end - current.start <= max_span):
+                current = current._replace(end=piece.end, gaps=current.gaps + [piece])
+            else:
+                if current:
+                    requests_.append(current)
+                current = HistoryRequest(piece.table, piece.polygon_id, piece.source,
+                                         piece.start, piece.end, [piece])
+    if current:
+        requests_.append(current)
+    return requests_
+
+
+def fetch_history(request, api_key):
+    """
+    Consulta el historial de una ventana.
+
+    Returns:
+        Tuple (lista de observaciones del API, respuesta cruda para raw_archive)
+    """
+    import requests
+    import raw_archive
+
+    _, kind, endpoint, _, _ = SERIES_TABLES[request.table]
+    url = (f"{BASE_URL}/{endpoint}?polyid={request.polygon_id}"
+           f"&start={int(request.start.timestamp())}&end={int(request.end.timestamp())}&appid={api_key}")
+    response = requests.get(url, timeout=60)
+    response.raise_for_status()
+    return response.json(), raw_archive.capture(kind, request.polygon_id, url, response.content, api_key)
+
+
+def history_parser(table):
+    """Parser del recolector y columnas del upsert para una tabla"""
+    import agro_data_collector as collector
+
+    return {
+        'weather_data': (collector.parse_weather, collector.WEATHER_COLUMNS),
+        'soil_data': (collector.parse_soil, collector.SOIL_COLUMNS),
+    }[table]
+
+
+def history_rows(request, items):
+    """Filas de las observaciones que caen dentro de algún hueco de la consulta"""
+    import agro_data_collector as collector
+
+    parse, columns = history_parser(request.table)
+    rows = []
+    for item in items:
+        observed = datetime.fromtimestamp(item['dt'], tz=timezone.utc)
+        if any(gap.start < observed < gap.end for gap in request.gaps):
+            rows.append(collector.observation_row(parse(item), request.polygon_id, columns))
+    return rows
+
+
+def backfill(conn, api_key, since, until, polygon_id=None, max_requests=MAX_REQUESTS,
+             dry_run=False):
+    """
+    Detecta huecos y los rellena desde el historial del API.
+
+    Returns:
+        Dict con 'gaps', 'planned' (lista de HistoryRequest), 'done', 'rows' y 'errors'
+    """
+    import agro_data_collector as collector
+    import raw_archive
+
+    # El historial es de Agromonitoring: los huecos de otras fuentes no se rellenan desde aquí
+    _, gaps = scan(conn, since, until, polygon_id)
+    gaps = [gap for gap in gaps if gap.source == collector.SOURCE]
+    planned = plan_requests(gaps, since)
+    result = {'gaps': len(gaps), 'planned': planned, 'done': 0, 'rows': 0, 'errors': []}
+    if dry_run:
+        return result
+
+    cur = conn.cursor()
+    for index, request in enumerate(planned[:max_requests]):
+        if index:
+            time.sleep(REQUEST_INTERVAL)
+        try:
+            items, raw = fetch_history(request, api_key)
+            result['done'] += 1
+            rows = history_rows(request, items)
+            if rows:
+                _, columns = history_parser(request.table)
+                cur.executemany(collector.upsert_sql(
+                    request.table, columns, collector.OBSERVATION_KEY), rows)
+                result['rows'] += len(rows)
+            raw_archive.archive_responses(cur, [raw])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            result['errors'].append(f"{request.table} {request.polygon_id} "
+                                    f"{request.start:%Y-%m-%d %H:%M}: {e}")
+    cur.close()
+    return result
+
+
+def run_backfill(days=BACKFILL_DAYS):
+    """Job diario (scheduler.py): rellena los huecos de los últimos `days` días"""
+    from agro_data_collector import load_config
+    from db_config import get_connection
+
+    config = load_config() or {}
+    api_key = os.environ.get('AGROMONITORING_API_KEY') or config.get('api_key')
+    conn = get_connection()
+    if not conn or not api_key:
+        return None
+    try:
+        until = datetime.now(timezone.utc)
+        return backfill(conn, api_key, until - timedelta(days=days), until)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Huecos y relleno de series de AgroMonitor")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_rep = sub.add_parser('report', help='Completitud por polígono')
+    p_rep.add_argument('--days', type=int, default=30)
+    p_rep.add_argument('--polygon')
+
+    p_fill = sub.add_parser('backfill', help='Rellena los huecos desde el historial del API')
+    p_fill.add_argument('--days', type=int, default=BACKFILL_DAYS)
+    p_fill.add_argument('--polygon')
+    p_fill.add_argument('--max-requests', type=int, default=MAX_REQUESTS)
+    p_fill.add_argument('--dry-run', action='store_true', help='Solo mostrar las consultas planificadas')
+    args = parser.parse_args()
+
+    from db_config import get_connection
+    conn = get_connection()
+    if not conn:
+        print("[ERROR] No se pudo conectar a la base de datos")
+        return 1
+
+    until = datetime.now(timezone.utc)
+    since = until - timedelta(days=args.days)
+    try:
+        if args.command == 'report':
+            series, gaps = scan(conn, since, until, args.polygon)
+            rows = completeness(series, gaps, since, until)
+            if not rows:
+                print("[OK] No hay series para revisar")
+            for row in rows:
+                print(f"  {row['table']:<13} {row['polygon_id']:<26} {row['source']:<15} "
+                      f"{row['completeness']:>5}%  faltan {row['missing']}/{row['expected']} obs.  "
+                      f"{row['gaps']} huecos (mayor: {row['largest_gap_hours']} h)")
+        else:
+            from agro_data_collector import load_config
+            config = load_config() or {}
+            api_key = os.environ.get('AGROMONITORING_API_KEY') or config.get('api_key')
+            if not api_key and not args.dry_run:
+                print("[ERROR] Falta la API key (AGROMONITORING_API_KEY o polygon_config.json)")
+                return 1
+            result = backfill(conn, api_key, since, until, args.polygon,
+                              args.max_requests, args.dry_run)
+            print(f"[OK] {result['gaps']} huecos, {len(result['planned'])} consultas planificadas")
+            if args.dry_run:
+                for request in result['planned']:
+                    print(f"  {request.table:<13} {request.polygon_id:<26} "
+                          f"{request.start:%Y-%m-%d %H:%M} - {request.end:%Y-%m-%d %H:%M} "
+                          f"({len(request.gaps)} huecos)")
+            else:
+                print(f"  {result['done']} consultas hechas, {result['rows']} filas guardadas")
+            for error in result['errors']:
+                print(f"[ERROR] {error}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
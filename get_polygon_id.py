@@ -6,15 +6,24 @@ Script para obtener el ID de tus polígonos en Agromonitoring
 import requests
 import json
 
-def get_polygons(api_key):
-    """Lista todos los polígonos de tu cuenta"""
+def get_polygons(api_key, verbose=True):
+    """
+    Lista todos los polígonos de tu cuenta
+    
+    Returns:
+        Lista de polígonos de /polygons (id, name, area, center, geo_json...);
+        vacía si hay error
+    """
     url = f"http://api.agromonitoring.com/agro/1.0/polygons?appid={api_key}"
     
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=30)
         response.raise_for_status()
         polygons = response.json()
         
+        if not verbose:
+            return polygons
+        
         print("=" * 70)
         print("TUS POLÍGONOS EN AGROMONITORING")
         print("=" * 70)
@@ -22,7 +31,7 @@ def get_polygons(api_key):
         
         if not polygons:
             print("❌ No tienes polígonos creados aún")
-            return
+            return polygons
         
         for i, poly in enumerate(polygons, 1):
             print(f"Polígono #{i}")
@@ -52,11 +61,16 @@ def get_polygons(api_key):
                 print(f"👉 Copia este ID y úsalo en el dashboard: {v['id']}")
                 print()
         
+        return polygons
+        
     except requests.exceptions.RequestException as e:
-        print(f"❌ Error al conectar con el API: {e}")
-        print("Verifica que tu API Key sea correcta")
+        if verbose:
+            print(f"❌ Error al conectar con el API: {e}")
+            print("Verifica que tu API Key sea correcta")
     except json.JSONDecodeError:
-        print("❌ Error al procesar la respuesta del servidor")
+        if verbose:
+            print("❌ Error al procesar la respuesta del servidor")
+    return []
 
 def main():
     print("🌱 Obtener IDs de Polígonos - Agromonitoring")
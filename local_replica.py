@@ -0,0 +1,391 @@
+"""
+AgroMonitor - Réplica local (SQLite)
+Copia incremental de las tablas de observaciones de Neon a un archivo SQLite
+local, para que el API responda aunque la BD serverless esté suspendida.
+
+La sincronización usa una marca de agua (high-water mark) sobre created_at
+por tabla y corre en un hilo de fondo: es ese hilo, y no el usuario, quien
+paga el arranque en frío de Neon.
+
+La réplica solo guarda una ventana reciente (REPLICA_WINDOW_DAYS, por
+defecto los mismos 90 días que quedan en caliente antes del archivo frío):
+lo anterior se poda en cada sincronización y las consultas que piden más
+atrás van al primario. Dentro de la ventana, cada REPLICA_RECONCILE_INTERVAL
+se comparan los id con el primario y se borran las filas que allí ya no
+existen (retención, archivo frío, deduplicación por clave natural).
+
+Las versiones para ETag (conteo y último created_at por tabla y polígono)
+se guardan en replica_stats y se recalculan solo para los polígonos que
+tocó cada sincronización, como table_stats en el primario.
+
+Uso desde api_server.py (variables de entorno):
+    REPLICA_PATH                Archivo SQLite (sin valor = réplica desactivada)
+    REPLICA_SYNC_INTERVAL       Segundos entre sincronizaciones (default 300)
+    REPLICA_MAX_STALENESS       Antigüedad máxima aceptada en segundos (default 900)
+    REPLICA_WINDOW_DAYS         Días que guarda la réplica (default 90)
+    REPLICA_RECONCILE_INTERVAL  Segundos entre reconciliaciones de borrados (default 3600)
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from db_config import get_connection
+
+REPLICATED_TABLES = ['weather_data', 'soil_data', 'ndvi_data', 'forecast_data']
+
+# Columna de tiempo de cada tabla (la de la partición en el primario)
+TIME_COLUMNS = {
+    'weather_data': 'timestamp',
+    'soil_data': 'timestamp',
+    'ndvi_data': 'timestamp',
+    'forecast_data': 'forecast_date'
+}
+
+WINDOW_DAYS = int(os.environ.get('REPLICA_WINDOW_DAYS', 90))
+RECONCILE_INTERVAL = int(os.environ.get('REPLICA_RECONCILE_INTERVAL', 3600))
+
+# Filas por lote al copiar desde el primario
+SYNC_BATCH_ROWS = 5000
+
+# Se relee este margen antes de la marca de agua para no perder filas de
+# transacciones que hicieron commit tarde con un created_at anterior
+SYNC_OVERLAP = timedelta(minutes=5)
+
+# OID de PostgreSQL -> tipo declarado en SQLite
+PG_TYPES = {
+    20: 'INTEGER', 21: 'INTEGER', 23: 'INTEGER',
+    700: 'REAL', 701: 'REAL', 1700: 'REAL',
+    1082: 'DATE',
+    1114: 'TIMESTAMPTZ', 1184: 'TIMESTAMPTZ'
+}
+
+# Índices de la réplica (mismas consultas que en el primario)
+REPLICA_INDEXES = {
+    'weather_data': ['polygon_id, timestamp'],
+    'soil_data': ['polygon_id, timestamp'],
+    'ndvi_data': ['polygon_id, timestamp'],
+    'forecast_data': ['polygon_id, forecast_date', 'polygon_id, issued_at']
+}
+
+# Fechas siempre en UTC e ISO: el orden de texto coincide con el temporal
+sqlite3.register_adapter(datetime, lambda d: d.astimezone(timezone.utc).isoformat(sep=' '))
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_converter('TIMESTAMPTZ', lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter('DATE', lambda b: date.fromisoformat(b.decode()))
+
+
+def to_sqlite_sql(sql):
+    """Adapta los placeholders de psycopg2 (%s) a SQLite (?)"""
+    return re.sub(r'%s', '?', sql)
+
+
+class ReplicaCursor:
+    """Cursor con la misma interfaz que psycopg2 sobre la réplica"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(to_sqlite_sql(sql), params)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def close(self):
+        self.cursor.close()
+
+
+class ReplicaConnection:
+    """Conexión de solo lectura a la réplica, intercambiable con la de psycopg2"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.cursor_factory = ReplicaCursor
+
+    def cursor(self):
+        return self.cursor_factory(self.conn.cursor())
+
+    def table_versions(self, tables, polygon_id=None):
+        """Conteo y último created_at por tabla desde replica_stats (equivalente a table_stats)"""
+        placeholders = ', '.join('?' for _ in tables)
+        if polygon_id:
+            rows = self.conn.execute(f"""
+                SELECT table_name, row_count, last_created_at FROM replica_stats
+                WHERE table_name IN ({placeholders}) AND polygon_id = ?
+                ORDER BY table_name
+            """, (*tables, polygon_id)).fetchall()
+        else:
+            rows = self.conn.execute(f"""
+                SELECT table_name, SUM(row_count), MAX(last_created_at) FROM replica_stats
+                WHERE table_name IN ({placeholders})
+                GROUP BY table_name
+                ORDER BY table_name
+            """, tuple(tables)).fetchall()
+        # MAX() pierde el tipo declarado y llega como texto
+        return [(table, count, last if isinstance(last, datetime) else datetime.fromisoformat(last))
+                for table, count, last in rows if count]
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class LocalReplica:
+    """Réplica SQLite sincronizada incrementalmente desde PostgreSQL"""
+
+    def __init__(self, path, sync_interval=300, max_staleness=900,
+                 window_days=WINDOW_DAYS, reconcile_interval=RECONCILE_INTERVAL):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self.window = timedelta(days=window_days)
+        self.reconcile_interval = reconcile_interval
+        self.last_sync = None
+        self.last_reconcile = 0.0
+        self.thread = None
+        self._init_db()
+
+    def _init_db(self):
+        """Crea la tabla de marcas de agua"""
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS replica_sync (
+                table_name TEXT PRIMARY KEY,
+                high_water_mark TIMESTAMPTZ,
+                synced_at REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS replica_stats (
+                table_name TEXT NOT NULL,
+                polygon_id TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                last_created_at TIMESTAMPTZ,
+                PRIMARY KEY (table_name, polygon_id)
+            )
+        """)
+        conn.commit()
+        # Si una ejecución anterior sincronizó hace poco se puede servir ya
+        row = conn.execute("SELECT MIN(synced_at) FROM replica_sync").fetchone()
+        if row and row[0]:
+            self.last_sync = row[0]
+        conn.close()
+
+    def is_fresh(self):
+        """True si la última sincronización está dentro del límite de antigüedad"""
+        return (self.last_sync is not None
+                and time.time() - self.last_sync <= self.max_staleness)
+
+    def connect(self):
+        """Abre una conexión de lectura (una por request/hilo)"""
+        return ReplicaConnection(self.path)
+
+    def window_start(self):
+        """Inicio de la ventana que guarda la réplica"""
+        return datetime.now(timezone.utc) - self.window
+
+    def covers(self, since):
+        """True si la réplica tiene los datos desde `since` (None = sin límite inferior)"""
+        return since is not None and since >= self.window_start()
+
+    def _ensure_table(self, local, table, description):
+        """Crea la tabla local o agrega columnas nuevas del primario"""
+        columns = [(col.name, PG_TYPES.get(col.type_code, 'TEXT')) for col in description]
+        existing = {row[1] for row in local.execute(f"PRAGMA table_info({table})")}
+
+        if not existing:
+            defs = ', '.join(
+                f"{name} {kind}" + (' PRIMARY KEY' if name == 'id' else '')
+                for name, kind in columns)
+            local.execute(f"CREATE TABLE {table} ({defs})")
+            local.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_created ON {table}(created_at)")
+            local.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_time ON {table}({TIME_COLUMNS[table]})")
+            for i, cols in enumerate(REPLICA_INDEXES.get(table, [])):
+                local.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{i} ON {table}({cols})")
+        else:
+            for name, kind in columns:
+                if name not in existing:
+                    local.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+        return [name for name, _ in columns]
+
+    def sync_table(self, primary, local, table, reconcile=False):
+        """
+        Copia las filas de la ventana con created_at posterior a la marca de
+        agua, poda lo que salió de la ventana y, con reconcile, borra las
+        filas que ya no existen en el primario
+        """
+        row = local.execute(
+            "SELECT high_water_mark FROM replica_sync WHERE table_name = ?", (table,)
+        ).fetchone()
+        hwm = datetime.fromisoformat(row[0]) if row and row[0] else None
+        since = hwm - SYNC_OVERLAP if hwm else datetime(1970, 1, 1, tzinfo=timezone.utc)
+        window_start = self.window_start()
+        if TIME_COLUMNS[table] == 'forecast_date':
+            window_start = window_start.date()
+
+        cur = primary.cursor(name=f"replica_{table}")
+        cur.execute(f"""
+            SELECT * FROM {table}
+            WHERE created_at > %s AND {TIME_COLUMNS[table]} >= %s
+            ORDER BY created_at
+        """, (since, window_start))
+
+        rows = cur.fetchmany(SYNC_BATCH_ROWS)
+        columns = self._ensure_table(local, table, cur.description)
+        created_idx = columns.index('created_at')
+        polygon_idx = columns.index('polygon_id')
+        insert_sql = (f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                      f"VALUES ({', '.join('?' for _ in columns)})")
+
+        copied = 0
+        touched = set()
+        while rows:
+            local.executemany(insert_sql, rows)
+            copied += len(rows)
+            touched.update(r[polygon_idx] for r in rows)
+            batch_max = rows[-1][created_idx]
+            if hwm is None or batch_max > hwm:
+                hwm = batch_max
+            rows = cur.fetchmany(SYNC_BATCH_ROWS)
+        cur.close()
+
+        touched |= self._prune(local, table, window_start)
+        if reconcile:
+            touched |= self._reconcile(primary, local, table, window_start)
+        self._refresh_stats(local, table, touched)
+
+        local.execute("""
+            INSERT INTO replica_sync (table_name, high_water_mark, synced_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (table_name) DO UPDATE SET
+                high_water_mark = excluded.high_water_mark,
+                synced_at = excluded.synced_at
+        """, (table, hwm, time.time()))
+        local.commit()
+        return copied
+
+    def _prune(self, local, table, window_start):
+        """Borra las filas anteriores a la ventana; devuelve los polígonos afectados"""
+        time_column = TIME_COLUMNS[table]
+        polygons = {row[0] for row in local.execute(
+            f"SELECT DISTINCT polygon_id FROM {table} WHERE {time_column} < ?", (window_start,))}
+        if polygons:
+            local.execute(f"DELETE FROM {table} WHERE {time_column} < ?", (window_start,))
+        return polygons
+
+    def _reconcile(self, primary, local, table, window_start):
+        """
+        Borra las filas de la ventana cuyo id ya no está en el primario;
+        devuelve los polígonos afectados
+        """
+        time_column = TIME_COLUMNS[table]
+        local.execute("CREATE TEMP TABLE IF NOT EXISTS primary_ids (id INTEGER PRIMARY KEY)")
+        local.execute("DELETE FROM primary_ids")
+
+        cur = primary.cursor(name=f"replica_ids_{table}")
+        cur.execute(f"SELECT id FROM {table} WHERE {time_column} >= %s", (window_start,))
+        rows = cur.fetchmany(SYNC_BATCH_ROWS)
+        while rows:
+            local.executemany("INSERT OR IGNORE INTO primary_ids (id) VALUES (?)", rows)
+            rows = cur.fetchmany(SYNC_BATCH_ROWS)
+        cur.close()
+
+        stale = f"""
+            FROM {table} WHERE {time_column} >= ?
+              AND id NOT IN (SELECT id FROM primary_ids)
+        """
+        polygons = {row[0] for row in local.execute(
+            f"SELECT DISTINCT polygon_id {stale}", (window_start,))}
+        if polygons:
+            local.execute(f"DELETE {stale}", (window_start,))
+        local.execute("DELETE FROM primary_ids")
+        return polygons
+
+    def _refresh_stats(self, local, table, polygons):
+        """
+        Recalcula replica_stats de los polígonos dados (todos si la tabla
+        todavía no tiene estadísticas)
+        """
+        has_stats = local.execute(
+            "SELECT 1 FROM replica_stats WHERE table_name = ? LIMIT 1", (table,)).fetchone()
+        if not has_stats:
+            polygons = {row[0] for row in local.execute(f"SELECT DISTINCT polygon_id FROM {table}")}
+
+        for polygon_id in polygons:
+            count, last_created_at = local.execute(f"""
+                SELECT COUNT(*), MAX(created_at) FROM {table} WHERE polygon_id = ?
+            """, (polygon_id,)).fetchone()
+            if count:
+                local.execute("""
+                    INSERT INTO replica_stats (table_name, polygon_id, row_count, last_created_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (table_name, polygon_id) DO UPDATE SET
+                        row_count = excluded.row_count,
+                        last_created_at = excluded.last_created_at
+                """, (table, polygon_id, count, last_created_at))
+            else:
+                local.execute("DELETE FROM replica_stats WHERE table_name = ? AND polygon_id = ?",
+                              (table, polygon_id))
+
+    def sync(self):
+        """Sincroniza todas las tablas; devuelve las filas copiadas por tabla"""
+        primary = get_connection()
+        if not primary:
+            return None
+
+        local = sqlite3.connect(self.path)
+        try:
+            reconcile = time.time() - self.last_reconcile >= self.reconcile_interval
+            copied = {table: self.sync_table(primary, local, table, reconcile)
+                      for table in REPLICATED_TABLES}
+            primary.rollback()
+            self.last_sync = time.time()
+            if reconcile:
+                self.last_reconcile = self.last_sync
+            return copied
+        finally:
+            local.close()
+            primary.close()
+
+    def start(self):
+        """Inicia la sincronización periódica en un hilo de fondo"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                copied = self.sync()
+                if copied and any(copied.values()):
+                    print(f"[REPLICA] Sincronizado: {copied}")
+            except Exception as e:
+                print(f"[ERROR] Replica sync: {e}")
+            time.sleep(self.sync_interval)
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('REPLICA_PATH', 'replica.db')
+    replica = LocalReplica(path)
+    print(f"Sincronizando réplica en {path}...")
+    print(replica.sync())
@@ -0,0 +1,400 @@
+"""
+AgroMonitor - Estadísticas de NDVI/NDWI por zona de cultivo
+get_ndvi_data solo lee el resumen del polígono completo, pero la finca está
+dividida en zonas (platano, hortalizas, tuberculos en polygon_config.json).
+Este módulo descarga una vez el raster GeoTIFF de cada escena nueva, lo
+guarda en disco y calcula por zona media, mínimo, máximo, desviación y
+percentiles con NumPy, usando máscaras de zona precalculadas (una por
+grilla de píxeles, guardadas junto a las imágenes).
+
+Cada zona necesita su geometría en polygon_config.json (GeoJSON en lon/lat):
+
+    "cultivos": {
+        "platano": {
+            "area_hectareas": 1.0,
+            "geometria": {"type": "Polygon", "coordinates": [[[lon, lat], ...]]}
+        }
+    }
+
+Las zonas sin geometría se omiten; la zona 'total' (todos los píxeles
+válidos del polígono) se calcula siempre.
+
+Las escenas quedan en el almacén mapeado de raster_store.py. Además de las
+estadísticas de cada escena se guardan las de compuestos móviles (máximo
+NDVI por píxel de las últimas escenas despejadas), que descartan las nubes
+que quedan en escenas con poca nubosidad declarada.
+
+Uso:
+    python ndvi_zones.py [--days 30] [--method max] [--scenes 4]
+
+Variables de entorno:
+    IMAGERY_DIR     Carpeta de imágenes y máscaras (default data/imagery)
+
+Requiere numpy y tifffile (opcional en requirements.txt).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+import raster_store
+from agro_data_collector import upsert_sql
+
+# tifffile es opcional: sin él no se procesan imágenes
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+CONFIG_FILE = SCRIPT_DIR / "polygon_config.json"
+IMAGERY_DIR = raster_store.IMAGERY_DIR
+
+BASE_URL = "http://api.agromonitoring.com/agro/1.0"
+
+# Índices a descargar de cada escena (claves de image['data'])
+INDICES = ['ndvi', 'ndwi']
+PERCENTILES = [10, 25, 50, 75, 90]
+TOTAL_ZONE = 'total'
+
+STAT_COLUMNS = ['pixels', 'mean_value', 'min_value', 'max_value', 'std_value'] + [
+    f'p{p}' for p in PERCENTILES]
+SCENE_COLUMNS = ['polygon_id', 'zone', 'index_name', 'image_time', 'satellite',
+                 'cloud_coverage'] + STAT_COLUMNS
+SCENE_KEY = ('polygon_id', 'zone', 'index_name', 'image_time')
+COMPOSITE_COLUMNS = ['polygon_id', 'zone', 'index_name', 'method', 'window_end',
+                     'window_start', 'scenes'] + STAT_COLUMNS
+COMPOSITE_KEY = ('polygon_id', 'zone', 'index_name', 'method', 'window_end')
+
+# Tags GeoTIFF (georreferencia y valor sin dato de GDAL)
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+GDAL_NODATA = 42113
+
+
+def is_enabled():
+    """True si tifffile está instalado"""
+    return tifffile is not None
+
+
+def load_zones(config_file=CONFIG_FILE):
+    """
+    Geometrías de las zonas de cultivo.
+
+    Returns:
+        Dict zona -> anillo exterior [(lon, lat), ...]
+    """
+    with open(config_file, 'r', encoding='utf-8') as f:
+        crops = json.load(f).get('polygon', {}).get('cultivos', {})
+    zones = {}
+    for name, crop in crops.items():
+        geometry = crop.get('geometria')
+        if geometry and geometry.get('type') == 'Polygon':
+            zones[name] = [tuple(point[:2]) for point in geometry['coordinates'][0]]
+    return zones
+
+
+# ============================================
+# RASTERS Y MÁSCARAS
+# ============================================
+
+def load_scene(polygon_id, image, index):
+    """
+    Valores (mapeados en memoria) y georreferencia de un índice de una
+    escena. El GeoTIFF se descarga solo si la escena no está en el almacén.
+    """
+    import requests
+
+    if not raster_store.has_scene(polygon_id, index, image['dt']):
+        response = requests.get(image['data'][index], timeout=60)
+        response.raise_for_status()
+        path = raster_store.scene_dir(polygon_id, index) / f"{image['dt']}.tif"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(response.content)
+        try:
+            values, transform = read_geotiff(path)
+        finally:
+            path.unlink()
+        raster_store.store_scene(polygon_id, index, image, values, transform)
+
+    scene = raster_store.load_catalog(polygon_id, index)[image['dt']]
+    return raster_store.open_scene(polygon_id, index, image['dt']), scene['transform']
+
+
+def read_geotiff(path):
+    """
+    Valores de la primera banda (NaN donde no hay dato) y su georreferencia.
+
+    Returns:
+        Tuple (array float32, transform (lon0, lat0, dlon, dlat) de la
+        esquina superior izquierda y tamaño de píxel)
+    """
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        values = np.squeeze(page.asarray()).astype(np.float32)
+        if values.ndim != 2:
+            raise ValueError(f"{path.name}: se esperaba una sola banda")
+        scale = page.tags[MODEL_PIXEL_SCALE].value
+        tiepoint = page.tags[MODEL_TIEPOINT].value
+        nodata = page.tags.get(GDAL_NODATA)
+
+    if nodata is not None:
+        values[values == np.float32(str(nodata.value).strip('\x00'))] = np.nan
+    values[~np.isfinite(values)] = np.nan
+    lon0 = tiepoint[3] - tiepoint[0] * scale[0]
+    lat0 = tiepoint[4] + tiepoint[1] * scale[1]
+    return values, (lon0, lat0, scale[0], scale[1])
+
+
+def polygon_mask(ring, lon, lat):
+    """Píxeles cuyo centro cae dentro del anillo (regla par-impar, vectorizada por arista)"""
+    inside = np.zeros(lon.shape, dtype=bool)
+    x0, y0 = ring[-1]
+    for x1, y1 in ring:
+        crosses = (y1 > lat) != (y0 > lat)
+        if y0 != y1:
+            inside ^= crosses & (lon < (x0 - x1) * (lat - y1) / (y0 - y1) + x1)
+        x0, y0 = x1, y1
+    return inside
+
+
+def zone_masks(zones, shape, transform):
+    """
+    Máscaras booleanas de cada zona para una grilla. Se calculan una vez por
+    grilla y geometrías y se guardan en IMAGERY_DIR/masks.
+    """
+    key = hashlib.sha1(json.dumps([sorted(zones.items()), shape, transform]).encode()).hexdigest()
+    path = IMAGERY_DIR / "masks" / f"{key}.npz"
+    if path.exists():
+        with np.load(path) as stored:
+            return {name: stored[name] for name in stored.files}
+
+    lon0, lat0, dlon, dlat = transform
+    rows, cols = shape
+    lon = lon0 + (np.arange(cols) + 0.5) * dlon
+    lat = lat0 - (np.arange(rows) + 0.5) * dlat
+    lon, lat = np.meshgrid(lon, lat)
+    masks = {name: polygon_mask(ring, lon, lat) for name, ring in zones.items()}
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, **masks)
+    return masks
+
+
+def zone_stats(values, masks):
+    """
+    Estadísticas por zona de los píxeles válidos.
+
+    Returns:
+        Dict zona -> {pixels, mean, min, max, std, p10, ..., p90} (zonas sin
+        píxeles válidos se omiten)
+    """
+    valid = np.isfinite(values)
+    stats = {}
+    for name, mask in [(TOTAL_ZONE, valid)] + list(masks.items()):
+        pixels = values[mask & valid]
+        if not pixels.size:
+            continue
+        quantiles = np.percentile(pixels, PERCENTILES)
+        stats[name] = {
+            'pixels': int(pixels.size),
+            'mean': round(float(pixels.mean()), 4),
+            'min': round(float(pixels.min()), 4),
+            'max': round(float(pixels.max()), 4),
+            'std': round(float(pixels.std()), 4),
+            **{f'p{p}': round(float(q), 4) for p, q in zip(PERCENTILES, quantiles)},
+        }
+    return stats
+
+
+def stat_values(stats):
+    """Valores de STAT_COLUMNS de un resultado de zone_stats()"""
+    return (stats['pixels'], stats['mean'], stats['min'], stats['max'], stats['std'],
+            *(stats[f'p{p}'] for p in PERCENTILES))
+
+
+# ============================================
+# ESCENAS
+# ============================================
+
+def search_scenes(api_key, polygon_id, days=30):
+    """Escenas del polígono en los últimos `days` días"""
+    import requests
+
+    end = int(time.time())
+    start = end - days * 24 * 60 * 60
+    url = f"{BASE_URL}/image/search?start={start}&end={end}&polyid={polygon_id}&appid={api_key}"
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def processed_scenes(cur, polygon_id):
+    """Momentos de las escenas que ya tienen estadísticas por zona"""
+    cur.execute("SELECT DISTINCT image_time FROM ndvi_zone_stats WHERE polygon_id = %s", (polygon_id,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def process_scene(cur, polygon_id, image, zones):
+    """
+    Descarga (si hace falta) los rasters de la escena y guarda sus
+    estadísticas por zona.
+
+    Returns:
+        Filas guardadas
+    """
+    image_time = datetime.fromtimestamp(image['dt'], tz=timezone.utc)
+    rows = []
+    for index in INDICES:
+        if not image.get('data', {}).get(index):
+            continue
+        values, transform = load_scene(polygon_id, image, index)
+        masks = zone_masks(zones, values.shape, transform)
+        for zone, stats in zone_stats(values, masks).items():
+            rows.append((polygon_id, zone, index, image_time, image.get('type'),
+                         image.get('cl')) + stat_values(stats))
+
+    cur.executemany(upsert_sql('ndvi_zone_stats', SCENE_COLUMNS, SCENE_KEY), rows)
+    return len(rows)
+
+
+def run_zone_stats(conn, api_key, polygon_id, days=30, zones=None):
+    """
+    Procesa las escenas nuevas del polígono.
+
+    Returns:
+        Lista de (momento de la escena, filas guardadas)
+    """
+    if tifffile is None:
+        raise RuntimeError("tifffile no está instalado")
+    zones = load_zones() if zones is None else zones
+
+    cur = conn.cursor()
+    done = processed_scenes(cur, polygon_id)
+    conn.commit()
+
+    processed = []
+    for image in sorted(search_scenes(api_key, polygon_id, days), key=lambda i: i['dt']):
+        image_time = datetime.fromtimestamp(image['dt'], tz=timezone.utc)
+        if image_time in done:
+            continue
+        saved = process_scene(cur, polygon_id, image, zones)
+        conn.commit()
+        processed.append((image_time, saved))
+    cur.close()
+    return processed
+
+
+# ============================================
+# COMPUESTOS
+# ============================================
+
+def processed_composites(cur, polygon_id, index, method):
+    """Fines de ventana que ya tienen estadísticas del compuesto"""
+    cur.execute("""
+        SELECT window_end FROM ndvi_composite_stats
+        WHERE polygon_id = %s AND index_name = %s AND method = %s
+        GROUP BY window_end
+    """, (polygon_id, index, method))
+    return {row[0] for row in cur.fetchall()}
+
+
+def process_composite(cur, polygon_id, index, scenes, method, zones):
+    """
+    Arma el compuesto de las escenas (raster_store.composite) y guarda sus
+    estadísticas por zona.
+
+    Returns:
+        Filas guardadas
+    """
+    values = raster_store.composite(polygon_id, index, scenes, method)
+    masks = zone_masks(zones, values.shape, scenes[-1]['transform'])
+    window_start = datetime.fromtimestamp(scenes[0]['dt'], tz=timezone.utc)
+    window_end = datetime.fromtimestamp(scenes[-1]['dt'], tz=timezone.utc)
+    rows = [(polygon_id, zone, index, method, window_end, window_start, len(scenes))
+            + stat_values(stats)
+            for zone, stats in zone_stats(values, masks).items()]
+    cur.executemany(upsert_sql('ndvi_composite_stats', COMPOSITE_COLUMNS, COMPOSITE_KEY), rows)
+    return len(rows)
+
+
+def run_composites(conn, polygon_id, method='max', size=raster_store.COMPOSITE_SCENES, zones=None):
+    """
+    Compuestos móviles del almacén: uno por cada escena despejada, con las
+    `size` escenas despejadas que terminan en ella.
+
+    Returns:
+        Lista de (índice, fin de la ventana, escenas usadas, filas guardadas)
+    """
+    zones = load_zones() if zones is None else zones
+
+    cur = conn.cursor()
+    processed = []
+    for index in INDICES:
+        done = processed_composites(cur, polygon_id, index, method)
+        conn.commit()
+        scenes = raster_store.clear_scenes(polygon_id, index)
+        for scene in scenes:
+            window_end = datetime.fromtimestamp(scene['dt'], tz=timezone.utc)
+            if window_end in done:
+                continue
+            window = raster_store.window_scenes(scenes, scene['dt'], size)
+            saved = process_composite(cur, polygon_id, index, window, method, zones)
+            conn.commit()
+            processed.append((index, window_end, len(window), saved))
+    cur.close()
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NDVI/NDWI por zona de cultivo de AgroMonitor")
+    parser.add_argument('--days', type=int, default=30, help='Escenas de los últimos N días')
+    parser.add_argument('--method', choices=sorted(raster_store.METHODS), default='max',
+                        help='Estadístico por píxel de los compuestos')
+    parser.add_argument('--scenes', type=int, default=raster_store.COMPOSITE_SCENES,
+                        help='Escenas despejadas por compuesto')
+    args = parser.parse_args()
+
+    if tifffile is None:
+        print("[ERROR] tifffile no está instalado (pip install tifffile)")
+        return 1
+
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    api_key = os.environ.get('AGROMONITORING_API_KEY') or config.get('api', {}).get('api_key')
+    polygon_id = config.get('polygon', {}).get('id')
+
+    zones = load_zones()
+    missing = [name for name in config.get('polygon', {}).get('cultivos', {}) if name not in zones]
+    if missing:
+        print(f"[AVISO] Zonas sin 'geometria' en {CONFIG_FILE.name}: {', '.join(missing)}")
+
+    from db_config import get_connection
+    conn = get_connection()
+    if not conn:
+        print("[ERROR] No se pudo conectar a la base de datos")
+        return 1
+
+    try:
+        processed = run_zone_stats(conn, api_key, polygon_id, args.days, zones)
+        for image_time, saved in processed:
+            print(f"[OK] Escena {image_time:%Y-%m-%d %H:%M}: {saved} filas")
+        if not processed:
+            print("[OK] Sin escenas nuevas")
+        for index, window_end, scenes, saved in run_composites(
+                conn, polygon_id, args.method, args.scenes, zones):
+            print(f"[OK] Compuesto {index} {args.method} hasta {window_end:%Y-%m-%d} "
+                  f"({scenes} escenas): {saved} filas")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
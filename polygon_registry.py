@@ -0,0 +1,232 @@
+"""
+AgroMonitor - Registro de polígonos
+Copia local (tabla polygons) de los polígonos de la cuenta en
+Agromonitoring: ID, nombre, área, centro y geometría. Una sincronización
+trae /polygons completo en una sola consulta y solo escribe lo que cambió
+(hash del contenido); los polígonos que ya no están se marcan con
+deleted_at en lugar de borrarse, porque sus observaciones siguen en la BD.
+
+El recolector, el analizador y el API resuelven los polígonos desde aquí
+sin consultar el API en cada ejecución. Las funciones de consulta devuelven
+dicts con la misma forma que /polygons (center = [lon, lat]), así que
+sirven igual para weather_grid.py.
+
+Uso:
+    python polygon_registry.py sync
+    python polygon_registry.py list [--all]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+BASE_URL = "http://api.agromonitoring.com/agro/1.0"
+
+# Segundos que el API server reutiliza el registro leído (ver cached_polygons)
+REGISTRY_TTL = int(os.environ.get('POLYGON_REGISTRY_TTL', 300))
+
+_cache = {'loaded_at': 0.0, 'polygons': []}
+
+
+def fetch_polygons(api_key):
+    """Polígonos de la cuenta (/polygons); lanza excepción si el API falla"""
+    import requests
+
+    response = requests.get(f"{BASE_URL}/polygons?appid={api_key}", timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def content_hash(polygon):
+    """Hash de los campos que guarda el registro (detecta cambios)"""
+    content = {key: polygon.get(key) for key in ('name', 'area', 'center', 'geo_json')}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def polygon_row(polygon):
+    center = polygon.get('center') or [None, None]
+    created_at = polygon.get('created_at')
+    return (
+        polygon['id'],
+        polygon.get('name'),
+        polygon.get('area'),
+        center[1],
+        center[0],
+        json.dumps(polygon.get('geo_json')) if polygon.get('geo_json') else None,
+        datetime.fromtimestamp(created_at, tz=timezone.utc) if created_at else None,
+        content_hash(polygon),
+    )
+
+
+def sync(conn, polygons):
+    """
+    Sincroniza el registro con la lista completa de /polygons.
+
+    Returns:
+        Dict con 'added', 'updated', 'removed' (listas de IDs) y 'unchanged'
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT id, content_hash, deleted_at IS NOT NULL FROM polygons")
+    known = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+    added, updated, changed = [], [], []
+    for polygon in polygons:
+        row = polygon_row(polygon)
+        previous = known.get(polygon['id'])
+        if previous is None:
+            added.append(polygon['id'])
+        elif previous[0] != row[-1] or previous[1]:
+            updated.append(polygon['id'])
+        else:
+            continue
+        changed.append(row)
+
+    cur.executemany("""
+        INSERT INTO polygons (
+            id, name, area_ha, center_lat, center_lon, geo_json, upstream_created_at, content_hash
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (id) DO UPDATE SET
+            name = EXCLUDED.name,
+            area_ha = EXCLUDED.area_ha,
+            center_lat = EXCLUDED.center_lat,
+            center_lon = EXCLUDED.center_lon,
+            geo_json = EXCLUDED.geo_json,
+            upstream_created_at = EXCLUDED.upstream_created_at,
+            content_hash = EXCLUDED.content_hash,
+            updated_at = NOW(),
+            deleted_at = NULL
+    """, changed)
+
+    current = [polygon['id'] for polygon in polygons]
+    cur.execute("""
+        UPDATE polygons SET deleted_at = NOW()
+        WHERE deleted_at IS NULL AND NOT (id = ANY(%s))
+        RETURNING id
+    """, (current,))
+    removed = [row[0] for row in cur.fetchall()]
+
+    cur.execute("UPDATE polygons SET synced_at = NOW() WHERE id = ANY(%s)", (current,))
+    conn.commit()
+    cur.close()
+    _cache['loaded_at'] = 0.0
+    return {
+        'added': added,
+        'updated': updated,
+        'removed': removed,
+        'unchanged': len(polygons) - len(changed),
+    }
+
+
+def run_sync(api_key):
+    """Sincroniza desde el API; None si no hay conexión a la BD"""
+    from db_config import get_connection
+
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        return sync(conn, fetch_polygons(api_key))
+    finally:
+        conn.close()
+
+
+# ============================================
+# CONSULTAS
+# ============================================
+
+def as_polygon(row):
+    """Fila de la tabla -> dict con la forma de /polygons"""
+    polygon_id, name, area, lat, lon, geo_json, created_at, updated_at, deleted_at = row
+    return {
+        'id': polygon_id,
+        'name': name,
+        'area': area,
+        'center': [lon, lat] if lat is not None else None,
+        'geo_json': json.loads(geo_json) if isinstance(geo_json, str) else geo_json,
+        'created_at': int(created_at.timestamp()) if created_at else None,
+        'updated_at': updated_at,
+        'deleted_at': deleted_at,
+    }
+
+
+def load_polygons(conn, include_deleted=False):
+    """Polígonos del registro ordenados por nombre"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT id, name, area_ha, center_lat, center_lon, geo_json,
+               upstream_created_at, updated_at, deleted_at
+        FROM polygons
+        {'' if include_deleted else 'WHERE deleted_at IS NULL'}
+        ORDER BY name, id
+    """)
+    polygons = [as_polygon(row) for row in cur.fetchall()]
+    cur.close()
+    return polygons
+
+
+def cached_polygons(conn, max_age=REGISTRY_TTL):
+    """load_polygons() reutilizado durante max_age segundos (para el API server)"""
+    if time.monotonic() - _cache['loaded_at'] > max_age:
+        _cache['polygons'] = load_polygons(conn)
+        _cache['loaded_at'] = time.monotonic()
+    return _cache['polygons']
+
+
+def find(polygons, key):
+    """
+    Polígono por ID o por nombre (sin distinguir mayúsculas); None si no
+    existe o si el nombre es ambiguo
+    """
+    for polygon in polygons:
+        if polygon['id'] == key:
+            return polygon
+    named = [polygon for polygon in polygons
+             if (polygon.get('name') or '').strip().lower() == key.strip().lower()]
+    return named[0] if len(named) == 1 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro de polígonos de AgroMonitor")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('sync', help='Sincronizar desde /polygons')
+    list_parser = sub.add_parser('list', help='Listar el registro')
+    list_parser.add_argument('--all', action='store_true', help='Incluir polígonos eliminados')
+    args = parser.parse_args()
+
+    from db_config import get_connection
+    conn = get_connection()
+    if not conn:
+        print("[ERROR] No se pudo conectar a la base de datos")
+        return 1
+
+    try:
+        if args.command == 'sync':
+            from agro_data_collector import load_config
+            config = load_config()
+            api_key = os.environ.get('AGROMONITORING_API_KEY') or (config or {}).get('api_key')
+            if not api_key:
+                print("[ERROR] API key no configurada")
+                return 1
+            result = sync(conn, fetch_polygons(api_key))
+            print(f"[OK] Nuevos: {len(result['added'])}, actualizados: {len(result['updated'])}, "
+                  f"eliminados: {len(result['removed'])}, sin cambios: {result['unchanged']}")
+            for label in ('added', 'updated', 'removed'):
+                for polygon_id in result[label]:
+                    print(f"  {label:<8} {polygon_id}")
+        else:
+            for polygon in load_polygons(conn, include_deleted=args.all):
+                center = polygon['center']
+                location = f"{center[1]:.6f}, {center[0]:.6f}" if center else 'N/A'
+                status = ' (eliminado)' if polygon['deleted_at'] else ''
+                print(f"{polygon['id']}  {polygon['name'] or 'Sin nombre'}  "
+                      f"{polygon['area'] or 'N/A'} ha  {location}{status}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
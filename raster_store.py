@@ -0,0 +1,168 @@
+"""
+AgroMonitor - Almacén local de rasters y compuestos multi-escena
+Las escenas NDVI/NDWI se guardan una vez como arreglos .npy (float32, NaN =
+sin dato) que se abren con memory-map: leer una escena no la carga en RAM y
+varios procesos comparten las mismas páginas del sistema operativo.
+
+Sobre ese almacén se arman compuestos de las últimas N escenas con poca
+nubosidad (máximo NDVI o mediana por píxel). Las nubes bajan el NDVI, así
+que el máximo por píxel se queda con el valor despejado de cada punto. El
+compuesto se calcula por bloques de filas con un presupuesto de memoria fijo
+y se escribe en otro .npy mapeado, así que N escenas nunca están completas
+en memoria a la vez.
+
+Estructura en IMAGERY_DIR:
+    store/<polígono>/<índice>/<dt>.npy      valores de la escena
+    store/<polígono>/<índice>/scenes.json   catálogo (satélite, nubosidad, grilla)
+    composites/<polígono>/<índice>_<método>_<n>_<dt>.npy
+
+Variables de entorno:
+    COMPOSITE_SCENES        Escenas por compuesto (default 4)
+    COMPOSITE_CHUNK_MB      Memoria por bloque al componer (default 64)
+"""
+
+import json
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+from agro_data_collector import MAX_CLOUD_COVERAGE
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+IMAGERY_DIR = Path(os.environ.get('IMAGERY_DIR', SCRIPT_DIR / "data" / "imagery"))
+STORE_DIR = IMAGERY_DIR / "store"
+COMPOSITES_DIR = IMAGERY_DIR / "composites"
+
+COMPOSITE_SCENES = int(os.environ.get('COMPOSITE_SCENES', 4))
+CHUNK_BYTES = int(os.environ.get('COMPOSITE_CHUNK_MB', 64)) * 1024 * 1024
+
+# Estadístico por píxel de cada método (ignoran NaN)
+METHODS = {
+    'max': np.nanmax,
+    'median': np.nanmedian,
+}
+
+# Rango válido de los índices normalizados; fuera de él el píxel no es dato
+VALID_RANGE = (-1.0, 1.0)
+
+
+def scene_dir(polygon_id, index):
+    return STORE_DIR / polygon_id / index
+
+
+def load_catalog(polygon_id, index):
+    """
+    Catálogo de escenas guardadas.
+
+    Returns:
+        Dict dt -> {dt, satellite, cloud_coverage, shape, transform}
+    """
+    path = scene_dir(polygon_id, index) / "scenes.json"
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {int(dt): scene for dt, scene in json.load(f).items()}
+
+
+def save_catalog(polygon_id, index, catalog):
+    path = scene_dir(polygon_id, index) / "scenes.json"
+    tmp = path.with_suffix('.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({str(dt): scene for dt, scene in sorted(catalog.items())}, f, indent=1)
+    tmp.replace(path)
+
+
+def has_scene(polygon_id, index, dt):
+    return (scene_dir(polygon_id, index) / f"{dt}.npy").exists()
+
+
+def store_scene(polygon_id, index, image, values, transform):
+    """Guarda los valores de una escena y la registra en el catálogo"""
+    directory = scene_dir(polygon_id, index)
+    directory.mkdir(parents=True, exist_ok=True)
+    values = np.asarray(values, dtype=np.float32)
+    values = np.where((values >= VALID_RANGE[0]) & (values <= VALID_RANGE[1]), values, np.nan)
+
+    path = directory / f"{image['dt']}.npy"
+    tmp = directory / f"{image['dt']}.tmp.npy"
+    np.save(tmp, values)
+    tmp.replace(path)
+
+    catalog = load_catalog(polygon_id, index)
+    catalog[image['dt']] = {
+        'dt': image['dt'],
+        'satellite': image.get('type'),
+        'cloud_coverage': image.get('cl'),
+        'shape': list(values.shape),
+        'transform': list(transform),
+    }
+    save_catalog(polygon_id, index, catalog)
+    return path
+
+
+def open_scene(polygon_id, index, dt):
+    """Valores de una escena, mapeados en memoria (solo lectura)"""
+    return np.load(scene_dir(polygon_id, index) / f"{dt}.npy", mmap_mode='r')
+
+
+def clear_scenes(polygon_id, index, max_cloud=MAX_CLOUD_COVERAGE):
+    """Escenas del catálogo con nubosidad <= max_cloud, de la más antigua a la más reciente"""
+    return [scene for _, scene in sorted(load_catalog(polygon_id, index).items())
+            if (scene.get('cloud_coverage') or 0) <= max_cloud]
+
+
+def window_scenes(scenes, end_dt, size=COMPOSITE_SCENES):
+    """
+    Las últimas `size` escenas hasta end_dt (inclusive) que comparten la
+    grilla de la escena final
+    """
+    candidates = [scene for scene in scenes if scene['dt'] <= end_dt]
+    if not candidates:
+        return []
+    last = candidates[-1]
+    grid = (last['shape'], last['transform'])
+    same_grid = [scene for scene in candidates if (scene['shape'], scene['transform']) == grid]
+    return same_grid[-size:]
+
+
+def composite_path(polygon_id, index, method, scenes):
+    return COMPOSITES_DIR / polygon_id / f"{index}_{method}_{len(scenes)}_{scenes[-1]['dt']}.npy"
+
+
+def composite(polygon_id, index, scenes, method='max', chunk_bytes=CHUNK_BYTES):
+    """
+    Compuesto por píxel de las escenas dadas (misma grilla), escrito en un
+    .npy mapeado.
+
+    Args:
+        scenes: Escenas del catálogo (ver window_scenes)
+        method: Clave de METHODS
+        chunk_bytes: Memoria aproximada por bloque de filas
+
+    Returns:
+        Arreglo mapeado (solo lectura) con el compuesto
+    """
+    reducer = METHODS[method]
+    rows, cols = scenes[-1]['shape']
+    path = composite_path(polygon_id, index, method, scenes)
+    if path.exists():
+        return np.load(path, mmap_mode='r')
+
+    maps = [open_scene(polygon_id, index, scene['dt']) for scene in scenes]
+    block = max(1, chunk_bytes // (len(maps) * cols * 4))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp.npy')
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(rows, cols))
+    with warnings.catch_warnings():
+        # Píxeles sin dato en todas las escenas quedan en NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for start in range(0, rows, block):
+            stack = np.stack([values[start:start + block] for values in maps])
+            out[start:start + block] = reducer(stack, axis=0)
+    out.flush()
+    del out
+    tmp.replace(path)
+    return np.load(path, mmap_mode='r')
@@ -0,0 +1,325 @@
+"""
+AgroMonitor - Archivo de respuestas crudas del API
+Los recolectores convierten unidades, redondean y descartan campos antes de
+guardar. Para poder corregir un parser o extraer un campo nuevo sin volver
+a consultar el API, cada respuesta cruda se archiva en PostgreSQL:
+
+    raw_blobs       cuerpo comprimido con gzip, direccionado por su SHA-256
+                    (respuestas idénticas se guardan una sola vez)
+    raw_responses   una fila por consulta: tipo, polígono, URL, momento y hash
+
+La API key se quita de la URL y del cuerpo (las respuestas de imágenes traen
+URLs con appid) antes de calcular el hash.
+
+`reprocess` vuelve a derivar weather_data, soil_data, ndvi_data y
+forecast_data desde el archivo, en lotes paralelos y sin acceder al API.
+Escribe con los mismos upserts que el recolector: las filas que no cambian
+no se reescriben.
+
+Uso:
+    python raw_archive.py reprocess [--kind weather] [--since 2024-01-01] [--until ...]
+                                    [--workers 4] [--batch 500]
+    python raw_archive.py stats
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Tipo de respuesta -> tabla derivada (ndvi_stats/ndwi_stats se leen junto con ndvi_search)
+RAW_KINDS = {
+    'weather': 'weather_data',
+    'soil': 'soil_data',
+    'ndvi_search': 'ndvi_data',
+    'ndvi_stats': None,
+    'ndwi_stats': None,
+    'forecast': 'forecast_data',
+    'weather_history': 'weather_data',
+    'soil_history': 'soil_data',
+}
+
+REDACTED = b'REDACTED'
+
+# Respuestas por lote al reprocesar
+BATCH_SIZE = 500
+REPROCESS_WORKERS = int(os.environ.get('REPROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+
+RawResponse = namedtuple('RawResponse', ['kind', 'polygon_id', 'url', 'body', 'fetched_at'])
+
+
+def clean_url(url):
+    """URL sin el parámetro appid"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != 'appid']
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def capture(kind, polygon_id, url, body, api_key=None):
+    """Respuesta lista para archivar, sin la API key"""
+    if api_key:
+        body = body.replace(api_key.encode(), REDACTED)
+    return RawResponse(kind, polygon_id, clean_url(url), body, datetime.now(timezone.utc))
+
+
+def content_hash(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def archive_responses(cur, responses):
+    """
+    Guarda las respuestas en la transacción de `cur`. Solo se comprimen y
+    envían los cuerpos que todavía no están en raw_blobs.
+
+    Returns:
+        Cantidad de cuerpos nuevos
+    """
+    bodies = {content_hash(r.body): r.body for r in responses}
+    cur.execute("SELECT sha256 FROM raw_blobs WHERE sha256 = ANY(%s)", (list(bodies),))
+    stored = {row[0] for row in cur.fetchall()}
+    new = [(digest, len(body), gzip.compress(body, mtime=0))
+           for digest, body in bodies.items() if digest not in stored]
+
+    cur.executemany("""
+        INSERT INTO raw_blobs (sha256, size_bytes, body) VALUES (%s, %s, %s)
+        ON CONFLICT (sha256) DO NOTHING
+    """, new)
+    cur.executemany("""
+        INSERT INTO raw_responses (kind, polygon_id, url, fetched_at, sha256)
+        VALUES (%s, %s, %s, %s, %s)
+    """, [(r.kind, r.polygon_id, r.url, r.fetched_at, content_hash(r.body)) for r in responses])
+    return len(new)
+
+
+def load_body(blob):
+    """JSON de un cuerpo archivado"""
+    return json.loads(gzip.decompress(bytes(blob)))
+
+
+# ============================================
+# REPROCESO
+# ============================================
+
+def issuance_hour(fetched_at):
+    """Emisión de un pronóstico archivado (misma regla que el recolector)"""
+    return fetched_at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def derive_rows(cur, records):
+    """
+    Filas a escribir por tabla a partir de respuestas archivadas.
+
+    Args:
+        records: Lista de (kind, polygon_id, fetched_at, blob)
+
+    Returns:
+        Tuple (dict tabla -> lista de filas, respuestas que no se pudieron leer)
+    """
+    import agro_data_collector as collector
+
+    rows = {table: [] for table in RAW_KINDS.values() if table}
+    images = []
+    failed = 0
+    for kind, polygon_id, fetched_at, blob in records:
+        try:
+            data = load_body(blob)
+            if kind == 'weather':
+                rows['weather_data'].append(collector.observation_row(
+                    collector.parse_weather(data), polygon_id, collector.WEATHER_COLUMNS))
+            elif kind == 'soil':
+                rows['soil_data'].append(collector.observation_row(
+                    collector.parse_soil(data), polygon_id, collector.SOIL_COLUMNS))
+            # Del historial (gap_backfill.py) se cargan todas las observaciones,
+            # no solo las que cayeron en un hueco al consultarlo
+            elif kind == 'weather_history':
+                rows['weather_data'].extend(collector.observation_row(
+                    collector.parse_weather(item), polygon_id, collector.WEATHER_COLUMNS)
+                    for item in data)
+            elif kind == 'soil_history':
+                rows['soil_data'].extend(collector.observation_row(
+                    collector.parse_soil(item), polygon_id, collector.SOIL_COLUMNS)
+                    for item in data)
+            elif kind == 'forecast':
+                rows['forecast_data'].extend(collector.forecast_rows(
+                    collector.parse_forecast(data, issuance_hour(fetched_at)), polygon_id))
+            elif kind == 'ndvi_search':
+                image = collector.select_image(data)
+                if image:
+                    images.append((polygon_id, image))
+        except (ValueError, KeyError, TypeError, IndexError, OSError):
+            failed += 1
+
+    # Las estadísticas de una imagen no cambian: sirve la última copia archivada
+    urls = {clean_url(image['stats'][index])
+            for _, image in images for index in ('ndvi', 'ndwi')
+            if image.get('stats', {}).get(index)}
+    stats = {}
+    if urls:
+        cur.execute("""
+            SELECT DISTINCT ON (r.url) r.url, b.body
+            FROM raw_responses r JOIN raw_blobs b USING (sha256)
+            WHERE r.kind IN ('ndvi_stats', 'ndwi_stats') AND r.url = ANY(%s)
+            ORDER BY r.url, r.fetched_at DESC
+        """, (list(urls),))
+        stats = {url: load_body(blob) for url, blob in cur.fetchall()}
+
+    for polygon_id, image in images:
+        links = image.get('stats', {})
+        ndvi = stats.get(clean_url(links['ndvi'])) if links.get('ndvi') else None
+        ndwi = stats.get(clean_url(links['ndwi'])) if links.get('ndwi') else None
+        try:
+            rows['ndvi_data'].append(collector.observation_row(
+                collector.parse_ndvi(image, ndvi, ndwi), polygon_id, collector.NDVI_COLUMNS))
+        except (ValueError, KeyError, TypeError):
+            failed += 1
+    return rows, failed
+
+
+def reprocess_batch(ids):
+    """
+    Reprocesa un lote de raw_responses en su propia conexión (se ejecuta en
+    un proceso del pool).
+
+    Returns:
+        Dict tabla -> filas escritas, más 'failed'
+    """
+    import agro_data_collector as collector
+    from db_config import get_connection
+
+    conn = get_connection()
+    if not conn:
+        raise RuntimeError("No se pudo conectar a la base de datos")
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT r.kind, r.polygon_id, r.fetched_at, b.body
+            FROM raw_responses r JOIN raw_blobs b USING (sha256)
+            WHERE r.id = ANY(%s)
+            ORDER BY r.id
+        """, (ids,))
+        rows, failed = derive_rows(cur, cur.fetchall())
+
+        specs = {
+            'weather_data': (collector.WEATHER_COLUMNS, collector.OBSERVATION_KEY),
+            'soil_data': (collector.SOIL_COLUMNS, collector.OBSERVATION_KEY),
+            'ndvi_data': (collector.NDVI_COLUMNS, collector.OBSERVATION_KEY),
+            'forecast_data': (collector.FORECAST_COLUMNS, collector.FORECAST_KEY),
+        }
+        written = {'failed': failed}
+        for table, table_rows in rows.items():
+            if table_rows:
+                columns, key = specs[table]
+                cur.executemany(collector.upsert_sql(table, columns, key), table_rows)
+                written[table] = cur.rowcount
+        conn.commit()
+        cur.close()
+        return written
+    finally:
+        conn.close()
+
+
+def reprocess(conn, kinds=None, since=None, until=None,
+              workers=REPROCESS_WORKERS, batch_size=BATCH_SIZE):
+    """
+    Vuelve a derivar las tablas desde el archivo. Los lotes se reparten por
+    id entre `workers` procesos; si dos respuestas dan la misma clave natural
+    con valores distintos, gana la que se escriba al final.
+
+    Returns:
+        Dict tabla -> filas escritas, más 'responses' y 'failed'
+    """
+    kinds = [k for k in (kinds or RAW_KINDS) if RAW_KINDS.get(k)]
+    filters = ["kind = ANY(%s)"]
+    params = [kinds]
+    if since:
+        filters.append("fetched_at >= %s")
+        params.append(since)
+    if until:
+        filters.append("fetched_at < %s")
+        params.append(until)
+
+    cur = conn.cursor()
+    cur.execute(f"SELECT id FROM raw_responses WHERE {' AND '.join(filters)} ORDER BY id", params)
+    ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.commit()
+
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    totals = {'responses': len(ids), 'failed': 0}
+    if not batches:
+        return totals
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        for written in pool.map(reprocess_batch, batches):
+            for table, count in written.items():
+                totals[table] = totals.get(table, 0) + count
+    return totals
+
+
+def archive_stats(conn):
+    """Respuestas, cuerpos únicos y bytes (crudos y comprimidos) por tipo"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT r.kind, COUNT(*), COUNT(DISTINCT r.sha256), MIN(r.fetched_at), MAX(r.fetched_at)
+        FROM raw_responses r
+        GROUP BY r.kind
+        ORDER BY r.kind
+    """)
+    kinds = cur.fetchall()
+    cur.execute("SELECT COUNT(*), SUM(size_bytes), SUM(octet_length(body)) FROM raw_blobs")
+    blobs = cur.fetchone()
+    cur.close()
+    return kinds, blobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivo de respuestas crudas de AgroMonitor")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_re = sub.add_parser('reprocess', help='Vuelve a derivar las tablas desde el archivo')
+    p_re.add_argument('--kind', action='append', choices=[k for k, t in RAW_KINDS.items() if t],
+                      help='Tipo de respuesta (repetible; default: todos)')
+    p_re.add_argument('--since', type=datetime.fromisoformat, help='Desde (fetched_at)')
+    p_re.add_argument('--until', type=datetime.fromisoformat, help='Hasta, exclusivo (fetched_at)')
+    p_re.add_argument('--workers', type=int, default=REPROCESS_WORKERS)
+    p_re.add_argument('--batch', type=int, default=BATCH_SIZE)
+
+    sub.add_parser('stats', help='Tamaño y deduplicación del archivo')
+    args = parser.parse_args()
+
+    from db_config import get_connection
+    conn = get_connection()
+    if not conn:
+        print("[ERROR] No se pudo conectar a la base de datos")
+        return 1
+
+    try:
+        if args.command == 'reprocess':
+            totals = reprocess(conn, args.kind, args.since, args.until, args.workers, args.batch)
+            print(f"[OK] {totals.pop('responses')} respuestas reprocesadas")
+            failed = totals.pop('failed')
+            for table, count in sorted(totals.items()):
+                print(f"  {table}: {count} filas escritas")
+            if failed:
+                print(f"[AVISO] {failed} respuestas no se pudieron interpretar")
+        else:
+            kinds, (blob_count, raw_bytes, stored_bytes) = archive_stats(conn)
+            for kind, responses, unique, first, last in kinds:
+                print(f"  {kind}: {responses} respuestas, {unique} únicas ({first:%Y-%m-%d} - {last:%Y-%m-%d})")
+            if blob_count:
+                print(f"[OK] {blob_count} cuerpos, {raw_bytes / 1e6:.1f} MB crudos, "
+                      f"{stored_bytes / 1e6:.1f} MB comprimidos")
+            else:
+                print("[OK] El archivo está vacío")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
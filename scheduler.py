@@ -9,6 +9,7 @@ from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime
 import logging
+import os
 
 # Configurar logging
 logging.basicConfig(
@@ -19,14 +20,18 @@ logger = logging.getLogger(__name__)
 
 def collect_data_job():
     """Job que ejecuta la recolección de datos"""
-    from agro_data_collector import collect_and_save_all_data
+    from agro_data_collector import collect_all_polygons, collect_and_save_all_data
     
     logger.info("=" * 50)
     logger.info("Iniciando recolección programada de datos...")
     logger.info("=" * 50)
     
     try:
-        result = collect_and_save_all_data()
+        # COLLECT_ALL_POLYGONS=1: todos los polígonos de la cuenta, agrupados por celda
+        if os.environ.get('COLLECT_ALL_POLYGONS') == '1':
+            result = collect_all_polygons()
+        else:
+            result = collect_and_save_all_data()
         if result:
             logger.info("Recolección completada exitosamente")
         else:
@@ -37,6 +42,103 @@ def collect_data_job():
     logger.info(f"Próxima ejecución en 1 hora")
     logger.info("=" * 50 + "\n")
 
+def maintenance_job():
+    """Job diario: particiones, archivo frío, retención y recálculo de agregados"""
+    from db_maintenance import run_maintenance
+
+    try:
+        result = run_maintenance()
+        if result is None:
+            logger.warning("Mantenimiento omitido: sin conexión a la BD")
+            return
+        if result['created']:
+            logger.info(f"Particiones creadas: {', '.join(result['created'])}")
+        for table, month, rows in result['archived']:
+            logger.info(f"Archivado {table} {month:%Y-%m}: {rows} filas")
+        for name, archived in result['removed']:
+            logger.info(f"Partición quitada: {name}" + (f" (archivo: {archived})" if archived else ""))
+    except Exception as e:
+        logger.error(f"Error en mantenimiento: {e}")
+
+def forecast_skill_job():
+    """Job diario: acierto de los pronósticos por anticipación"""
+    from db_config import get_connection
+    from forecast_skill import run_evaluation
+
+    conn = get_connection()
+    if not conn:
+        logger.warning("Evaluación de pronósticos omitida: sin conexión a la BD")
+        return
+    try:
+        results = run_evaluation(conn, save=True)
+        for variable, rows in results.items():
+            summary = ', '.join(f"{r['lead_days']}d mae={r['mae']}" for r in rows)
+            logger.info(f"Acierto {variable}: {summary or 'sin datos'}")
+    except Exception as e:
+        logger.error(f"Error en evaluación de pronósticos: {e}")
+    finally:
+        conn.close()
+
+def backfill_job():
+    """Job diario: rellena huecos de las series horarias desde el historial del API"""
+    from gap_backfill import run_backfill
+
+    try:
+        result = run_backfill()
+        if result is None:
+            logger.warning("Relleno de huecos omitido: sin conexión a la BD o sin API key")
+            return
+        logger.info(f"Huecos: {result['gaps']}, consultas: {result['done']}/{len(result['planned'])}, "
+                    f"filas recuperadas: {result['rows']}")
+        for error in result['errors']:
+            logger.warning(f"Relleno de huecos: {error}")
+    except Exception as e:
+        logger.error(f"Error en relleno de huecos: {e}")
+
+def ndvi_zones_job():
+    """Job diario: estadísticas por zona de las escenas satelitales nuevas y sus compuestos"""
+    import ndvi_zones
+
+    if not ndvi_zones.is_enabled():
+        return
+    from agro_data_collector import load_config
+    from db_config import get_connection
+
+    config = load_config()
+    conn = get_connection()
+    if not config or not conn:
+        logger.warning("NDVI por zona omitido: sin configuración o sin conexión a la BD")
+        return
+    try:
+        for image_time, saved in ndvi_zones.run_zone_stats(conn, config['api_key'], config['polygon_id']):
+            logger.info(f"NDVI por zona: escena {image_time:%Y-%m-%d} ({saved} filas)")
+        for index, window_end, scenes, saved in ndvi_zones.run_composites(conn, config['polygon_id']):
+            logger.info(f"NDVI por zona: compuesto {index} hasta {window_end:%Y-%m-%d} "
+                        f"({scenes} escenas, {saved} filas)")
+    except Exception as e:
+        logger.error(f"Error en NDVI por zona: {e}")
+    finally:
+        conn.close()
+
+def polygon_sync_job():
+    """Job diario: sincroniza el registro de polígonos con /polygons"""
+    from agro_data_collector import load_config
+    from polygon_registry import run_sync
+
+    config = load_config()
+    if not config or not config.get('api_key'):
+        logger.warning("Sincronización de polígonos omitida: sin API key")
+        return
+    try:
+        result = run_sync(config['api_key'])
+        if result is None:
+            logger.warning("Sincronización de polígonos omitida: sin conexión a la BD")
+            return
+        logger.info(f"Polígonos: {len(result['added'])} nuevos, {len(result['updated'])} actualizados, "
+                    f"{len(result['removed'])} eliminados, {result['unchanged']} sin cambios")
+    except Exception as e:
+        logger.error(f"Error sincronizando polígonos: {e}")
+
 def main():
     """Punto de entrada principal del scheduler"""
     print("=" * 60)
@@ -60,6 +162,52 @@ def main():
         next_run_time=datetime.now()  # Ejecutar inmediatamente la primera vez
     )
     
+    # Mantenimiento de particiones una vez al día
+    scheduler.add_job(
+        maintenance_job,
+        trigger=IntervalTrigger(days=1),
+        id='db_maintenance',
+        name='Mantenimiento de particiones diario',
+        replace_existing=True,
+        next_run_time=datetime.now()
+    )
+    
+    # Evaluación de pronósticos una vez al día
+    scheduler.add_job(
+        forecast_skill_job,
+        trigger=IntervalTrigger(days=1),
+        id='forecast_skill',
+        name='Evaluación de pronósticos diaria',
+        replace_existing=True
+    )
+    
+    # Relleno de huecos una vez al día
+    scheduler.add_job(
+        backfill_job,
+        trigger=IntervalTrigger(days=1),
+        id='gap_backfill',
+        name='Relleno de huecos diario',
+        replace_existing=True
+    )
+    
+    # Registro de polígonos una vez al día
+    scheduler.add_job(
+        polygon_sync_job,
+        trigger=IntervalTrigger(days=1),
+        id='polygon_sync',
+        name='Sincronización de polígonos diaria',
+        replace_existing=True
+    )
+    
+    # Estadísticas por zona de las escenas nuevas una vez al día
+    scheduler.add_job(
+        ndvi_zones_job,
+        trigger=IntervalTrigger(days=1),
+        id='ndvi_zones',
+        name='NDVI por zona diario',
+        replace_existing=True
+    )
+    
     logger.info("Scheduler iniciado. Primera ejecución ahora...")
     
     try:
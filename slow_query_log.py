@@ -0,0 +1,136 @@
+"""
+AgroMonitor - Log de consultas lentas
+Registra cada consulta que supera un umbral junto con sus parámetros y, una
+vez por forma de consulta (y luego como máximo cada EXPLAIN_INTERVAL), captura
+su plan con EXPLAIN (ANALYZE, BUFFERS) para ver regresiones de plan a medida
+que crecen los datos.
+
+Variables de entorno:
+    SLOW_QUERY_MS         Umbral en milisegundos (default 200)
+    SLOW_QUERY_LOG        Archivo JSONL donde guardar las entradas (opcional)
+    EXPLAIN_INTERVAL      Segundos mínimos entre planes de la misma forma (default 86400)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from db_config import get_connection
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')
+EXPLAIN_INTERVAL = int(os.environ.get('EXPLAIN_INTERVAL', 86400))
+
+logger = logging.getLogger('agromonitor.slow_query')
+
+# Forma de consulta -> momento del último EXPLAIN
+_last_explain = {}
+_lock = threading.Lock()
+
+
+def sql_text(sql):
+    """SQL como str: execute_values y mogrify de psycopg2 lo pasan como bytes"""
+    if isinstance(sql, bytes):
+        return sql.decode('utf-8', errors='replace')
+    return str(sql)
+
+
+def query_shape(sql):
+    """Identificador de la forma de la consulta (SQL sin espacios extra)"""
+    normalized = ' '.join(sql.split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12], normalized
+
+
+def write_entry(entry):
+    """Agrega la entrada al archivo JSONL, si está configurado"""
+    if SLOW_QUERY_LOG:
+        with _lock:
+            with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, default=str, ensure_ascii=False) + '\n')
+
+
+def should_explain(shape):
+    """True si esta forma no tiene un plan reciente (y lo reserva)"""
+    now = time.time()
+    with _lock:
+        last = _last_explain.get(shape)
+        if last is not None and now - last < EXPLAIN_INTERVAL:
+            return False
+        _last_explain[shape] = now
+        return True
+
+
+def capture_plan(shape, sql, params):
+    """Ejecuta EXPLAIN (ANALYZE, BUFFERS) en una conexión aparte"""
+    conn = get_connection()
+    if not conn:
+        return
+    try:
+        cur = conn.cursor()
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+        plan = '\n'.join(row[0] for row in cur.fetchall())
+        cur.close()
+        conn.rollback()
+
+        entry = {
+            'time': datetime.now().isoformat(),
+            'type': 'plan',
+            'shape': shape,
+            'sql': ' '.join(sql.split()),
+            'params': params,
+            'seq_scan': 'Seq Scan' in plan,
+            'plan': plan
+        }
+        logger.warning("Plan [%s]%s\n%s", shape,
+                       ' (Seq Scan)' if entry['seq_scan'] else '', plan)
+        write_entry(entry)
+    except Exception as e:
+        logger.error("EXPLAIN [%s] falló: %s", shape, e)
+    finally:
+        conn.close()
+
+
+def record(sql, params, elapsed, route=None, explain=True):
+    """
+    Registra la consulta si superó el umbral. El EXPLAIN corre en un hilo de
+    fondo para no sumar latencia a la request. Nunca lanza excepciones: un
+    fallo del log no debe convertir una request correcta en un error.
+
+    Args:
+        sql: SQL con placeholders
+        params: Parámetros enlazados
+        elapsed: Duración en segundos
+        route: Ruta del API que la ejecutó (opcional)
+        explain: False para fuentes donde no aplica EXPLAIN (réplica SQLite)
+    """
+    duration_ms = elapsed * 1000
+    if duration_ms < SLOW_QUERY_MS:
+        return
+    try:
+        _record_slow(sql_text(sql), params, duration_ms, route, explain)
+    except Exception as e:
+        logger.error("No se pudo registrar la consulta lenta: %s", e)
+
+
+def _record_slow(sql, params, duration_ms, route, explain):
+    shape, normalized = query_shape(sql)
+    logger.warning("Consulta lenta [%s] %.1f ms route=%s params=%r: %s",
+                   shape, duration_ms, route, params, normalized)
+    write_entry({
+        'time': datetime.now().isoformat(),
+        'type': 'slow_query',
+        'shape': shape,
+        'route': route,
+        'duration_ms': round(duration_ms, 1),
+        'sql': normalized,
+        'params': params
+    })
+
+    # ANALYZE vuelve a ejecutar la sentencia: solo lecturas
+    is_read = normalized.upper().startswith(('SELECT', 'WITH'))
+    if explain and is_read and should_explain(shape):
+        threading.Thread(target=capture_plan, args=(shape, sql, params), daemon=True).start()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Pruebas del API server - GET condicional (ETag / Last-Modified / 304),
+compresión de respuestas, resolución de los historiales y errores de la
+exportación CSV
+
+Necesita las dependencias de api_server.py (Flask, psycopg2, db_config.py).
+La versión de los datos se simula: no hace falta una base de datos.
+
+Ejecutar: python -m unittest test_api_server
+"""
+
+import gzip
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+try:
+    import api_server
+    from flask import jsonify
+except ImportError:
+    api_server = None
+
+LAST_MODIFIED = datetime(2026, 10, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+VERSION = ('abc123', LAST_MODIFIED)
+
+if api_server is not None:
+    app = api_server.app
+    calls = []
+
+    @app.route('/_test/conditional')
+    @api_server.conditional('weather_data')
+    def conditional_view():
+        calls.append(1)
+        return jsonify({'value': 1})
+
+    @app.route('/_test/body/<int:size>')
+    def body_view(size):
+        return app.response_class('x' * size, mimetype='text/plain')
+
+
+@unittest.skipIf(api_server is None, 'dependencias de api_server.py no disponibles')
+class ConditionalTest(unittest.TestCase):
+
+    def setUp(self):
+        calls.clear()
+        self.client = app.test_client()
+        patches = [
+            mock.patch.object(api_server, 'get_read_db', return_value=object()),
+            mock.patch.object(api_server, 'get_data_version', return_value=VERSION),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_sets_validators(self):
+        response = self.client.get('/_test/conditional')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], 'W/"abc123"')
+        self.assertEqual(response.headers['Last-Modified'], 'Thu, 01 Oct 2026 12:30:15 GMT')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(calls, [1])
+
+    def test_matching_etag_is_304_without_running_the_view(self):
+        response = self.client.get('/_test/conditional', headers={'If-None-Match': 'W/"abc123"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], 'W/"abc123"')
+        self.assertEqual(calls, [])
+
+    def test_other_etag_is_200(self):
+        response = self.client.get('/_test/conditional', headers={'If-None-Match': '"old"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(calls, [1])
+
+    def test_if_modified_since(self):
+        response = self.client.get('/_test/conditional',
+                                   headers={'If-Modified-Since': 'Thu, 01 Oct 2026 12:30:15 GMT'})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/_test/conditional',
+                                   headers={'If-Modified-Since': 'Thu, 01 Oct 2026 12:30:14 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_none_match_takes_precedence(self):
+        response = self.client.get('/_test/conditional', headers={
+            'If-None-Match': '"old"',
+            'If-Modified-Since': 'Thu, 01 Oct 2026 12:30:15 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_without_version_the_view_runs_without_validators(self):
+        with mock.patch.object(api_server, 'get_data_version', return_value=(None, None)):
+            response = self.client.get('/_test/conditional', headers={'If-None-Match': 'W/"abc123"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+
+
+@unittest.skipIf(api_server is None, 'dependencias de api_server.py no disponibles')
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.size = api_server.COMPRESS_MIN_BYTES * 4
+
+    def test_gzip(self):
+        response = self.client.get(f'/_test/body/{self.size}', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), b'x' * self.size)
+
+    @unittest.skipIf(api_server is None or api_server.brotli is None, 'brotli no está instalado')
+    def test_brotli_preferred(self):
+        response = self.client.get(f'/_test/body/{self.size}', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(api_server.brotli.decompress(response.data), b'x' * self.size)
+
+    def test_gzip_without_brotli(self):
+        with mock.patch.object(api_server, 'brotli', None):
+            response = self.client.get(f'/_test/body/{self.size}', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+    def test_identity(self):
+        response = self.client.get(f'/_test/body/{self.size}', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(len(response.data), self.size)
+
+    def test_small_bodies_are_not_compressed(self):
+        size = api_server.COMPRESS_MIN_BYTES - 1
+        response = self.client.get(f'/_test/body/{size}', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+    def test_errors_are_not_compressed(self):
+        response = self.client.get('/_test/missing', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+
+@unittest.skipIf(api_server is None, 'dependencias de api_server.py no disponibles')
+class HistoryResolutionTest(unittest.TestCase):
+
+    def resolution(self, query):
+        with app.test_request_context(f'/api/weather/history?{query}'):
+            return api_server.history_resolution()
+
+    def test_raw_by_default_for_any_range(self):
+        self.assertEqual(self.resolution('days=7'), 'raw')
+        self.assertEqual(self.resolution('days=365'), 'raw')
+
+    def test_rollups_are_opt_in(self):
+        self.assertEqual(self.resolution('days=365&resolution=day'), 'day')
+        self.assertEqual(self.resolution('resolution=hour'), 'hour')
+
+    def test_invalid(self):
+        self.assertIsNone(self.resolution('resolution=week'))
+
+
+
+class FakeCopyCursor:
+    """Cursor que simula COPY: escribe los bloques dados y luego falla si hay error"""
+
+    def __init__(self, blocks, error):
+        self.blocks = blocks
+        self.error = error
+
+    def mogrify(self, query, params):
+        return query.encode('utf-8')
+
+    def copy_expert(self, sql, writer):
+        for block in self.blocks:
+            writer.write(block)
+        if self.error:
+            raise self.error
+
+    def close(self):
+        pass
+
+
+@unittest.skipIf(api_server is None, 'dependencias de api_server.py no disponibles')
+class ExportTest(unittest.TestCase):
+
+    def export(self, blocks, error=None, query='polygon=' + 'a' * 24):
+        conn = mock.Mock()
+        conn.cursor.return_value = FakeCopyCursor(blocks, error)
+        with mock.patch.object(api_server, 'get_connection', return_value=conn), \
+                mock.patch.object(api_server, 'EXPORT_CHUNK_BYTES', 4):
+            return app.test_client().get(f'/api/export/weather?{query}')
+
+    def test_complete_export(self):
+        response = self.export([b'a,b\n', b'1,2\n'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'a,b\n1,2\n')
+
+    def test_failure_before_the_first_chunk_is_500(self):
+        response = self.export([], RuntimeError('relation does not exist'))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json(), {'error': 'relation does not exist'})
+
+    def test_failure_mid_stream_leaves_a_trailer_and_aborts(self):
+        response = self.export([b'a,b\n', b'1,2\n'], RuntimeError('connection\nlost'))
+        self.assertEqual(response.status_code, 200)
+        body = bytearray()
+        with self.assertRaises(RuntimeError):
+            for chunk in response.response:
+                body += chunk
+        self.assertTrue(body.startswith(b'a,b\n1,2\n'))
+        self.assertTrue(body.endswith(b'\n# ERROR: connection lost\n'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Pruebas de cold_archive.py - escritura de los Parquet mensuales
+
+Ejecutar: python -m unittest test_cold_archive
+"""
+
+import tempfile
+import unittest
+from datetime import date, datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import cold_archive
+except ImportError:
+    pa = None
+
+MONTH = date(2026, 1, 1)
+
+
+def hour(h):
+    return datetime(2026, 1, 1, h, tzinfo=timezone.utc)
+
+
+@unittest.skipIf(pa is None, 'pyarrow no está instalado')
+class WritePolygonMonthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.schema = pa.schema([
+            ('id', pa.int64()), ('polygon_id', pa.string()), ('source', pa.string()),
+            ('timestamp', pa.timestamp('us', tz='UTC')), ('temperature_c', pa.float64()),
+        ])
+
+    def write(self, rows):
+        return cold_archive.write_polygon_month(self.base, 'weather_data', 'p1', MONTH, self.schema, rows)
+
+    def read(self, path):
+        table = pq.read_table(f"{self.base}/{path}").sort_by('timestamp')
+        return list(zip(table['timestamp'].to_pylist(), table['temperature_c'].to_pylist()))
+
+    def test_rewriting_the_same_rows_does_not_duplicate(self):
+        rows = [(1, 'p1', 'agromonitoring', hour(0), 20.0), (2, 'p1', 'agromonitoring', hour(1), 21.0)]
+        self.write(rows)
+        path, count = self.write(rows)
+        self.assertEqual(count, 2)
+        self.assertEqual(len(self.read(path)), 2)
+
+    def test_late_rows_are_appended_and_new_values_win(self):
+        self.write([(1, 'p1', 'agromonitoring', hour(0), 20.0), (2, 'p1', 'agromonitoring', hour(1), 21.0)])
+        path, count = self.write([(2, 'p1', 'agromonitoring', hour(1), 22.0),
+                                  (3, 'p1', 'agromonitoring', hour(2), 23.0)])
+        self.assertEqual(count, 3)
+        self.assertEqual(self.read(path), [(hour(0), 20.0), (hour(1), 22.0), (hour(2), 23.0)])
+
+    def test_same_time_from_another_source_is_kept(self):
+        self.write([(1, 'p1', 'agromonitoring', hour(0), 20.0)])
+        path, count = self.write([(2, 'p1', 'sensor', hour(0), 19.5)])
+        self.assertEqual(count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Pruebas de forecast_skill.py - cruce de claves y acierto por anticipación
+
+Ejecutar: python -m unittest test_forecast_skill
+"""
+
+import unittest
+
+try:
+    import numpy as np
+    import forecast_skill
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, 'numpy no está instalado')
+class MatchTest(unittest.TestCase):
+
+    def test_index_of_each_key(self):
+        observed = np.array([30, 10, 20], dtype=np.int64)
+        forecast = np.array([10, 20, 25, 30, 40], dtype=np.int64)
+        self.assertEqual(forecast_skill.match(forecast, observed).tolist(), [1, 2, -1, 0, -1])
+
+    def test_no_observations(self):
+        result = forecast_skill.match(np.array([1, 2], dtype=np.int64), np.array([], dtype=np.int64))
+        self.assertEqual(result.tolist(), [-1, -1])
+
+
+@unittest.skipIf(np is None, 'numpy no está instalado')
+class SkillByLeadTest(unittest.TestCase):
+
+    def test_bias_mae_rmse(self):
+        forecast = np.array([21.0, 19.0, 25.0, 30.0])
+        observed = np.array([20.0, 20.0, 22.0, 26.0])
+        lead = np.array([1, 1, 3, 3])
+        results = forecast_skill.skill_by_lead(forecast, observed, lead)
+        self.assertEqual([r['lead_days'] for r in results], [1, 3])
+        self.assertEqual(results[0], {'lead_days': 1, 'samples': 2, 'bias': 0.0, 'mae': 1.0, 'rmse': 1.0})
+        self.assertEqual(results[1]['bias'], 3.5)
+        self.assertEqual(results[1]['rmse'], round(float(np.sqrt((9 + 16) / 2)), 3))
+
+    def test_nan_pairs_are_skipped(self):
+        forecast = np.array([21.0, np.nan, 25.0])
+        observed = np.array([20.0, 20.0, np.nan])
+        results = forecast_skill.skill_by_lead(forecast, observed, np.array([0, 0, 1]))
+        self.assertEqual(results, [{'lead_days': 0, 'samples': 1, 'bias': 1.0, 'mae': 1.0, 'rmse': 1.0}])
+
+    def test_empty(self):
+        empty = np.array([])
+        self.assertEqual(forecast_skill.skill_by_lead(empty, empty, np.array([], dtype=np.int64)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
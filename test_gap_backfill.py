@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Pruebas de gap_backfill.py - conteo de huecos y planificación de consultas
+
+Ejecutar: python -m unittest test_gap_backfill
+"""
+
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from gap_backfill import Gap, completeness, missing_steps, plan_requests
+
+T0 = datetime(2026, 10, 1, tzinfo=timezone.utc)
+HOUR = timedelta(hours=1)
+
+
+def gap(start_hours, end_hours, table='weather_data', polygon_id='p1'):
+    return Gap(table, polygon_id, 'agromonitoring', T0 + start_hours * HOUR, T0 + end_hours * HOUR)
+
+
+class PlanRequestsTest(unittest.TestCase):
+
+    def test_close_gaps_are_merged(self):
+        (request,) = plan_requests([gap(0, 3), gap(10, 14)], T0, merge_within=12 * HOUR)
+        self.assertEqual((request.start, request.end), (T0, T0 + 14 * HOUR))
+        self.assertEqual(len(request.gaps), 2)
+
+    def test_distant_gaps_are_separate(self):
+        requests_ = plan_requests([gap(0, 3), gap(20, 24)], T0, merge_within=12 * HOUR)
+        self.assertEqual(len(requests_), 2)
+
+    def test_long_gap_is_split(self):
+        requests_ = plan_requests([gap(0, 250)], T0, max_span=100 * HOUR)
+        self.assertEqual([(r.start - T0) / HOUR for r in requests_], [0, 100, 200])
+        self.assertEqual(requests_[-1].end, T0 + 250 * HOUR)
+        self.assertTrue(all(r.end - r.start <= 100 * HOUR for r in requests_))
+
+    def test_merge_respects_max_span(self):
+        requests_ = plan_requests([gap(0, 50), gap(55, 110)], T0,
+                                  merge_within=12 * HOUR, max_span=100 * HOUR)
+        self.assertEqual(len(requests_), 2)
+
+    def test_other_polygon_or_table_is_not_merged(self):
+        requests_ = plan_requests([gap(0, 3), gap(4, 6, polygon_id='p2'),
+                                   gap(5, 8, table='soil_data')], T0)
+        self.assertEqual(len(requests_), 3)
+
+    def test_start_is_clipped_to_the_window(self):
+        (request,) = plan_requests([gap(-5, 3)], T0)
+        self.assertEqual(request.start, T0)
+
+
+class MissingStepsTest(unittest.TestCase):
+
+    def test_uses_the_interval_of_each_table(self):
+        self.assertEqual(missing_steps(gap(0, 5)), 4)
+        self.assertEqual(missing_steps(gap(0, 48, table='soil_data')), 3)
+
+    def test_completeness(self):
+        series = [('weather_data', 'p1', 'agromonitoring'), ('soil_data', 'p1', 'agromonitoring')]
+        rows = completeness(series, [gap(0, 5)], T0, T0 + 10 * 24 * HOUR)
+        by_table = {row['table']: row for row in rows}
+        self.assertEqual(by_table['weather_data']['expected'], 240)
+        self.assertEqual(by_table['weather_data']['missing'], 4)
+        self.assertEqual(by_table['soil_data']['expected'], 20)
+        self.assertEqual(by_table['soil_data']['completeness'], 100.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la ingesta de sensores del API server (validate_reading)
+
+Necesita las dependencias de api_server.py (Flask, psycopg2, db_config.py).
+
+Ejecutar: python -m unittest test_ingest
+"""
+
+import unittest
+from datetime import datetime, timedelta, timezone
+
+try:
+    from api_server import validate_reading
+except ImportError:
+    validate_reading = None
+
+NOW = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def reading(**fields):
+    base = {'device_id': 'sonda-1', 'metric': 'soil_moisture_percent',
+            'timestamp': '2026-10-01T11:00:00Z', 'value': 42}
+    base.update(fields)
+    return base
+
+
+@unittest.skipIf(validate_reading is None, 'dependencias de api_server.py no disponibles')
+class ValidateReadingTest(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual(validate_reading(reading(), NOW), (
+            'sonda-1', 'soil_moisture_percent',
+            datetime(2026, 10, 1, 11, 0, tzinfo=timezone.utc), 42.0))
+
+    def test_epoch_timestamp(self):
+        epoch = int((NOW - timedelta(minutes=5)).timestamp())
+        self.assertEqual(validate_reading(reading(timestamp=epoch), NOW)[2], NOW - timedelta(minutes=5))
+
+    def test_invalid_readings(self):
+        cases = {
+            'not an object': ['x'],
+            'device_id': reading(device_id=''),
+            'long device_id': reading(device_id='x' * 65),
+            'metric': reading(metric='wind_kmh'),
+            'naive timestamp': reading(timestamp='2026-10-01T11:00:00'),
+            'bool timestamp': reading(timestamp=True),
+            'huge epoch': reading(timestamp=1e18),
+            'nan epoch': reading(timestamp=float('nan')),
+            'future': reading(timestamp='2026-10-01T14:00:00Z'),
+            'bool value': reading(value=True),
+            'string value': reading(value='42'),
+            'out of range': reading(value=101),
+        }
+        for label, case in cases.items():
+            with self.subTest(label), self.assertRaises(ValueError):
+                validate_reading(case, NOW)
+
+    def test_clock_skew_tolerance(self):
+        ahead = (NOW + timedelta(minutes=30)).isoformat()
+        self.assertEqual(validate_reading(reading(timestamp=ahead), NOW)[2], NOW + timedelta(minutes=30))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Pruebas de polygon_registry.py - búsqueda de polígonos por ID o nombre
+
+Ejecutar: python -m unittest test_polygon_registry
+"""
+
+import unittest
+
+from polygon_registry import content_hash, find
+
+POLYGONS = [
+    {'id': '69810584a049de7a8d4b4156', 'name': 'Los Valles'},
+    {'id': '69810584a049de7a8d4b4157', 'name': 'El Potrero'},
+    {'id': '69810584a049de7a8d4b4158', 'name': 'potrero '},
+    {'id': '69810584a049de7a8d4b4159', 'name': None},
+]
+
+
+class FindTest(unittest.TestCase):
+
+    def test_by_id(self):
+        self.assertEqual(find(POLYGONS, '69810584a049de7a8d4b4157')['name'], 'El Potrero')
+
+    def test_by_name_ignores_case_and_spaces(self):
+        self.assertEqual(find(POLYGONS, '  los valles')['id'], '69810584a049de7a8d4b4156')
+
+    def test_ambiguous_name(self):
+        polygons = POLYGONS + [{'id': 'x', 'name': 'Los valles'}]
+        self.assertIsNone(find(polygons, 'los valles'))
+
+    def test_unknown(self):
+        self.assertIsNone(find(POLYGONS, 'la loma'))
+        self.assertIsNone(find([], '69810584a049de7a8d4b4156'))
+
+    def test_id_wins_over_name(self):
+        polygons = POLYGONS + [{'id': 'x', 'name': '69810584a049de7a8d4b4156'}]
+        self.assertEqual(find(polygons, '69810584a049de7a8d4b4156')['name'], 'Los Valles')
+
+
+class ContentHashTest(unittest.TestCase):
+
+    def test_ignores_fields_outside_the_registry(self):
+        polygon = {'id': 'a', 'name': 'Finca', 'area': 2.0, 'center': [-81.1, 8.4]}
+        self.assertEqual(content_hash(polygon), content_hash({**polygon, 'user_id': 'u'}))
+        self.assertNotEqual(content_hash(polygon), content_hash({**polygon, 'area': 2.5}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Pruebas de slow_query_log.py - normalización y registro de consultas lentas
+
+Necesita db_config.py (lo importa el módulo para los EXPLAIN).
+
+Ejecutar: python -m unittest test_slow_query_log
+"""
+
+import unittest
+from unittest import mock
+
+try:
+    import slow_query_log
+except ImportError:
+    slow_query_log = None
+
+
+@unittest.skipIf(slow_query_log is None, 'db_config.py no disponible')
+class SlowQueryLogTest(unittest.TestCase):
+
+    def test_bytes_sql_has_the_same_shape(self):
+        sql = "INSERT INTO sensor_readings\n   VALUES (%s, %s)"
+        self.assertEqual(slow_query_log.query_shape(slow_query_log.sql_text(sql.encode())),
+                         slow_query_log.query_shape(sql))
+
+    def test_record_bytes_sql(self):
+        with mock.patch.object(slow_query_log, 'write_entry') as write_entry:
+            slow_query_log.record(b"INSERT INTO t VALUES (1),\n (2)", None, 10.0)
+        entry = write_entry.call_args[0][0]
+        self.assertEqual(entry['sql'], "INSERT INTO t VALUES (1), (2)")
+
+    def test_record_never_raises(self):
+        with mock.patch.object(slow_query_log, 'write_entry', side_effect=OSError('disk full')):
+            slow_query_log.record("UPDATE t SET a = 1", None, 10.0)
+
+    def test_fast_queries_are_ignored(self):
+        with mock.patch.object(slow_query_log, 'write_entry') as write_entry:
+            slow_query_log.record("SELECT 1", None, 0.0)
+        write_entry.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Pruebas de timeseries.py - TimeSeries (resample, rolling, selección)
+
+Ejecutar: python -m unittest test_timeseries
+"""
+
+import math
+import unittest
+
+from timeseries import TimeSeries
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def series(points, columns=('value',)):
+    """Serie a partir de (epoch, valor) con una sola columna"""
+    return TimeSeries(columns, [t for t, _ in points], {columns[0]: [v for _, v in points]})
+
+
+class ResampleTest(unittest.TestCase):
+
+    def test_mean_by_day(self):
+        s = series([(0, 1.0), (HOUR, 3.0), (DAY + HOUR, 10.0)])
+        daily = s.resample(DAY)
+        self.assertEqual(list(daily.times), [0, DAY])
+        self.assertEqual(list(daily['value']), [2.0, 10.0])
+
+    def test_buckets_without_points_are_skipped(self):
+        s = series([(0, 1.0), (3 * DAY, 2.0)])
+        self.assertEqual(list(s.resample(DAY).times), [0, 3 * DAY])
+
+    def test_buckets_align_to_epoch(self):
+        s = series([(DAY + 5 * HOUR, 4.0)])
+        self.assertEqual(list(s.resample(DAY).times), [DAY])
+
+    def test_nan_is_ignored(self):
+        s = series([(0, float('nan')), (HOUR, 5.0), (DAY, float('nan'))])
+        daily = s.resample(DAY, 'mean')
+        self.assertEqual(daily['value'][0], 5.0)
+        self.assertTrue(math.isnan(daily['value'][1]))
+        self.assertEqual(list(s.resample(DAY, 'count')['value']), [1.0, 0.0])
+
+    def test_aggregates(self):
+        s = series([(0, 2.0), (HOUR, 7.0), (2 * HOUR, 4.0)])
+        expected = {'min': 2.0, 'max': 7.0, 'sum': 13.0, 'first': 2.0, 'last': 4.0}
+        for how, value in expected.items():
+            self.assertEqual(s.resample(DAY, how)['value'][0], value, how)
+
+    def test_empty(self):
+        self.assertEqual(len(series([]).resample(DAY)), 0)
+
+
+class TimeSeriesTest(unittest.TestCase):
+
+    def test_append_out_of_order(self):
+        s = series([(HOUR, 1.0)])
+        with self.assertRaises(ValueError):
+            s.append(0, {'value': 2.0})
+
+    def test_between(self):
+        s = series([(0, 1.0), (HOUR, 2.0), (2 * HOUR, 3.0)])
+        self.assertEqual(list(s.between(HOUR, 2 * HOUR)['value']), [2.0])
+        self.assertEqual(list(s.between(start=HOUR)['value']), [2.0, 3.0])
+
+    def test_rolling(self):
+        s = series([(0, 1.0), (HOUR, 2.0), (3 * HOUR, 3.0)])
+        self.assertEqual(list(s.rolling('value', 2 * HOUR, 'sum')), [1.0, 3.0, 3.0])
+
+    def test_dropna_and_dedupe(self):
+        s = series([(0, 1.0), (HOUR, float('nan')), (2 * HOUR, 1.0), (3 * HOUR, 2.0)])
+        self.assertEqual(list(s.dropna('value')['value']), [1.0, 1.0, 2.0])
+        self.assertEqual(list(s.dropna('value').dedupe('value').times), [0, 3 * HOUR])
+
+    def test_from_records_sorts_and_fills_nan(self):
+        s = TimeSeries.from_records(
+            [{'date': HOUR, 'a': 2}, {'date': 0, 'a': None}], ('a',))
+        self.assertEqual(list(s.times), [0, HOUR])
+        self.assertTrue(math.isnan(s['a'][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Pruebas de weather_grid.py - agrupación de polígonos por celda
+
+Ejecutar: python -m unittest test_weather_grid
+"""
+
+import unittest
+
+from weather_grid import cell_of, group_polygons
+
+
+def polygon(polygon_id, lat=None, lon=None):
+    """Polígono con la forma de /polygons (center = [lon, lat])"""
+    return {'id': polygon_id, 'center': [lon, lat] if lat is not None else None}
+
+
+class GroupPolygonsTest(unittest.TestCase):
+
+    def test_nearby_polygons_share_a_group(self):
+        groups = group_polygons([
+            polygon('b', 8.431, -81.191),
+            polygon('a', 8.439, -81.199),
+            polygon('c', 9.5, -80.1),
+        ], cell_degrees=0.1)
+        self.assertEqual(len(groups), 2)
+        members = sorted([p['id'] for p in group.polygons] for group in groups)
+        self.assertEqual(members, [['a', 'b'], ['c']])
+
+    def test_polygons_without_center_are_kept_alone(self):
+        groups = group_polygons([polygon('a', 8.43, -81.19), polygon('x')], cell_degrees=0.1)
+        alone = [group for group in groups if group.cell is None]
+        self.assertEqual(len(alone), 1)
+        self.assertEqual(alone[0].representative['id'], 'x')
+        self.assertEqual(alone[0].polygons, [polygon('x')])
+
+    def test_representative_is_closest_to_the_mean_center(self):
+        members = [
+            polygon('edge1', 8.401, -81.199),
+            polygon('middle', 8.450, -81.150),
+            polygon('edge2', 8.499, -81.101),
+        ]
+        (group,) = group_polygons(members, cell_degrees=0.1)
+        self.assertEqual(group.representative['id'], 'middle')
+
+    def test_cell_boundary_splits_groups(self):
+        self.assertNotEqual(cell_of(8.4999, -81.15, 0.1), cell_of(8.5001, -81.15, 0.1))
+        groups = group_polygons([polygon('a', 8.4999, -81.15), polygon('b', 8.5001, -81.15)],
+                                cell_degrees=0.1)
+        self.assertEqual(len(groups), 2)
+
+    def test_empty(self):
+        self.assertEqual(group_polygons([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+"""
+AgroMonitor - Series temporales compactas
+Contenedor de series para el analizador: los tiempos se guardan como epoch
+en segundos en un array('q') y cada variable en un array('d') (NaN = sin
+dato), así un punto cuesta 8 bytes por columna en vez de un dict con un
+datetime (cientos de bytes). Años de historia de varios polígonos caben en
+memoria sin problema.
+
+Los tiempos van en orden no decreciente (append lo valida), lo que permite
+cortar por rango con búsqueda binaria. Iterar la serie devuelve dicts
+{'date', columna: valor}, la forma que usaba get_ndvi_history.
+"""
+
+import math
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+NAN = float('nan')
+
+# Agregados disponibles en resample() y rolling()
+AGGREGATES = ('mean', 'min', 'max', 'sum', 'count', 'first', 'last')
+
+
+def to_epoch(value) -> int:
+    """Epoch en segundos de un datetime (naive = hora local) o de un número"""
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def to_datetime(epoch: int) -> datetime:
+    """datetime UTC de un epoch en segundos"""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+def aggregate(values: Iterable[float], how: str) -> float:
+    """Agregado de los valores válidos (NaN se ignora; sin valores -> NaN, count -> 0)"""
+    valid = [v for v in values if not math.isnan(v)]
+    if how == 'count':
+        return float(len(valid))
+    if not valid:
+        return NAN
+    if how == 'mean':
+        return math.fsum(valid) / len(valid)
+    if how == 'sum':
+        return math.fsum(valid)
+    if how == 'min':
+        return min(valid)
+    if how == 'max':
+        return max(valid)
+    if how == 'first':
+        return valid[0]
+    if how == 'last':
+        return valid[-1]
+    raise ValueError(f"Agregado desconocido: {how}")
+
+
+class TimeSeries:
+    """Serie temporal con columnas float sobre arrays tipados"""
+
+    __slots__ = ('columns', 'times', '_values')
+
+    def __init__(self, columns: Iterable[str], times: Iterable[int] = (),
+                 values: Optional[Dict[str, Iterable[float]]] = None):
+        self.columns = tuple(columns)
+        self.times = array('q', times)
+        values = values or {}
+        self._values = {c: array('d', values.get(c, [NAN] * len(self.times))) for c in self.columns}
+        for column, data in self._values.items():
+            if len(data) != len(self.times):
+                raise ValueError(f"La columna {column} tiene {len(data)} valores para {len(self.times)} tiempos")
+        if any(a > b for a, b in zip(self.times, self.times[1:])):
+            raise ValueError("Los tiempos deben estar en orden")
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], columns: Iterable[str],
+                     time_key: str = 'date') -> 'TimeSeries':
+        """Serie a partir de dicts (en cualquier orden); None -> NaN"""
+        series = cls(columns)
+        for record in sorted(records, key=lambda r: to_epoch(r[time_key])):
+            series.append(record[time_key], record)
+        return series
+
+    def append(self, time, values: Dict[str, Optional[float]]):
+        """Agrega un punto al final; las columnas que faltan quedan en NaN"""
+        epoch = to_epoch(time)
+        if self.times and epoch < self.times[-1]:
+            raise ValueError("append fuera de orden")
+        self.times.append(epoch)
+        for column, data in self._values.items():
+            value = values.get(column)
+            data.append(NAN if value is None else float(value))
+
+    # ============================================
+    # ACCESO
+    # ============================================
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __getitem__(self, key):
+        """
+        serie['col'] -> array de la columna; serie[i] -> dict del punto;
+        serie[a:b] -> nueva serie
+        """
+        if isinstance(key, str):
+            return self._values[key]
+        if isinstance(key, slice):
+            return TimeSeries(self.columns, self.times[key],
+                              {c: data[key] for c, data in self._values.items()})
+        return self.point(key)
+
+    def __iter__(self):
+        for i in range(len(self.times)):
+            yield self.point(i)
+
+    def __repr__(self) -> str:
+        span = f"{to_datetime(self.times[0]):%Y-%m-%d}..{to_datetime(self.times[-1]):%Y-%m-%d}" if self.times else 'vacía'
+        return f"TimeSeries({len(self)} puntos, {span}, columnas={list(self.columns)})"
+
+    def point(self, i: int) -> Dict:
+        """Punto i como {'date': datetime UTC, columna: valor}"""
+        record = {'date': to_datetime(self.times[i])}
+        for column, data in self._values.items():
+            record[column] = data[i]
+        return record
+
+    def dates(self) -> List[datetime]:
+        return [to_datetime(t) for t in self.times]
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria de los datos (sin el objeto)"""
+        return sum(data.itemsize * len(data) for data in (self.times, *self._values.values()))
+
+    # ============================================
+    # SELECCIÓN
+    # ============================================
+
+    def between(self, start=None, end=None) -> 'TimeSeries':
+        """Puntos con start <= tiempo < end (búsqueda binaria)"""
+        lo = bisect_left(self.times, to_epoch(start)) if start is not None else 0
+        hi = bisect_left(self.times, to_epoch(end)) if end is not None else len(self.times)
+        return self[lo:hi]
+
+    def select(self, indexes: Iterable[int]) -> 'TimeSeries':
+        indexes = list(indexes)
+        return TimeSeries(self.columns, (self.times[i] for i in indexes),
+                          {c: [data[i] for i in indexes] for c, data in self._values.items()})
+
+    def dropna(self, column: str) -> 'TimeSeries':
+        """Sin los puntos donde la columna no tiene dato"""
+        data = self._values[column]
+        return self.select(i for i in range(len(data)) if not math.isnan(data[i]))
+
+    def dedupe(self, column: str) -> 'TimeSeries':
+        """Sin los puntos que repiten el valor del punto anterior en la columna"""
+        data = self._values[column]
+        return self.select(i for i in range(len(data)) if i == 0 or data[i] != data[i - 1])
+
+    # ============================================
+    # VENTANAS
+    # ============================================
+
+    def resample(self, seconds: int, how: str = 'mean') -> 'TimeSeries':
+        """
+        Agrega los puntos en intervalos de `seconds` (alineados a epoch 0,
+        es decir UTC); cada intervalo con datos da un punto en su inicio
+        """
+        result = TimeSeries(self.columns)
+        start = 0
+        while start < len(self.times):
+            bucket = self.times[start] - self.times[start] % seconds
+            end = bisect_left(self.times, bucket + seconds, start)
+            result.append(bucket, {c: aggregate(data[start:end], how)
+                                   for c, data in self._values.items()})
+            start = end
+        return result
+
+    def rolling(self, column: str, seconds: int, how: str = 'mean') -> array:
+        """
+        Agregado de la columna en la ventana (t - seconds, t] de cada punto
+
+        Returns:
+            array('d') alineado con la serie
+        """
+        data = self._values[column]
+        result = array('d')
+        start = 0
+        for i, t in enumerate(self.times):
+            while self.times[start] <= t - seconds:
+                start += 1
+            result.append(aggregate(data[start:i + 1], how))
+        return result
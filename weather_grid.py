@@ -0,0 +1,83 @@
+"""
+AgroMonitor - Agrupación de polígonos por celda meteorológica
+El clima y el pronóstico de Agromonitoring salen de un modelo de grilla
+gruesa: polígonos cercanos caen en la misma celda y reciben los mismos
+datos. Este módulo indexa los centros de los polígonos (campo `center` de
+/polygons) en una grilla regular y agrupa los que comparten celda, para
+consultar /weather y /weather/forecast una vez por grupo y repartir el
+resultado a todos sus polígonos.
+
+El índice es un hash de celdas: la clave es (fila, columna) de la grilla en
+grados, así que armarlo y consultarlo cuesta O(1) por polígono. Dos
+polígonos muy cercanos a ambos lados de un borde de celda quedan en grupos
+distintos; eso solo cuesta una consulta de más, nunca mezcla datos.
+
+Variables de entorno:
+    WEATHER_CELL_DEGREES    Tamaño de la celda en grados (default 0.1, ~11 km)
+"""
+
+import math
+import os
+from collections import namedtuple
+
+CELL_DEGREES = float(os.environ.get('WEATHER_CELL_DEGREES', 0.1))
+
+# Polígonos de una celda; el representativo es el que se consulta al API
+CellGroup = namedtuple('CellGroup', ['cell', 'representative', 'polygons'])
+
+
+def centroid(polygon):
+    """(lat, lon) del centro de un polígono de /polygons (center = [lon, lat]) o None"""
+    center = polygon.get('center')
+    if not center or len(center) < 2:
+        return None
+    return center[1], center[0]
+
+
+def cell_of(lat, lon, cell_degrees=CELL_DEGREES):
+    """Clave (fila, columna) de la celda que contiene el punto"""
+    return math.floor(lat / cell_degrees), math.floor(lon / cell_degrees)
+
+
+def build_index(polygons, cell_degrees=CELL_DEGREES):
+    """
+    Índice celda -> polígonos (ordenados por ID). Los polígonos sin centro
+    no se indexan.
+    """
+    index = {}
+    for polygon in polygons:
+        point = centroid(polygon)
+        if point is not None:
+            index.setdefault(cell_of(*point, cell_degrees), []).append(polygon)
+    for members in index.values():
+        members.sort(key=lambda polygon: polygon['id'])
+    return index
+
+
+def polygons_at(index, lat, lon, cell_degrees=CELL_DEGREES):
+    """Polígonos de la celda que contiene el punto"""
+    return index.get(cell_of(lat, lon, cell_degrees), [])
+
+
+def representative(members):
+    """El polígono más cercano al centro medio del grupo (el dato más típico de la celda)"""
+    points = [centroid(polygon) for polygon in members]
+    lat = sum(point[0] for point in points) / len(points)
+    lon = sum(point[1] for point in points) / len(points)
+    return min(members, key=lambda polygon: (
+        (centroid(polygon)[0] - lat) ** 2 + (centroid(polygon)[1] - lon) ** 2, polygon['id']))
+
+
+def group_polygons(polygons, cell_degrees=CELL_DEGREES):
+    """
+    Agrupa los polígonos por celda.
+
+    Returns:
+        Lista de CellGroup; cada polígono sin centro forma su propio grupo
+        (cell None) para no perder datos
+    """
+    groups = [CellGroup(cell, representative(members), members)
+              for cell, members in sorted(build_index(polygons, cell_degrees).items())]
+    groups.extend(CellGroup(None, polygon, [polygon])
+                  for polygon in polygons if centroid(polygon) is None)
+    return groups